@@ -1,71 +1,163 @@
 # application_layer.py
-import json
+import itertools
+import math
+import threading
+import time
+from concurrent.futures import Future
+
+from messages import Message
+from metrics import NULL_METRICS
+from response_cache import CACHEABLE_METHODS, max_age
+from router import Router
+from timers import default_scheduler
 
 class ApplicationLayer:
     def __init__(self):
         self.presentation_layer = None
-        self.handlers = {}  # Maps HTTP-like methods to handler functions
+        self.router = Router()  # Maps (method, path pattern) to handler functions
+        self.response_handler = None  # Optional callable(response, session_id)
+        self.timers = default_scheduler()
+        self.metrics = NULL_METRICS
+        self.worker_pool = None  # Handlers run inline on the receive thread unless set
+        self.response_cache = None  # ResponseCache for requests we answer, off unless set
+        self.client_cache = None  # ResponseCache for responses to our own requests
+        
+        # Requests in flight, matched to responses by request_id
+        self.request_ids = itertools.count(1)
+        self.pending_requests = {}  # Maps request_id to (Future, timeout timer, client cache key, send time)
+        self.pending_lock = threading.Lock()
     
     def connect_to_presentation_layer(self, presentation_layer):
         self.presentation_layer = presentation_layer
         presentation_layer.connect_to_application_layer(self)
     
     def register_handler(self, method, handler):
-        """Register a handler function for a specific HTTP-like method"""
-        self.handlers[method] = handler
+        """Register a handler function for every path of an HTTP-like method"""
+        self.router.mount('/', handler, [method])
+    
+    def register_route(self, method, pattern, handler):
+        """Register a handler for one path pattern, e.g. '/users/{id}'"""
+        self.router.add_route(method, pattern, handler)
     
-    def create_request(self, method, path, headers=None, body=None):
-        """Create an HTTP-like request"""
+    def mount(self, prefix, handler, methods=None):
+        """Register a handler for every path under prefix"""
+        self.router.mount(prefix, handler, methods)
+    
+    def create_request(self, method, path, headers=None, body=None, request_id=None):
+        """Create an HTTP-like request, serialized by the presentation layer"""
         if headers is None:
             headers = {}
+        if request_id is None:
+            request_id = next(self.request_ids)
         
-        request = {
-            'type': 'request',
-            'method': method,
-            'path': path,
-            'headers': headers,
-            'body': body
-        }
-        
-        return json.dumps(request)
+        return Message.request(method, path, headers, body, request_id)
     
-    def create_response(self, status_code, status_message, headers=None, body=None):
-        """Create an HTTP-like response"""
+    def create_response(self, status_code, status_message, headers=None, body=None, request_id=None):
+        """Create an HTTP-like response, request_id is echoed from the request it answers"""
         if headers is None:
             headers = {}
         
-        response = {
-            'type': 'response',
-            'status_code': status_code,
-            'status_message': status_message,
-            'headers': headers,
-            'body': body
-        }
-        
-        return json.dumps(response)
+        return Message.response(status_code, status_message, headers, body, request_id)
     
-    def send_request(self, method, path, peer_ip, headers=None, body=None):
-        """Send an HTTP-like request to a peer"""
-        request = self.create_request(method, path, headers, body)
+    def send_request(self, method, path, peer_ip, headers=None, body=None, request_id=None, session_id=None):
+        """Send an HTTP-like request to a peer, on the current session unless one is given"""
+        start = time.perf_counter()
+        request = self.create_request(method, path, headers, body, request_id)
+        self.metrics.observe('application.encode', time.perf_counter() - start)
+        self.metrics.count('application.requests_sent')
         
         if self.presentation_layer:
-            return self.presentation_layer.send_to_application(request, peer_ip)
+            return self.presentation_layer.send_to_application(request, peer_ip, session_id)
         
         return False
     
-    def send_response(self, status_code, status_message, peer_ip, headers=None, body=None):
-        """Send an HTTP-like response to a peer"""
-        response = self.create_response(status_code, status_message, headers, body)
+    def submit_request(self, method, path, peer_ip, headers=None, body=None, timeout=None, session_id=None):
+        """Send a request and return a Future that resolves to the response Message.
+        
+        Any number of requests can be in flight at once; responses are matched
+        by request_id in whatever order they arrive. If no response arrives
+        within timeout seconds the Future fails with TimeoutError.
+        """
+        future = Future()
+        
+        # With a client cache, fresh responses are served without a round trip
+        # and stale ones are revalidated by ETag
+        cache_key = None
+        if self.client_cache is not None and method in CACHEABLE_METHODS:
+            cache_key = self.client_cache.key(method, path, headers)
+            entry = self.client_cache.get(cache_key, allow_stale=True)
+            if entry is not None:
+                if entry['expires'] > time.monotonic():
+                    future.set_result(self._cached_response(entry))
+                    return future
+                headers = dict(headers or {}, **{'If-None-Match': entry['etag']})
+        
+        request_id = next(self.request_ids)
+        with self.pending_lock:
+            timer = None
+            if timeout is not None:
+                timer = self.timers.call_later(timeout, self._expire_request, request_id)
+            self.pending_requests[request_id] = (future, timer, cache_key, time.perf_counter())
+        
+        # A caller that cancels stops waiting for the response
+        future.add_done_callback(lambda _: self._forget_request(request_id))
+        
+        if not self.send_request(method, path, peer_ip, headers, body, request_id, session_id):
+            future.set_exception(ConnectionError(f"Could not send {method} {path} to {peer_ip}"))
+        
+        return future
+    
+    def close(self):
+        """Fail every request still waiting for a response, the stack is closing"""
+        self.fail_pending(ConnectionError("Stack closed"))
+    
+    def fail_pending(self, error):
+        """Fail every request still waiting for a response with error"""
+        with self.pending_lock:
+            pending, self.pending_requests = self.pending_requests, {}
+        for future, timer, _, _ in pending.values():
+            if timer is not None:
+                timer.cancel()
+            if not future.done():
+                future.set_exception(error)
+    
+    def _forget_request(self, request_id):
+        with self.pending_lock:
+            entry = self.pending_requests.pop(request_id, None)
+        if entry and entry[1] is not None:
+            entry[1].cancel()
+        return entry
+    
+    def _expire_request(self, request_id):
+        entry = self._forget_request(request_id)
+        if entry and not entry[0].done():
+            self.metrics.count('application.timeouts')
+            entry[0].set_exception(TimeoutError(f"No response to request {request_id}"))
+    
+    @staticmethod
+    def _cached_response(entry, request_id=None):
+        """Rebuild a response from a cache entry"""
+        return Message.response(entry['status_code'], entry['status_message'], dict(entry['headers']),
+                                entry['body'], request_id)
+    
+    def send_response(self, status_code, status_message, peer_ip, headers=None, body=None, request_id=None, session_id=None):
+        """Send an HTTP-like response to a peer, on the session the request came in on if given"""
+        start = time.perf_counter()
+        response = self.create_response(status_code, status_message, headers, body, request_id)
+        self.metrics.observe('application.encode', time.perf_counter() - start)
+        self.metrics.count('application.responses_sent')
         
         if self.presentation_layer:
-            return self.presentation_layer.send_to_application(response, peer_ip)
+            return self.presentation_layer.send_to_application(response, peer_ip, session_id)
         
         return False
     
     def receive_from_presentation(self, data, session_id):
         """Process data received from the presentation layer"""
         try:
-            message = json.loads(data)
+            start = time.perf_counter()
+            message = Message.from_json(data)
+            self.metrics.observe('application.decode', time.perf_counter() - start)
             
             # Determine if this is a request or response
             if message.get('type') == 'request':
@@ -77,6 +169,7 @@ class ApplicationLayer:
                 
         except Exception as e:
             print(f"Application layer error: {e}")
+            self.metrics.count('application.dropped.error')
     
     def _handle_request(self, request, session_id):
         """Handle an incoming HTTP-like request"""
@@ -84,29 +177,101 @@ class ApplicationLayer:
         path = request.get('path', '')
         
         print(f"Request received: {method} {path}")
+        self.metrics.count('application.requests_received')
+        
+        # Get peer IP from the session
+        peer_ip = "unknown"
+        if self.presentation_layer and self.presentation_layer.session_layer:
+            peer_ip = self.presentation_layer.session_layer.peer_of(session_id) or peer_ip
         
-        # Find a handler for this method
-        if method in self.handlers:
-            # Call the handler with the request
-            response = self.handlers[method](request)
+        request_id = request.get('request_id')
+        
+        # Responses go back on the session the request came in on, so each
+        # of the peer's sessions gets its own answers
+        request['session_id'] = session_id
+        
+        # Idempotent requests may be answered from the cache, anything else
+        # may change the resource so its cached responses are dropped
+        cache_key = None
+        if self.response_cache is not None:
+            if method in CACHEABLE_METHODS:
+                cache_key = self.response_cache.key(method, path, request.get('headers'))
+                entry = self.response_cache.get(cache_key)
+                if entry is not None:
+                    self._send_cached_response(entry, request, peer_ip)
+                    return
+            else:
+                self.response_cache.invalidate(path)
+        
+        # Find a handler for this method and path
+        handler, params = self.router.resolve(method, path)
+        if handler is None:
+            print(f"No handler for {method} {path}")
+            self.metrics.count('application.not_found')
+            self.send_response(404, 'Not Found', peer_ip, None, 'Resource not found', request_id, session_id)
+            return
+        
+        # Call the handler with the request and its path parameters
+        request['params'] = params
+        start = time.perf_counter()
+        if self.worker_pool is None:
+            response = handler(request)
+            self.metrics.observe('application.handler', time.perf_counter() - start)
+            self._send_handler_response(response, peer_ip, request, cache_key)
+            return
+        
+        # Hand the handler to the pool, the response is sent when it completes
+        future = self.worker_pool.try_submit(handler, request)
+        if future is None:
+            print(f"Worker pool saturated, rejecting {method} {path}")
+            self.metrics.count('application.rejected')
+            self.send_response(503, 'Service Unavailable', peer_ip, None, 'Server overloaded, retry later', request_id, session_id)
+            return
+        future.add_done_callback(lambda done: self._complete_request(done, peer_ip, request, cache_key, start))
+    
+    def _complete_request(self, future, peer_ip, request, cache_key=None, started=None):
+        """Send the response of a handler that ran in the worker pool"""
+        # Handler time here includes any wait in the pool queue
+        if started is not None:
+            self.metrics.observe('application.handler', time.perf_counter() - started)
+        try:
+            response = future.result()
+        except Exception as e:
+            print(f"Handler error: {e}")
+            self.metrics.count('application.handler_errors')
+            response = (500, 'Internal Server Error', None, str(e))
+        self._send_handler_response(response, peer_ip, request, cache_key)
+    
+    def _send_handler_response(self, response, peer_ip, request, cache_key=None):
+        # Send the response
+        if isinstance(response, tuple) and len(response) >= 2:
+            status_code, status_message = response[0], response[1]
+            headers = response[2] if len(response) > 2 else None
+            body = response[3] if len(response) > 3 else None
             
-            # Get peer IP from the session
-            peer_ip = "unknown"
-            if self.presentation_layer and self.presentation_layer.session_layer:
-                if session_id in self.presentation_layer.session_layer.sessions:
-                    peer_ip = self.presentation_layer.session_layer.sessions[session_id]['peer_ip']
+            # Successful idempotent responses are stored and carry an ETag
+            if cache_key is not None and status_code == 200:
+                entry = self.response_cache.put(cache_key, status_code, status_message, headers, body)
+                if entry is not None:
+                    self._send_cached_response(entry, request, peer_ip)
+                    return
             
-            # Send the response
-            if isinstance(response, tuple) and len(response) >= 2:
-                status_code, status_message = response[0], response[1]
-                headers = response[2] if len(response) > 2 else None
-                body = response[3] if len(response) > 3 else None
-                
-                self.send_response(status_code, status_message, peer_ip, headers, body)
-            else:
-                print("Invalid response format from handler")
+            self.send_response(status_code, status_message, peer_ip, headers, body, request.get('request_id'), request.get('session_id'))
         else:
-            print(f"No handler for method: {method}")
+            print("Invalid response format from handler")
+    
+    def _send_cached_response(self, entry, request, peer_ip):
+        """Answer from a cache entry, with a bodiless 304 if the peer already has it"""
+        request_headers = request.get('headers') or {}
+        remaining = max(math.ceil(entry['expires'] - time.monotonic()), 0)
+        headers = {'ETag': entry['etag'], 'Cache-Control': f'max-age={remaining}'}
+        
+        if self.response_cache.matches(entry, request_headers.get('If-None-Match')):
+            self.send_response(304, 'Not Modified', peer_ip, headers, None, request.get('request_id'), request.get('session_id'))
+            return
+        
+        headers = dict(entry['headers'], **headers)
+        self.send_response(entry['status_code'], entry['status_message'], peer_ip, headers, entry['body'], request.get('request_id'), request.get('session_id'))
     
     def _handle_response(self, response, session_id):
         """Handle an incoming HTTP-like response"""
@@ -116,5 +281,32 @@ class ApplicationLayer:
         
         print(f"Response received: {status_code} {status_message}")
         print(f"Body: {body}")
+        self.metrics.count('application.responses_received')
+        
+        # Resolve the Future of the request this response answers
+        entry = self._forget_request(response.get('request_id'))
+        if entry:
+            self.metrics.observe('application.round_trip', time.perf_counter() - entry[3])
+        if entry and entry[2] is not None:
+            response = self._update_client_cache(entry[2], response)
+        if entry and not entry[0].done():
+            entry[0].set_result(response)
+        
+        # Hand the parsed response to whoever else is listening
+        if self.response_handler:
+            self.response_handler(response, session_id)
+    
+    def _update_client_cache(self, cache_key, response):
+        """Store a cacheable response, or expand a 304 into the cached one"""
+        headers = response.get('headers') or {}
+        ttl = max_age(headers, 0)
         
-        # Additional response handling logic would go here
+        if response.get('status_code') == 304:
+            entry = self.client_cache.get(cache_key, allow_stale=True)
+            if entry is not None:
+                if ttl is not None:
+                    self.client_cache.refresh(entry, ttl)
+                return self._cached_response(entry, response.get('request_id'))
+        elif response.get('status_code') == 200 and (headers.get('ETag') or ttl):
+            self.client_cache.put(cache_key, 200, response.get('status_message'), headers, response.get('body'), 0)
+        return response
@@ -0,0 +1,53 @@
+# async_osi_stack.py
+import asyncio
+
+from osi_stack import OSIStack
+from async_physical_layer import AsyncPhysicalLayer
+from timers import AsyncioTimerScheduler
+from wire_format import WIRE_FORMAT_BINARY
+
+class AsyncOSIStack(OSIStack):
+    """OSIStack driven by an asyncio event loop.
+    
+    The data link through application layers are reused as-is: they only do
+    CPU work and end in a buffered write, so they run inline on the loop. No
+    threads are started, so a single loop can drive many stacks at once.
+    """
+    physical_layer_class = AsyncPhysicalLayer
+    
+    def __init__(self, is_server=False, host='127.0.0.1', port=12345, mac_address='00:00:00:00:00:01', ip_address='192.168.1.1', wire_format=WIRE_FORMAT_BINARY, multi_client=False, physical_layer=None, metrics=None, link='tcp'):
+        # ConnectionServer serves its clients from a selector thread of its
+        # own, there is no asyncio version of it
+        if multi_client:
+            raise ValueError("AsyncOSIStack serves a single connection, use OSIStack for multi_client")
+        # The loopback hub delivers frames on a thread of its own and its
+        # layers have no coroutines to await
+        if physical_layer is None and link == 'loopback':
+            raise ValueError("AsyncOSIStack needs a socket link, use OSIStack for link='loopback'")
+        super().__init__(is_server, host, port, mac_address, ip_address, wire_format, multi_client, physical_layer, metrics, link)
+    
+    async def initialize(self):
+        """Start listening or connect to the server"""
+        # Retransmission, request, session expiry and MAC aging timers run on
+        # this loop instead of the shared timer thread
+        timers = AsyncioTimerScheduler(asyncio.get_running_loop())
+        self.transport.timers = timers
+        self.application.timers = timers
+        self.session.sessions.timers = timers
+        self.data_link.mac_table.timers = timers
+        await self.physical.initialize()
+    
+    async def wait_connected(self):
+        """Wait until the physical layer has a peer"""
+        await self.physical.wait_connected()
+    
+    async def send_request(self, method, path, peer_ip, headers=None, body=None, timeout=None, session_id=None):
+        """Send an HTTP-like request and return the parsed response"""
+        future = self.application.submit_request(method, path, peer_ip, headers, body, timeout, session_id)
+        await self.physical.drain()
+        return await asyncio.wrap_future(future)
+    
+    async def close(self):
+        """Shut down the stack"""
+        self.stop_timers()
+        await self.physical.close()
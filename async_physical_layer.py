@@ -0,0 +1,137 @@
+# async_physical_layer.py
+import asyncio
+import threading
+
+from metrics import NULL_METRICS
+from physical_layer import LENGTH_PREFIX, MAX_FRAME_SIZE, frame_buffers
+
+class AsyncPhysicalLayer:
+    """Physical layer built on asyncio streams instead of sockets and threads.
+    
+    It keeps the PhysicalLayer contract (connect_to_data_link_layer, send_data,
+    close) so the upper layers are unchanged, but all I/O runs on one event
+    loop: send_data only buffers the frame on the stream writer and drain()
+    waits for the transport to flush it.
+    """
+    
+    def __init__(self, is_server=False, host='127.0.0.1', port=12345):
+        self.is_server = is_server
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+        self.connected = False
+        self.data_link_layer = None
+        self.server = None  # asyncio.Server while listening
+        self.loop = None
+        self.loop_thread_id = None
+        self.receive_task = None
+        self.connection_made = None  # Event set once a peer is connected
+        self.metrics = NULL_METRICS
+    
+    def connect_to_data_link_layer(self, data_link_layer):
+        self.data_link_layer = data_link_layer
+    
+    async def initialize(self):
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread_id = threading.get_ident()
+        self.connection_made = asyncio.Event()
+        
+        if self.is_server:
+            self.server = await asyncio.start_server(self._accept_connection, self.host, self.port)
+            print(f"Server listening on {self.host}:{self.port}")
+        else:
+            reader, writer = await asyncio.open_connection(self.host, self.port)
+            print(f"Connected to {self.host}:{self.port}")
+            self._attach(reader, writer)
+    
+    async def _accept_connection(self, reader, writer):
+        """Accept a client connection, only one peer per stack like PhysicalLayer"""
+        addr = writer.get_extra_info('peername')
+        if self.connected:
+            print(f"Already connected, rejecting connection from {addr}")
+            writer.close()
+            return
+        
+        print(f"Connection from {addr}")
+        self._attach(reader, writer)
+    
+    def _attach(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.connected = True
+        self.connection_made.set()
+        self.receive_task = self.loop.create_task(self.receive_data())
+    
+    async def wait_connected(self):
+        await self.connection_made.wait()
+    
+    def send_data(self, data):
+        # Convert data to bitstream (bytes), joining a frame given as buffers
+        bit_data = b''.join(frame_buffers(data))
+        
+        if not (self.connected and self.writer):
+            print("Cannot send data: not connected")
+            self.metrics.count('physical.dropped.not_connected')
+            return
+        
+        frame = LENGTH_PREFIX.pack(len(bit_data)) + bit_data
+        self.metrics.count('physical.frames_sent')
+        self.metrics.count('physical.bytes_sent', len(frame))
+        if threading.get_ident() == self.loop_thread_id:
+            self.writer.write(frame)
+        else:
+            # Stream writers may only be used from the loop's own thread
+            self.loop.call_soon_threadsafe(self.writer.write, frame)
+    
+    def flush(self):
+        """Nothing to do, the stream writer sends on the loop's next turn"""
+    
+    async def drain(self):
+        """Wait until buffered frames have been handed to the transport"""
+        if self.connected and self.writer:
+            await self.writer.drain()
+    
+    async def receive_data(self):
+        try:
+            while self.connected:
+                length_bytes = await self.reader.readexactly(LENGTH_PREFIX.size)
+                data_length = LENGTH_PREFIX.unpack(length_bytes)[0]
+                if data_length > MAX_FRAME_SIZE:
+                    raise ConnectionError(f"Frame of {data_length} bytes is over the {MAX_FRAME_SIZE} byte limit")
+                received_data = await self.reader.readexactly(data_length)
+                self.metrics.count('physical.frames_received')
+                self.metrics.count('physical.bytes_received', data_length + LENGTH_PREFIX.size)
+                
+                if self.data_link_layer:
+                    self.data_link_layer.receive_from_physical(received_data)
+        
+        except asyncio.IncompleteReadError:
+            print("Peer closed the connection")
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"Physical layer receive error: {e}")
+            self.reset()  # The stream cannot be read past this point
+        self.connected = False
+    
+    def reset(self):
+        """Drop the connection without flushing, the receive task then ends"""
+        self.connected = False
+        if not self.writer:
+            return
+        if threading.get_ident() == self.loop_thread_id:
+            self.writer.transport.abort()
+        else:
+            self.loop.call_soon_threadsafe(self.writer.transport.abort)
+    
+    async def close(self):
+        self.connected = False
+        if self.receive_task and self.receive_task is not asyncio.current_task():
+            self.receive_task.cancel()
+        if self.writer:
+            self.writer.close()
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+        print("Physical connection closed")
@@ -0,0 +1,207 @@
+# benchmarks.py
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import socket
+import sys
+import time
+import timeit
+
+from application_layer import ApplicationLayer
+from data_link_layer import DataLinkLayer
+from integrity import ALGORITHMS
+from messages import Message
+from network_layer import NetworkLayer
+from osi_stack import OSIStack
+from presentation_layer import PresentationLayer
+from transport_layer import TransportLayer
+from wire_format import WireCodec
+
+PAYLOAD_SIZES = (64, 1024, 16384, 262144)
+
+def measure(func, *args, repeat=3):
+    """Seconds per call of func(*args), best of repeat runs of at least 0.2s"""
+    timer = timeit.Timer(lambda: func(*args))
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def result(value, unit, better='lower'):
+    return {'value': round(value, 3), 'unit': unit, 'better': better}
+
+
+def bench_layers(sizes):
+    """Encode and decode cost of each layer on its own, in microseconds per call"""
+    results = {}
+    codec = WireCodec()
+    data_link = DataLinkLayer('00:00:00:00:00:01', codec)
+    network = NetworkLayer('192.168.1.1', codec)
+    transport = TransportLayer(codec)
+    presentation = PresentationLayer()
+    application = ApplicationLayer()
+    
+    # The zlib variant needs a peer that has advertised it
+    presentation.peer_codecs['peer'] = set(presentation.supported_codecs())
+    
+    for size in sizes:
+        payload = os.urandom(size // 2).hex().encode()  # Compressible but not trivially
+        text = payload.decode()
+        
+        # Units are encoded to lists of buffers, joined here as they arrive
+        encode_frame = lambda data: codec.encode_frame(data_link.create_frame(data, '00:00:00:00:00:01'))
+        encode_packet = lambda data: codec.encode_packet(network.create_packet(data, '192.168.1.1'))
+        encode_segment = lambda data: codec.encode_segment(transport.create_segment(data))
+        frame = b''.join(encode_frame(payload))
+        packet = b''.join(encode_packet(payload))
+        segment = b''.join(encode_segment(payload))
+        envelope = presentation.encode(text)
+        envelope_zlib = presentation.encode(text, None, 'peer')
+        request = application.create_request('POST', '/bench', None, text).to_json()
+        
+        cases = {
+            'data_link.encode': (encode_frame, payload),
+            'data_link.decode': (data_link.receive_from_physical, frame),
+            'network.encode': (encode_packet, payload),
+            'network.decode': (codec.decode_packet, packet),
+            'transport.encode': (encode_segment, payload),
+            'transport.decode': (codec.decode_segment, segment),
+            'stack.encode': (lambda: encode_frame(network.create_packet(transport.create_segment(payload), '192.168.1.1')),),
+            'presentation.encode': (presentation.encode, text),
+            'presentation.decode': (presentation.decode, envelope),
+            'presentation.encode_zlib': (presentation.encode, text, None, 'peer'),
+            'presentation.decode_zlib': (presentation.decode, envelope_zlib),
+            'application.encode': (lambda: application.create_request('POST', '/bench', None, text).to_json(),),
+            'application.decode': (Message.from_json, request)
+        }
+        for name, algorithm in ALGORITHMS.items():
+            cases[f"integrity.{name}"] = (algorithm.compute, payload)
+        for name, (func, *args) in cases.items():
+            results[f"{name}[{size}]"] = result(measure(func, *args) * 1e6, 'us')
+    return results
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def bench_end_to_end(requests, body_size, link='tcp'):
+    """Lock-step latency and pipelined throughput between two stacks on one host"""
+    port = free_port()
+    server = OSIStack(is_server=True, port=port, link=link)
+    server.add_route('192.168.1.2', '00:00:00:00:00:02')
+    server.register_route('POST', '/echo', lambda request: (200, 'OK', None, request['body']))
+    server.initialize()
+    time.sleep(0.1)
+    
+    client = OSIStack(port=port, mac_address='00:00:00:00:00:02', ip_address='192.168.1.2', link=link)
+    client.add_route('192.168.1.1', '00:00:00:00:00:01')
+    client.initialize()
+    
+    body = 'x' * body_size
+    try:
+        # Warm up the connection and the RTT estimate
+        for _ in range(10):
+            client.submit_request('POST', '/echo', '192.168.1.1', body=body, timeout=10).result()
+        
+        latencies = []
+        for _ in range(requests):
+            start = time.perf_counter()
+            client.submit_request('POST', '/echo', '192.168.1.1', body=body, timeout=10).result()
+            latencies.append(time.perf_counter() - start)
+        
+        start = time.perf_counter()
+        futures = [client.submit_request('POST', '/echo', '192.168.1.1', body=body, timeout=30) for _ in range(requests)]
+        for future in futures:
+            future.result()
+        elapsed = time.perf_counter() - start
+    finally:
+        client.close()
+        server.close()
+        time.sleep(0.2)  # Let receive threads and pending timers wind down
+    
+    prefix = f"end_to_end[{body_size}]" if link == 'tcp' else f"end_to_end_{link}[{body_size}]"
+    return {
+        f"{prefix}.latency_p50": result(percentile(latencies, 0.5) * 1000, 'ms'),
+        f"{prefix}.latency_p99": result(percentile(latencies, 0.99) * 1000, 'ms'),
+        f"{prefix}.throughput": result(requests / elapsed, 'req/s', 'higher')
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Print each result next to the baseline, returns the names that regressed"""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None or not previous['value']:
+            print(f"{name:45} {current['value']:>12} {current['unit']:6} (new)")
+            continue
+        
+        change = (current['value'] - previous['value']) / previous['value']
+        worse = change > tolerance if current['better'] == 'lower' else change < -tolerance
+        marker = 'REGRESSION' if worse else ''
+        print(f"{name:45} {current['value']:>12} {current['unit']:6} {change:+8.1%} {marker}")
+        if worse:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark each layer and the full stack')
+    parser.add_argument('--output', help='where to write the results, they are only printed if not given')
+    # Timings only mean something on the machine that took them, so there is
+    # no shared baseline: compare against one saved earlier on this machine
+    parser.add_argument('--baseline', help='results of an earlier run to compare against, nothing is compared if not given')
+    parser.add_argument('--save-baseline', metavar='PATH', help='also store these results as a baseline at PATH')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown before a result counts as a regression')
+    parser.add_argument('--quick', action='store_true', help='fewer payload sizes and requests')
+    args = parser.parse_args(argv)
+    
+    sizes = PAYLOAD_SIZES[:2] if args.quick else PAYLOAD_SIZES
+    requests = 100 if args.quick else 500
+    
+    # The layers log every message, keep that out of the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = bench_layers(sizes)
+        for link in ('tcp', 'loopback'):
+            for body_size in (64, 16384):
+                results.update(bench_end_to_end(requests, body_size, link))
+    
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': results
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+    regressions = compare(results, baseline, args.tolerance)
+    
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.save_baseline}")
+    
+    if regressions:
+        print(f"{len(regressions)} regression(s) beyond {args.tolerance:.0%}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
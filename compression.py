@@ -0,0 +1,56 @@
+# compression.py
+import bz2
+import lzma
+import zlib
+
+class CompressionCodec:
+    """A named one-shot compressor/decompressor pair"""
+    
+    def __init__(self, name, compress, decompress):
+        self.name = name
+        self.compress = compress
+        self.decompress = decompress
+
+
+class ZlibStream:
+    """Per-session zlib context shared by every message of the session.
+    
+    Each message is sync-flushed, so it can be decompressed as soon as it
+    arrives, while the sliding window keeps earlier messages as a dictionary
+    for later ones. Messages must be decompressed in the order they were
+    compressed. The transport does not keep that order across the messages
+    of a session, the session layer's reorder buffer does, so a decoder
+    only ever sees a session's messages in sequence.
+    """
+    name = 'zlib-stream'
+    
+    def __init__(self, level=6):
+        self.compressor = zlib.compressobj(level)
+        self.decompressor = zlib.decompressobj()
+    
+    def compress(self, data):
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+    
+    def decompress(self, data):
+        return self.decompressor.decompress(data)
+
+
+# Maps the codec name recorded in the presentation envelope to its codec
+CODECS = {}
+
+def register_codec(codec):
+    """Make a codec available for encoding and decoding"""
+    CODECS[codec.name] = codec
+
+register_codec(CompressionCodec('none', bytes, bytes))
+register_codec(CompressionCodec('zlib', zlib.compress, zlib.decompress))
+register_codec(CompressionCodec('lzma', lzma.compress, lzma.decompress))
+register_codec(CompressionCodec('bz2', bz2.compress, bz2.decompress))
+
+
+def is_compressible(data, sample_size=4096, max_ratio=0.9):
+    """Cheaply estimate whether compressing data is worth it from a fast zlib pass over a sample"""
+    sample = data[:sample_size]
+    if not sample:
+        return False
+    return len(zlib.compress(sample, 1)) < len(sample) * max_ratio
@@ -0,0 +1,199 @@
+# connection_pool.py
+import itertools
+import threading
+from concurrent.futures import Future, InvalidStateError
+
+from osi_stack import OSIStack
+from response_cache import ResponseCache
+
+POOL_STRATEGIES = ('least_outstanding', 'round_robin')
+
+class PooledConnection:
+    """One client stack in the pool and the requests it has in flight"""
+    __slots__ = ('stack', 'address', 'outstanding')
+    
+    def __init__(self, stack, address):
+        self.stack = stack
+        self.address = address
+        self.outstanding = set()  # Futures of requests not answered yet
+    
+    @property
+    def alive(self):
+        return self.stack.physical.connected
+
+
+class ConnectionPool:
+    """Client that spreads requests over several connections to one or more servers.
+    
+    Every connection is a full client OSIStack with its own socket, receive
+    thread and transport state, so a large transfer on one link does not hold
+    up requests on the others. The servers must be multi_client stacks, and
+    with several addresses they are expected to serve the same routes. Dead
+    connections are replaced in the background, and the pool grows up to
+    max_size while every connection has grow_threshold requests in flight.
+    """
+    
+    def __init__(self, addresses, size=2, max_size=8, strategy='least_outstanding', grow_threshold=4, health_interval=1.0, **stack_options):
+        if strategy not in POOL_STRATEGIES:
+            raise ValueError(f"Unknown pool strategy: {strategy}")
+        if not addresses:
+            raise ValueError("A connection pool needs at least one server address")
+        self.addresses = list(addresses)  # (host, port) pairs, used in turn
+        self.size = min(size, max_size)  # Connections kept open at all times
+        self.max_size = max_size
+        self.strategy = strategy
+        self.grow_threshold = grow_threshold
+        self.health_interval = health_interval
+        self.stack_options = stack_options  # Passed on to every OSIStack
+        self.routes = {}  # Applied to every connection, including replacements
+        self.client_cache = None  # Shared by every connection when enabled
+        
+        self.connections = []
+        self.address_turn = itertools.count()
+        self.request_turn = itertools.count()
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()  # Asks the maintenance thread to run early
+        self.closed = False
+        self.maintainer = None  # Maintenance thread, joined by close()
+    
+    def add_route(self, destination_ip, next_hop_mac):
+        """Add a route to every connection in the pool"""
+        with self.lock:
+            self.routes[destination_ip] = next_hop_mac
+            stacks = [connection.stack for connection in self.connections]
+        for stack in stacks:
+            stack.add_route(destination_ip, next_hop_mac)
+    
+    def enable_client_cache(self, max_entries=1024, max_bytes=16 * 1024 * 1024, vary_headers=()):
+        """Share one client response cache between all connections"""
+        self.client_cache = ResponseCache(max_entries, max_bytes, 0, vary_headers)
+        with self.lock:
+            for connection in self.connections:
+                connection.stack.application.client_cache = self.client_cache
+    
+    def initialize(self):
+        """Open the initial connections and start the maintenance thread"""
+        for _ in range(self.size):
+            self._add_connection()
+        self.maintainer = threading.Thread(target=self._maintain, name='pool', daemon=True)
+        self.maintainer.start()
+    
+    def _add_connection(self):
+        host, port = self.addresses[next(self.address_turn) % len(self.addresses)]
+        stack = OSIStack(host=host, port=port, **self.stack_options)
+        for destination_ip, next_hop_mac in list(self.routes.items()):
+            stack.add_route(destination_ip, next_hop_mac)
+        stack.application.client_cache = self.client_cache
+        
+        try:
+            stack.initialize()
+        except OSError as e:
+            print(f"Pool could not connect to {host}:{port}: {e}")
+            return False
+        
+        # close() may have swept the pool while this stack was connecting
+        with self.lock:
+            if not self.closed:
+                self.connections.append(PooledConnection(stack, (host, port)))
+                return True
+        stack.close()
+        return False
+    
+    def _acquire(self):
+        """Pick the connection for the next request, None if none is alive"""
+        with self.lock:
+            live = [connection for connection in self.connections if connection.alive]
+            if len(live) < len(self.connections):
+                self.wakeup.set()
+            if not live:
+                return None
+            
+            if self.strategy == 'round_robin':
+                return live[next(self.request_turn) % len(live)]
+            
+            connection = min(live, key=lambda candidate: len(candidate.outstanding))
+            if len(connection.outstanding) >= self.grow_threshold and len(self.connections) < self.max_size:
+                self.wakeup.set()
+            return connection
+    
+    def submit_request(self, method, path, peer_ip, headers=None, body=None, timeout=None):
+        """Send a request on one of the connections, returns a Future for the parsed response"""
+        connection = self._acquire()
+        if connection is None:
+            future = Future()
+            future.set_exception(ConnectionError("No live connection in the pool"))
+            return future
+        
+        future = connection.stack.submit_request(method, path, peer_ip, headers, body, timeout)
+        with self.lock:
+            connection.outstanding.add(future)
+        future.add_done_callback(lambda done: self._release(connection, done))
+        return future
+    
+    def send_request(self, method, path, peer_ip, headers=None, body=None):
+        """Send a request without waiting for its response"""
+        connection = self._acquire()
+        if connection is None:
+            return False
+        return connection.stack.send_request(method, path, peer_ip, headers, body)
+    
+    def _release(self, connection, future):
+        with self.lock:
+            connection.outstanding.discard(future)
+    
+    def _maintain(self):
+        """Replace dead connections and grow the pool while it is busy"""
+        while not self.closed:
+            self.wakeup.wait(self.health_interval)
+            self.wakeup.clear()
+            if self.closed:
+                break
+            
+            with self.lock:
+                dead = [connection for connection in self.connections if not connection.alive]
+                for connection in dead:
+                    self.connections.remove(connection)
+                live = len(self.connections)
+                busy = live and all(len(connection.outstanding) >= self.grow_threshold for connection in self.connections)
+            
+            for connection in dead:
+                self._retire(connection)
+            
+            wanted = self.size - live
+            if busy and live < self.max_size:
+                wanted = max(wanted, 1)
+            for _ in range(wanted):
+                if not self._add_connection():
+                    break  # Try again on the next round
+    
+    def _retire(self, connection):
+        """Fail the requests of a dead connection and close it"""
+        host, port = connection.address
+        print(f"Pool connection to {host}:{port} lost, replacing it")
+        with self.lock:
+            outstanding = list(connection.outstanding)
+        for future in outstanding:
+            try:
+                future.set_exception(ConnectionError(f"Connection to {host}:{port} lost"))
+            except InvalidStateError:
+                pass  # Answered in the meantime
+        connection.stack.close()
+    
+    def stats(self):
+        """State of every connection in the pool"""
+        with self.lock:
+            return [
+                {'address': connection.address, 'alive': connection.alive, 'outstanding': len(connection.outstanding)}
+                for connection in self.connections
+            ]
+    
+    def close(self):
+        """Close every connection in the pool and stop the maintenance thread"""
+        with self.lock:
+            self.closed = True
+            connections, self.connections = self.connections, []
+        self.wakeup.set()
+        for connection in connections:
+            connection.stack.close()
+        if self.maintainer is not None and self.maintainer is not threading.current_thread():
+            self.maintainer.join()
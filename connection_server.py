@@ -0,0 +1,206 @@
+# connection_server.py
+import selectors
+import socket
+import threading
+import time
+from threading import Thread
+
+from physical_layer import PhysicalLayer
+
+class ConnectionServer:
+    """Server-side physical layer that accepts any number of clients.
+    
+    All sockets are multiplexed on one selectors loop (epoll on Linux) running
+    in a single thread, which both reads and writes them. Every accepted
+    connection gets its own PhysicalLayer and a stack built by stack_factory,
+    so data link, network and transport state is kept per connection.
+    
+    Sockets are non-blocking. A connection with frames queued asks the loop
+    to write them (request_write), which is safe from any thread: the loop
+    writes them once they are due under the connection's flush policy, and
+    watches the socket for EVENT_WRITE only while it would block.
+    """
+    
+    def __init__(self, host='127.0.0.1', port=12345, stack_factory=None, backlog=128):
+        self.host = host
+        self.port = port
+        self.stack_factory = stack_factory
+        self.backlog = backlog
+        self.server_socket = None
+        self.selector = None
+        self.running = False
+        self.data_link_layer = None
+        self.connections = {}  # Maps client socket to its connection stack
+        self.thread = None
+        
+        # Connections that asked for a write since the loop last looked, and
+        # the ones holding frames back until a deadline to coalesce more
+        self.write_requests = set()
+        self.write_lock = threading.Lock()  # Guards write_requests and wakeup_sent
+        self.write_deadlines = {}  # Maps PhysicalLayer to the time.monotonic() its frames are due
+        self.wakeup_receive, self.wakeup_send = socket.socketpair()  # Interrupts select
+        self.wakeup_sent = False
+    
+    def connect_to_data_link_layer(self, data_link_layer):
+        # The template stack never sends or receives through the server itself
+        self.data_link_layer = data_link_layer
+    
+    def initialize(self):
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server_socket.bind((self.host, self.port))
+        self.server_socket.listen(self.backlog)
+        self.server_socket.setblocking(False)
+        print(f"Server listening on {self.host}:{self.port}")
+        
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.server_socket, selectors.EVENT_READ, self._accept_connection)
+        self.wakeup_receive.setblocking(False)
+        self.wakeup_send.setblocking(False)
+        self.selector.register(self.wakeup_receive, selectors.EVENT_READ, self._woken)
+        self.running = True
+        
+        # One thread serves every connection
+        self.thread = Thread(target=self._event_loop)
+        self.thread.start()
+    
+    def _event_loop(self):
+        while self.running:
+            try:
+                events = self.selector.select(timeout=self._select_timeout())
+            except (OSError, ValueError):
+                break  # Selector closed underneath us
+            for key, mask in events:
+                callback = key.data
+                callback(key.fileobj, mask)
+            self._schedule_writes()
+    
+    def _select_timeout(self):
+        if not self.write_deadlines:
+            return 0.5
+        return max(min(self.write_deadlines.values()) - time.monotonic(), 0)
+    
+    def in_loop(self):
+        return threading.current_thread() is self.thread
+    
+    def request_write(self, physical):
+        """A connection has frames queued, called from any thread"""
+        with self.write_lock:
+            self.write_requests.add(physical)
+            if self.wakeup_sent or self.in_loop():
+                return  # The loop looks at the requests before it selects again
+            self.wakeup_sent = True
+        self._wake()
+    
+    def _wake(self):
+        try:
+            self.wakeup_send.send(b'\0')
+        except OSError:
+            pass  # Buffer full, the loop is being woken already; or closed
+    
+    def _woken(self, wakeup_socket, mask):
+        try:
+            while wakeup_socket.recv(4096):
+                pass
+        except OSError:
+            pass
+    
+    def _schedule_writes(self):
+        """Write for the connections that asked to and the ones whose frames came due"""
+        with self.write_lock:
+            requested, self.write_requests = self.write_requests, set()
+            self.wakeup_sent = False
+        now = time.monotonic()
+        requested.update(physical for physical, due in self.write_deadlines.items() if due <= now)
+        for physical in requested:
+            self.write_deadlines.pop(physical, None)
+            self._update_writes(physical)
+    
+    def _update_writes(self, physical):
+        """Write what a connection has due, then watch it for EVENT_WRITE while it would block"""
+        client_socket = physical.socket
+        if client_socket not in self.connections:
+            return  # Dropped meanwhile
+        
+        events = selectors.EVENT_READ
+        delay = physical.write_delay()
+        if delay == 0:
+            if physical.write_available():
+                events |= selectors.EVENT_WRITE  # Socket full, go on once it drains
+                delay = None
+            else:
+                delay = physical.write_delay()
+        if delay is not None:
+            self.write_deadlines[physical] = time.monotonic() + delay
+        if self.selector.get_key(client_socket).events != events:
+            self.selector.modify(client_socket, events, self._connection_event)
+    
+    def _accept_connection(self, server_socket, mask):
+        try:
+            client_socket, addr = server_socket.accept()
+        except (BlockingIOError, OSError):
+            return
+        print(f"Connection from {addr}")
+        
+        # Reads and writes only happen when the selector reports the socket
+        # ready, or a write is due, and neither may hold up the other sockets
+        client_socket.setblocking(False)
+        physical = PhysicalLayer(False, addr[0], addr[1])
+        physical.attach_socket(client_socket, write_loop=self)
+        
+        self.connections[client_socket] = self.stack_factory(physical)
+        self.selector.register(client_socket, selectors.EVENT_READ, self._connection_event)
+    
+    def _connection_event(self, client_socket, mask):
+        stack = self.connections.get(client_socket)
+        if stack is None:
+            return
+        if mask & selectors.EVENT_WRITE:
+            self._update_writes(stack.physical)
+        if mask & selectors.EVENT_READ:
+            self._receive_from_connection(client_socket, stack)
+    
+    def _receive_from_connection(self, client_socket, stack):
+        try:
+            still_open = stack.physical.receive_available()
+        except BlockingIOError:
+            still_open = True  # Readiness was spurious
+        except Exception as e:
+            print(f"Physical layer receive error: {e}")
+            still_open = False
+        
+        if not still_open:
+            self._drop_connection(client_socket)
+    
+    def _drop_connection(self, client_socket):
+        stack = self.connections.pop(client_socket, None)
+        try:
+            self.selector.unregister(client_socket)
+        except (KeyError, ValueError):
+            pass
+        if stack is not None:
+            self.write_deadlines.pop(stack.physical, None)
+            stack.close_connection()
+    
+    def send_data(self, data):
+        print("Cannot send data: the server sends through its connection stacks")
+    
+    def flush(self):
+        pass
+    
+    def close(self):
+        # Stop the loop first, the connections are then closed from this thread
+        self.running = False
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self._wake()
+            self.thread.join(timeout=1.0)
+        for client_socket in list(self.connections):
+            self._drop_connection(client_socket)
+        if self.server_socket:
+            self.selector.unregister(self.server_socket)
+            self.server_socket.close()
+        if self.selector:
+            self.selector.close()
+        self.wakeup_receive.close()
+        self.wakeup_send.close()
+        print("Server closed")
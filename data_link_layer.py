@@ -1,14 +1,30 @@
 # data_link_layer.py
-import json
-import hashlib
+import time
+from integrity import ALGORITHMS, DEFAULT_INTEGRITY, FALLBACK_ORDER, LEGACY_INTEGRITY
+from mac_table import MacTable
+from messages import Frame
+from metrics import NULL_METRICS
+from wire_format import WireCodec
+
+BROADCAST_MAC = 'FF:FF:FF:FF:FF:FF'
 
 class DataLinkLayer:
-    def __init__(self, mac_address):
+    def __init__(self, mac_address, codec=None):
         self.mac_address = mac_address
+        self.codec = codec if codec is not None else WireCodec()
         self.physical_layer = None
         self.network_layer = None
-        # Simple MAC table (destination MAC -> is_local)
-        self.mac_table = {}
+        self.metrics = NULL_METRICS
+        # MACs we accept frames for, compared in upper case
+        self.local_macs = {mac_address.upper(), BROADCAST_MAC}
+        # Source MACs learned from inbound frames, shared by a stack's links
+        self.mac_table = MacTable()
+        self.link_name = None  # Interface name of this link, None for the main one
+        # Frame integrity: the algorithm we prefer to send, the ones we accept
+        # from the peer, and the ones the peer said it accepts (None until heard)
+        self.integrity = DEFAULT_INTEGRITY
+        self.accepted_integrity = frozenset(name for name in ALGORITHMS if name != 'none')
+        self.peer_integrity = None
     
     def connect_to_physical_layer(self, physical_layer):
         self.physical_layer = physical_layer
@@ -18,58 +34,116 @@ class DataLinkLayer:
         self.network_layer = network_layer
     
     def add_mac_entry(self, mac_address, is_local=False):
-        self.mac_table[mac_address] = is_local
+        """Accept frames for a local MAC, or pin a remote MAC to this link"""
+        if is_local:
+            self.local_macs.add(mac_address.upper())
+        else:
+            self.mac_table.add_static(mac_address, self.link_name)
+    
+    def configure_integrity(self, preferred=DEFAULT_INTEGRITY, accepted=None):
+        """Pick the frame check to send and the ones to accept ('none' only for trusted links)"""
+        if preferred not in ALGORITHMS:
+            raise ValueError(f"Unknown integrity algorithm {preferred}")
+        accepted = set(accepted) if accepted is not None else {name for name in ALGORITHMS if name != 'none'}
+        unknown = accepted - set(ALGORITHMS)
+        if unknown:
+            raise ValueError(f"Unknown integrity algorithm {sorted(unknown)[0]}")
+        self.integrity = preferred
+        self.accepted_integrity = frozenset(accepted | {preferred})
+    
+    def _choose_integrity(self):
+        """Algorithm for the next frame, given what the peer has told us it accepts"""
+        peer = self.peer_integrity
+        if peer is None:
+            # JSON peers may predate the integrity field and only check MD5
+            if not self.codec.binary:
+                return LEGACY_INTEGRITY
+            # Never skip the check before the peer has said it allows that
+            return self.integrity if self.integrity != 'none' else DEFAULT_INTEGRITY
+        
+        if self.integrity in peer:
+            return self.integrity
+        for name in FALLBACK_ORDER:
+            if name in peer:
+                return name
+        return LEGACY_INTEGRITY
     
     def create_frame(self, data, destination_mac):
-        # Frame format:
-        # {
-        #   'source_mac': <sender MAC>,
-        #   'destination_mac': <destination MAC>,
-        #   'data': <payload>,
-        #   'checksum': <checksum>
-        # }
-        frame = {
-            'source_mac': self.mac_address,
-            'destination_mac': destination_mac,
-            'data': data,
-            'checksum': self._calculate_checksum(data)
-        }
-        return json.dumps(frame).encode()
+        # The frame keeps a reference to the packet it carries, the codec
+        # serializes both and computes the checksum when the frame is sent
+        # (binary header + raw payload, or JSON, see wire_format.py)
+        return Frame(self.mac_address, destination_mac, self._choose_integrity(), self.accepted_integrity, data)
     
-    def _calculate_checksum(self, data):
-        # Calculate a simple checksum for data integrity
-        if isinstance(data, bytes):
-            return hashlib.md5(data).hexdigest()
-        else:
-            return hashlib.md5(str(data).encode()).hexdigest()
+    def _calculate_checksum(self, data, algorithm=LEGACY_INTEGRITY):
+        # Digest of the raw payload bytes; a memoryview into the physical
+        # receive buffer is checked in place
+        if isinstance(data, str):
+            data = data.encode()
+        return ALGORITHMS[algorithm].compute(data)
     
     def send_to_physical(self, data, destination_mac):
-        frame = self.create_frame(data, destination_mac)
+        # This is the physical boundary, the only place a frame and what it
+        # carries are serialized on the way down
+        start = time.perf_counter()
+        buffers = self.codec.encode_frame(self.create_frame(data, destination_mac))
+        self.metrics.observe('data_link.encode', time.perf_counter() - start)
+        self.metrics.count('data_link.frames_sent')
         if self.physical_layer:
-            self.physical_layer.send_data(frame)
+            self.physical_layer.send_data(buffers)
             print(f"Frame sent to {destination_mac}")
     
+    def flush(self):
+        """Have the physical layer send queued frames now"""
+        if self.physical_layer:
+            self.physical_layer.flush()
+    
     def receive_from_physical(self, frame_data):
         try:
+            # Reject frames for other hosts from the header alone, before the
+            # payload is parsed or checksummed
+            start = time.perf_counter()
+            destination = self.codec.peek_frame_destination(frame_data)
+            if destination is not None and destination.upper() not in self.local_macs:
+                self.metrics.count('data_link.dropped.not_for_us')
+                return
+            
             # Parse the frame
-            frame = json.loads(frame_data.decode())
+            frame = self.codec.decode_frame(frame_data)
             
             # Verify it's for us or broadcast
-            if frame['destination_mac'] != self.mac_address and frame['destination_mac'] != 'FF:FF:FF:FF:FF:FF':
-                print(f"Frame not for us (for {frame['destination_mac']}), dropping")
+            if frame.destination_mac.upper() not in self.local_macs:
+                print(f"Frame not for us (for {frame.destination_mac}), dropping")
+                self.metrics.count('data_link.dropped.not_for_us')
                 return
             
-            # Verify checksum
-            calculated_checksum = self._calculate_checksum(frame['data'])
-            if calculated_checksum != frame['checksum']:
+            # Verify checksum. Any known algorithm is checked, so frames sent
+            # before the peer learned our preference still get through, but an
+            # unchecked frame is only taken on a link configured to trust it
+            integrity = frame.integrity
+            if integrity == 'none':
+                if 'none' not in self.accepted_integrity:
+                    print("Frame without integrity check on an untrusted link, dropping")
+                    self.metrics.count('data_link.dropped.integrity_not_accepted')
+                    return
+            elif self._calculate_checksum(frame.data, integrity) != frame.checksum:
                 print("Checksum mismatch, dropping frame")
+                self.metrics.count('data_link.dropped.checksum')
                 return
             
-            print(f"Frame received from {frame['source_mac']}")
+            # The peer tells us in every frame which checks it accepts
+            self.peer_integrity = frame.accept
+            
+            self.metrics.observe('data_link.decode', time.perf_counter() - start)
+            self.metrics.count('data_link.frames_received')
+            print(f"Frame received from {frame.source_mac}")
+            
+            # Remember which link the sender is reachable on
+            self.mac_table.learn(frame.source_mac, self.link_name)
             
             # Forward data to the network layer
             if self.network_layer:
-                self.network_layer.receive_from_data_link(frame['data'])
+                self.network_layer.receive_from_data_link(frame.data)
                 
         except Exception as e:
             print(f"Data link layer error: {e}")
+            self.metrics.count('data_link.dropped.error')
@@ -16,30 +16,25 @@ def create_server():
     # Add route to client
     server.add_route('192.168.1.2', '00:00:00:00:00:02')
     
-    # Define a GET handler
-    def handle_get(request):
-        path = request.get('path', '')
-        
-        if path == '/hello':
-            return 200, 'OK', None, 'Hello, World!'
-        elif path == '/time':
-            return 200, 'OK', None, f"The time is {time.strftime('%H:%M:%S')}"
-        else:
-            return 404, 'Not Found', None, 'Resource not found'
-    
-    # Define a POST handler
-    def handle_post(request):
-        path = request.get('path', '')
+    # Define the handlers, the router picks one by method and path
+    def handle_hello(request):
+        return 200, 'OK', None, 'Hello, World!'
+    
+    def handle_time(request):
+        return 200, 'OK', None, f"The time is {time.strftime('%H:%M:%S')}"
+    
+    def handle_greet(request):
+        return 200, 'OK', None, f"Hello, {request['params']['name']}!"
+    
+    def handle_echo(request):
         body = request.get('body', '')
-        
-        if path == '/echo':
-            return 200, 'OK', None, f"You sent: {body}"
-        else:
-            return 404, 'Not Found', None, 'Resource not found'
+        return 200, 'OK', None, f"You sent: {body}"
     
-    # Register handlers
-    server.register_application_handler('GET', handle_get)
-    server.register_application_handler('POST', handle_post)
+    # Register routes, unknown paths get a 404 response
+    server.register_route('GET', '/hello', handle_hello)
+    server.register_route('GET', '/time', handle_time)
+    server.register_route('GET', '/greet/{name}', handle_greet)
+    server.register_route('POST', '/echo', handle_echo)
     
     # Initialize the server
     server.initialize()
@@ -76,15 +71,16 @@ if __name__ == "__main__":
     
     client = create_client()
     
-    # Send requests from client to server
-    response = client.send_request('GET', '/hello', '192.168.1.1')
-    print("Response:", response)
-    
-    response = client.send_request('GET', '/time', '192.168.1.1')
-    print("Response:", response)
+    # Send requests from client to server, all three are in flight at once
+    hello = client.submit_request('GET', '/hello', '192.168.1.1', timeout=5)
+    current_time = client.submit_request('GET', '/time', '192.168.1.1', timeout=5)
+    greet = client.submit_request('GET', '/greet/Client', '192.168.1.1', timeout=5)
+    echo = client.submit_request('POST', '/echo', '192.168.1.1', body='Hello Server!', timeout=5)
+    missing = client.submit_request('GET', '/missing', '192.168.1.1', timeout=5)
     
-    response = client.send_request('POST', '/echo', '192.168.1.1', body='Hello Server!')
-    print("Response:", response)
+    for future in (hello, current_time, greet, echo, missing):
+        response = future.result()
+        print("Response:", response['status_code'], response['body'])
     
     # Clean up
     client.close()
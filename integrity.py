@@ -0,0 +1,69 @@
+# integrity.py
+import hashlib
+import zlib
+from functools import lru_cache
+
+class IntegrityAlgorithm:
+    """Frame check carried in every frame, identified on the wire by a one-byte id"""
+    
+    def __init__(self, algorithm_id, name, size, compute, compute_parts):
+        self.algorithm_id = algorithm_id
+        self.name = name
+        self.size = size  # Digest length in bytes
+        self.compute = compute  # Callable(bytes-like) returning the digest bytes
+        self.compute_parts = compute_parts  # Same digest over buffers sent back to back
+
+
+def _checksum_parts(function, initial):
+    def compute_parts(parts):
+        value = initial
+        for part in parts:
+            value = function(part, value)
+        return value.to_bytes(4, 'big')
+    return compute_parts
+
+
+def _hash_parts(new_hash):
+    def compute_parts(parts):
+        digest = new_hash()
+        for part in parts:
+            digest.update(part)
+        return digest.digest()
+    return compute_parts
+
+
+ALGORITHMS = {algorithm.name: algorithm for algorithm in (
+    IntegrityAlgorithm(0, 'none', 0, lambda data: b'', lambda parts: b''),
+    IntegrityAlgorithm(1, 'crc32', 4, lambda data: zlib.crc32(data).to_bytes(4, 'big'),
+                       _checksum_parts(zlib.crc32, 0)),
+    IntegrityAlgorithm(2, 'adler32', 4, lambda data: zlib.adler32(data).to_bytes(4, 'big'),
+                       _checksum_parts(zlib.adler32, 1)),
+    IntegrityAlgorithm(3, 'md5', 16, lambda data: hashlib.md5(data).digest(), _hash_parts(hashlib.md5)),
+    IntegrityAlgorithm(4, 'blake2', 16, lambda data: hashlib.blake2b(data, digest_size=16).digest(),
+                       _hash_parts(lambda: hashlib.blake2b(digest_size=16))),
+)}
+ALGORITHMS_BY_ID = {algorithm.algorithm_id: algorithm for algorithm in ALGORITHMS.values()}
+
+DEFAULT_INTEGRITY = 'crc32'
+LEGACY_INTEGRITY = 'md5'  # What frames without an algorithm field were checked with
+
+# Fallback order when the peer does not accept our preferred algorithm, cheapest first
+FALLBACK_ORDER = ('crc32', 'adler32', 'blake2', 'md5')
+
+
+def names_to_mask(names):
+    """Bit mask of algorithm ids, how binary frames advertise what they accept"""
+    return _names_to_mask(frozenset(names))  # A link's accepted set is frozen, so this hits the cache
+
+
+@lru_cache(maxsize=64)
+def _names_to_mask(names):
+    mask = 0
+    for name in names:
+        if name in ALGORITHMS:
+            mask |= 1 << ALGORITHMS[name].algorithm_id
+    return mask
+
+
+def mask_to_names(mask):
+    return {algorithm.name for algorithm in ALGORITHMS.values() if mask & (1 << algorithm.algorithm_id)}
@@ -0,0 +1,234 @@
+# loopback_physical_layer.py
+import threading
+from collections import deque
+
+from metrics import NULL_METRICS
+from physical_layer import frame_buffers
+
+class LoopbackHub:
+    """In-memory medium that links physical layers within one process.
+    
+    Frames from every link go through one FIFO queue and are delivered in the
+    order they were sent. A threaded hub delivers them on its single thread;
+    with threaded=False nothing moves until deliver_pending() is called, so
+    the order of deliveries is up to the caller. Timers are not: delayed ACKs,
+    retransmissions and request timeouts still fire on the shared wall-clock
+    timer thread, and a slow step can let one fire between two calls. Either
+    way a stack needs neither a socket nor a thread of its own.
+    """
+    
+    def __init__(self, threaded=True):
+        self.threaded = threaded
+        self.listeners = {}  # Maps (host, port) to a listening physical layer or server
+        self.queue = deque()  # (target physical layer, frame) in send order
+        self.condition = threading.Condition()
+        self.thread = None
+    
+    def listen(self, address, listener):
+        with self.condition:
+            if address in self.listeners:
+                raise OSError(f"Loopback address {address[0]}:{address[1]} already in use")
+            self.listeners[address] = listener
+    
+    def unlisten(self, address, listener):
+        with self.condition:
+            if self.listeners.get(address) is listener:
+                del self.listeners[address]
+    
+    def connect(self, address, client):
+        """Pair client with whatever listens on address, returns the server side"""
+        with self.condition:
+            listener = self.listeners.get(address)
+        if listener is None:
+            raise ConnectionRefusedError(f"Nothing listening on loopback {address[0]}:{address[1]}")
+        return listener.accept_loopback(client)
+    
+    def send(self, target, frame):
+        with self.condition:
+            self.queue.append((target, frame))
+            if self.threaded:
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self._run, name='loopback', daemon=True)
+                    self.thread.start()
+                self.condition.notify()
+    
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.queue:
+                    self.condition.wait()
+                batch = list(self.queue)
+                self.queue.clear()
+            
+            for target, frame in batch:
+                self._deliver(target, frame)
+    
+    def deliver_pending(self, max_frames=None):
+        """Deliver queued frames on the calling thread until none are left (threaded=False hubs)"""
+        delivered = 0
+        while max_frames is None or delivered < max_frames:
+            with self.condition:
+                if not self.queue:
+                    break
+                target, frame = self.queue.popleft()
+            self._deliver(target, frame)
+            delivered += 1
+        return delivered
+    
+    @staticmethod
+    def _deliver(target, frame):
+        try:
+            target.receive_frame(frame)
+        except Exception as e:
+            print(f"Loopback delivery error: {e}")
+
+
+_default_hub = None
+_default_lock = threading.Lock()
+
+def default_hub():
+    """The process-wide hub used when a loopback layer is not given one"""
+    global _default_hub
+    with _default_lock:
+        if _default_hub is None:
+            _default_hub = LoopbackHub()
+        return _default_hub
+
+
+class LoopbackPhysicalLayer:
+    """Physical layer that exchanges frames through a LoopbackHub instead of a socket.
+    
+    It keeps the PhysicalLayer contract (connect_to_data_link_layer,
+    initialize, send_data, close). Addresses are only names on the hub, so
+    no ports are bound. A server accepts one peer, like PhysicalLayer.
+    """
+    
+    def __init__(self, is_server=False, host='127.0.0.1', port=12345, hub=None):
+        self.is_server = is_server
+        self.host = host
+        self.port = port
+        self.hub = hub if hub is not None else default_hub()
+        self.peer = None  # Physical layer at the other end of the link
+        self.connected = False
+        self.listening = False
+        self.data_link_layer = None
+        self.on_peer_closed = None  # Optional callable(self) run when the peer closes
+        self.metrics = NULL_METRICS
+    
+    def connect_to_data_link_layer(self, data_link_layer):
+        self.data_link_layer = data_link_layer
+    
+    def initialize(self):
+        if self.is_server:
+            self.hub.listen((self.host, self.port), self)
+            self.listening = True
+            print(f"Server listening on loopback {self.host}:{self.port}")
+        else:
+            self.peer = self.hub.connect((self.host, self.port), self)
+            self.connected = True
+            print(f"Connected to loopback {self.host}:{self.port}")
+    
+    def accept_loopback(self, client):
+        """Take a connecting client as our peer"""
+        if self.connected:
+            raise ConnectionRefusedError(f"Loopback {self.host}:{self.port} already has a peer")
+        self.peer = client
+        self.connected = True
+        print("Connection from loopback client")
+        return self
+    
+    def send_data(self, data):
+        # Convert data to bitstream (bytes), joining a frame given as buffers
+        bit_data = b''.join(frame_buffers(data))
+        
+        if not (self.connected and self.peer is not None and self.peer.connected):
+            print("Cannot send data: not connected")
+            self.metrics.count('physical.dropped.not_connected')
+            return
+        
+        self.metrics.count('physical.frames_sent')
+        self.metrics.count('physical.bytes_sent', len(bit_data))
+        self.hub.send(self.peer, bit_data)
+    
+    def flush(self):
+        """Nothing to do, frames go to the hub as they are sent"""
+    
+    def receive_frame(self, frame):
+        """Called by the hub with a frame sent by our peer"""
+        if not (self.connected and self.data_link_layer):
+            return
+        self.metrics.count('physical.frames_received')
+        self.metrics.count('physical.bytes_received', len(frame))
+        self.data_link_layer.receive_from_physical(frame)
+    
+    def peer_closed(self):
+        """The other end closed the link, like reading EOF from a socket"""
+        self.connected = False
+        if self.on_peer_closed:
+            self.on_peer_closed(self)
+    
+    def reset(self):
+        """Drop the link, this end then cleans up as when the peer closes"""
+        self.close()
+        if self.on_peer_closed:
+            self.on_peer_closed(self)
+    
+    def close(self):
+        self.connected = False
+        if self.peer is not None and self.peer.connected:
+            self.peer.peer_closed()
+        if self.listening:
+            self.hub.unlisten((self.host, self.port), self)
+            self.listening = False
+        print("Physical connection closed")
+
+
+class LoopbackConnectionServer:
+    """Loopback counterpart of ConnectionServer: one stack per connecting client"""
+    
+    def __init__(self, host='127.0.0.1', port=12345, stack_factory=None, hub=None):
+        self.host = host
+        self.port = port
+        self.stack_factory = stack_factory
+        self.hub = hub if hub is not None else default_hub()
+        self.data_link_layer = None
+        self.connections = {}  # Maps server-side physical layer to its connection stack
+        self.lock = threading.Lock()
+    
+    def connect_to_data_link_layer(self, data_link_layer):
+        # The template stack never sends or receives through the server itself
+        self.data_link_layer = data_link_layer
+    
+    def initialize(self):
+        self.hub.listen((self.host, self.port), self)
+        print(f"Server listening on loopback {self.host}:{self.port}")
+    
+    def accept_loopback(self, client):
+        physical = LoopbackPhysicalLayer(False, self.host, self.port, self.hub)
+        physical.peer = client
+        physical.connected = True
+        physical.on_peer_closed = self._drop_connection
+        stack = self.stack_factory(physical)
+        with self.lock:
+            self.connections[physical] = stack
+        return physical
+    
+    def _drop_connection(self, physical):
+        with self.lock:
+            stack = self.connections.pop(physical, None)
+        if stack is not None:
+            stack.stop_timers()
+    
+    def send_data(self, data):
+        print("Cannot send data: the server sends through its connection stacks")
+    
+    def flush(self):
+        pass
+    
+    def close(self):
+        self.hub.unlisten((self.host, self.port), self)
+        with self.lock:
+            connections, self.connections = self.connections, {}
+        for stack in connections.values():
+            stack.close_connection()
+        print("Server closed")
@@ -0,0 +1,93 @@
+# mac_table.py
+import threading
+import time
+from collections import OrderedDict
+
+from timers import default_scheduler
+
+class MacTable:
+    """MAC address to link mappings learned from the source of inbound frames.
+    
+    A link is named by the interface it was seen on (None for a stack's main
+    link). Learned entries age out after max_age seconds without traffic,
+    removed by a periodic sweep on the shared timer thread, and the least
+    recently seen entry is evicted once max_entries is reached. Static
+    entries never age. Addresses are kept in upper case, so lookups do not
+    depend on how a frame or a caller spelled them.
+    """
+    
+    def __init__(self, max_entries=4096, max_age=300.0, timers=None):
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.timers = timers if timers is not None else default_scheduler()
+        self.static = {}  # Maps MAC to link, added by hand
+        self.learned = OrderedDict()  # Maps MAC to [link, last seen], least recently seen first
+        self.lock = threading.Lock()
+        self.sweep_timer = None
+        self.stopped = False  # No more sweeps once stopped
+        self.evictions = 0
+    
+    def add_static(self, mac_address, link=None):
+        mac_address = mac_address.upper()
+        with self.lock:
+            self.static[mac_address] = link
+            self.learned.pop(mac_address, None)
+    
+    def learn(self, mac_address, link=None):
+        """Record that mac_address was just seen on link"""
+        mac_address = mac_address.upper()
+        now = time.monotonic()
+        with self.lock:
+            if mac_address in self.static:
+                return
+            entry = self.learned.get(mac_address)
+            if entry is not None:
+                entry[0] = link  # A host that moved is found on its new link
+                entry[1] = now
+                self.learned.move_to_end(mac_address)
+                return
+            
+            self.learned[mac_address] = [link, now]
+            while len(self.learned) > self.max_entries:
+                self.learned.popitem(last=False)
+                self.evictions += 1
+            if self.sweep_timer is None and not self.stopped:
+                self.sweep_timer = self.timers.call_later(self.max_age, self._sweep)
+    
+    def lookup(self, mac_address):
+        """Return (found, link) for a MAC address"""
+        mac_address = mac_address.upper()
+        with self.lock:
+            if mac_address in self.static:
+                return True, self.static[mac_address]
+            entry = self.learned.get(mac_address)
+            if entry is None or time.monotonic() - entry[1] > self.max_age:
+                return False, None
+            return True, entry[0]
+    
+    def _sweep(self):
+        """Drop entries not seen for max_age, then check again later while any remain"""
+        cutoff = time.monotonic() - self.max_age
+        with self.lock:
+            self.sweep_timer = None
+            # Entries are ordered by last seen, so stop at the first fresh one
+            while self.learned:
+                mac_address, (_, last_seen) = next(iter(self.learned.items()))
+                if last_seen > cutoff:
+                    break
+                del self.learned[mac_address]
+            
+            if self.learned and not self.stopped:
+                oldest = next(iter(self.learned.values()))[1]
+                self.sweep_timer = self.timers.call_later(max(oldest - cutoff, 0.01), self._sweep)
+    
+    def stop(self):
+        """Cancel the sweep timer, entries still age out on lookup"""
+        with self.lock:
+            self.stopped = True
+            if self.sweep_timer is not None:
+                self.sweep_timer.cancel()
+                self.sweep_timer = None
+    
+    def __len__(self):
+        return len(self.static) + len(self.learned)
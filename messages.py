@@ -0,0 +1,152 @@
+# messages.py
+import json
+
+# Segment control flags, kept as bits of one int
+FLAG_SYN = 0x01
+FLAG_ACK = 0x02
+FLAG_FIN = 0x04
+FLAG_MORE = 0x08  # More segments of the same message follow
+FLAG_PIGGYBACK = 0x10  # Sender's ACKs are cumulative, and it reads data on ACK segments
+SEGMENT_FLAGS = (('SYN', FLAG_SYN), ('ACK', FLAG_ACK), ('FIN', FLAG_FIN), ('MORE', FLAG_MORE),
+                 ('PIGGYBACK', FLAG_PIGGYBACK))
+
+
+class Frame:
+    """Data link unit, data is the Packet it carries (or raw bytes).
+    
+    checksum is filled in when the frame is encoded, see WireCodec.
+    """
+    __slots__ = ('source_mac', 'destination_mac', 'integrity', 'accept', 'checksum', 'data')
+    
+    def __init__(self, source_mac, destination_mac, integrity, accept, data, checksum=b''):
+        self.source_mac = source_mac
+        self.destination_mac = destination_mac
+        self.integrity = integrity  # Name of the algorithm of the digest
+        self.accept = accept  # Algorithms the sender accepts in return
+        self.checksum = checksum  # Raw digest of the encoded payload
+        self.data = data
+
+
+class Packet:
+    """Network unit, data is the Segment it carries (or raw bytes)"""
+    __slots__ = ('source_ip', 'destination_ip', 'ttl', 'data')
+    
+    def __init__(self, source_ip, destination_ip, ttl, data):
+        self.source_ip = source_ip
+        self.destination_ip = destination_ip
+        self.ttl = ttl
+        self.data = data
+
+
+class Segment:
+    """Transport unit, flags is a bit field of the FLAG_ constants.
+    
+    data is one buffer when received, and a tuple of buffers sent back to
+    back when cut from an outbound message. The last three fields are send
+    side bookkeeping and never go on the wire.
+    """
+    __slots__ = ('sequence', 'ack', 'flags', 'window', 'message', 'data',
+                 'destination_ip', 'sent_at', 'retries')
+    
+    def __init__(self, sequence, ack, flags, window, message, data):
+        self.sequence = sequence
+        self.ack = ack
+        self.flags = flags
+        self.window = window
+        self.message = message  # Id of the message this segment belongs to
+        self.data = data
+        self.destination_ip = None
+        self.sent_at = 0.0
+        self.retries = 0
+
+
+class SessionEnvelope:
+    """Session unit: a message of one session, credit given back on it (grant), or its end (close)"""
+    __slots__ = ('session_id', 'seq', 'window', 'grant', 'close', 'data')
+    
+    def __init__(self, session_id, data=None, seq=None, window=None, grant=None, close=False):
+        self.session_id = session_id
+        self.seq = seq  # Per-session message number, None from peers without them
+        self.window = window  # Our receive window, on the first message of a session
+        self.grant = grant  # Bytes of credit given back, on control envelopes only
+        self.close = close  # The sender has ended the session, on control envelopes only
+        self.data = data  # Presentation layer payload
+
+
+REQUEST_FIELDS = ('type', 'request_id', 'method', 'path', 'headers', 'body')
+RESPONSE_FIELDS = ('type', 'request_id', 'status_code', 'status_message', 'headers', 'body')
+
+
+class Message:
+    """Application request or response.
+    
+    Fields read like the keys of a dict (message['body'], message.get(...)),
+    so handlers and response consumers written against parsed JSON keep
+    working. Fields that were never set behave like missing keys. session_id
+    and params are filled in locally and never serialized.
+    """
+    __slots__ = ('type', 'request_id', 'method', 'path', 'status_code', 'status_message',
+                 'headers', 'body', 'session_id', 'params')
+    
+    @classmethod
+    def request(cls, method, path, headers, body, request_id):
+        message = cls()
+        message.type = 'request'
+        message.request_id = request_id
+        message.method = method
+        message.path = path
+        message.headers = headers
+        message.body = body
+        return message
+    
+    @classmethod
+    def response(cls, status_code, status_message, headers, body, request_id):
+        message = cls()
+        message.type = 'response'
+        message.request_id = request_id
+        message.status_code = status_code
+        message.status_message = status_message
+        message.headers = headers
+        message.body = body
+        return message
+    
+    @classmethod
+    def from_json(cls, data):
+        """Parse a serialized message, unknown keys are ignored"""
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        message = cls()
+        for key, value in json.loads(data).items():
+            if key in MESSAGE_FIELDS:
+                setattr(message, key, value)
+        return message
+    
+    def to_json(self):
+        fields = RESPONSE_FIELDS if getattr(self, 'type', None) == 'response' else REQUEST_FIELDS
+        return json.dumps({key: getattr(self, key, None) for key in fields})
+    
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key) from None
+    
+    def __setitem__(self, key, value):
+        if key not in MESSAGE_FIELDS:
+            raise KeyError(key)
+        setattr(self, key, value)
+    
+    def __contains__(self, key):
+        return key in MESSAGE_FIELDS and hasattr(self, key)
+    
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+    
+    def keys(self):
+        return [key for key in self.__slots__ if hasattr(self, key)]
+    
+    def __repr__(self):
+        return f"Message({', '.join(f'{key}={self[key]!r}' for key in self.keys())})"
+
+
+MESSAGE_FIELDS = frozenset(Message.__slots__)
@@ -0,0 +1,159 @@
+# metrics.py
+import bisect
+import json
+import threading
+import weakref
+
+# Histogram bucket upper bounds in seconds, 1us doubling up to about 67s
+BUCKET_BOUNDS = [1e-6 * 2 ** i for i in range(27)]
+
+class Histogram:
+    """Latency distribution over exponential buckets"""
+    __slots__ = ('counts', 'count', 'total', 'max')
+    
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+    
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKET_BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+    
+    def merge(self, other):
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+    
+    def percentile(self, fraction):
+        """Upper bound of the bucket that holds the given fraction of samples"""
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return min(BUCKET_BOUNDS[index], self.max) if index < len(BUCKET_BOUNDS) else self.max
+        return self.max
+    
+    def summary(self):
+        """Count plus mean, percentiles and max in milliseconds"""
+        if not self.count:
+            return {'count': 0}
+        return {
+            'count': self.count,
+            'mean_ms': round(self.total / self.count * 1000, 4),
+            'p50_ms': round(self.percentile(0.5) * 1000, 4),
+            'p90_ms': round(self.percentile(0.9) * 1000, 4),
+            'p99_ms': round(self.percentile(0.99) * 1000, 4),
+            'max_ms': round(self.max * 1000, 4)
+        }
+
+
+class ShardOwner:
+    """Lives in a thread's threading.local, so it dies when the thread exits"""
+    __slots__ = ('__weakref__',)
+
+
+class Metrics:
+    """Counters and latency histograms shared by the layers of a stack.
+    
+    Names are '<layer>.<what>', e.g. 'data_link.dropped.checksum' or
+    'presentation.cipher'. Every thread records into its own shard
+    (threading.local), so recording never takes a lock; snapshot() merges
+    the shards of all threads. When a thread exits its shard is folded into
+    one retired shard, so threads that come and go do not pile up shards.
+    """
+    
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.local = threading.local()
+        self.shards = {}  # Maps id of a shard to the (counters, histograms) of a live thread
+        self.retired = ({}, {})  # Totals of the threads that have exited
+        self.lock = threading.Lock()  # Only taken the first time a thread records
+    
+    def _shard(self):
+        try:
+            return self.local.shard
+        except AttributeError:
+            shard = self.local.shard = ({}, {})
+            self.local.owner = ShardOwner()
+            weakref.finalize(self.local.owner, self._retire, shard)
+            with self.lock:
+                self.shards[id(shard)] = shard
+            return shard
+    
+    def _retire(self, shard):
+        """Fold the shard of a thread that has exited into the retired totals"""
+        with self.lock:
+            self.shards.pop(id(shard), None)
+            self._fold(self.retired, shard)
+    
+    @staticmethod
+    def _fold(target, shard):
+        counters, histograms = target
+        for name, value in list(shard[0].items()):
+            counters[name] = counters.get(name, 0) + value
+        for name, histogram in list(shard[1].items()):
+            if name not in histograms:
+                histograms[name] = Histogram()
+            histograms[name].merge(histogram)
+    
+    def count(self, name, amount=1):
+        if not self.enabled:
+            return
+        counters = self._shard()[0]
+        counters[name] = counters.get(name, 0) + amount
+    
+    def observe(self, name, seconds):
+        if not self.enabled:
+            return
+        histograms = self._shard()[1]
+        histogram = histograms.get(name)
+        if histogram is None:
+            histogram = histograms[name] = Histogram()
+        histogram.observe(seconds)
+    
+    def snapshot(self):
+        """Merge every thread's shard into {'counters': ..., 'histograms': ...}"""
+        counters = {}
+        histograms = {}
+        with self.lock:
+            shards = list(self.shards.values())
+            self._fold((counters, histograms), self.retired)  # Retired totals change under the lock
+        for shard in shards:
+            self._fold((counters, histograms), shard)
+        
+        return {
+            'counters': dict(sorted(counters.items())),
+            'histograms': {name: histograms[name].summary() for name in sorted(histograms)}
+        }
+    
+    def reset(self):
+        """Start counting from zero"""
+        with self.lock:
+            for counters, histograms in [self.retired] + list(self.shards.values()):
+                counters.clear()
+                histograms.clear()
+    
+    def export(self, format='json'):
+        """Snapshot as a JSON document or as 'name value' text lines"""
+        snapshot = self.snapshot()
+        if format == 'json':
+            return json.dumps(snapshot, indent=2)
+        if format != 'text':
+            raise ValueError(f"Unknown metrics format: {format}")
+        
+        lines = [f"{name} {value}" for name, value in snapshot['counters'].items()]
+        for name, summary in snapshot['histograms'].items():
+            lines.extend(f"{name}.{field} {value}" for field, value in summary.items())
+        return '\n'.join(lines)
+
+
+# Used by layers that are not part of an OSIStack, records nothing
+NULL_METRICS = Metrics(enabled=False)
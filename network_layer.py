@@ -1,78 +1,125 @@
 # network_layer.py
-import json
+import time
+from messages import Packet
+from metrics import NULL_METRICS
+from routing_table import RoutingTable
+from wire_format import WireCodec
 
 class NetworkLayer:
-    def __init__(self, ip_address):
+    def __init__(self, ip_address, codec=None):
         self.ip_address = ip_address
-        self.routing_table = {}  # Maps IP to next hop
+        self.codec = codec if codec is not None else WireCodec()
+        self.routing_table = RoutingTable()  # Longest-prefix match to next hop MAC
         self.data_link_layer = None
+        self.interfaces = {}  # Maps interface name to the data link layer of an extra link
         self.transport_layer = None
+        self.forwarding = False  # Router mode: forward packets addressed to other hosts
+        self.metrics = NULL_METRICS
     
     def connect_to_data_link_layer(self, data_link_layer):
         self.data_link_layer = data_link_layer
         data_link_layer.connect_to_network_layer(self)
     
+    def add_interface(self, name, data_link_layer):
+        """Attach another link, routes name it to send through it"""
+        self.interfaces[name] = data_link_layer
+        data_link_layer.connect_to_network_layer(self)
+    
     def connect_to_transport_layer(self, transport_layer):
         self.transport_layer = transport_layer
     
-    def add_route(self, destination_ip, next_hop_mac):
-        """Add a routing rule: packets to destination_ip go to next_hop_mac"""
-        self.routing_table[destination_ip] = next_hop_mac
+    def add_route(self, destination, next_hop_mac, metric=0, interface=None):
+        """Add a routing rule: packets to destination ('a.b.c.d' or 'a.b.c.d/n') go to next_hop_mac"""
+        if interface is not None and interface not in self.interfaces:
+            raise ValueError(f"Unknown interface: {interface}")
+        self.routing_table.add(destination, next_hop_mac, metric, interface)
     
     def create_packet(self, data, destination_ip):
-        # IP Packet format:
-        # {
-        #   'source_ip': <sender IP>,
-        #   'destination_ip': <destination IP>,
-        #   'ttl': <time to live>,
-        #   'data': <payload>
-        # }
-        packet = {
-            'source_ip': self.ip_address,
-            'destination_ip': destination_ip,
-            'ttl': 64,  # Default TTL
-            'data': data
-        }
-        return packet
+        # IP packet, serialized with the frame that carries it (see wire_format.py)
+        return Packet(self.ip_address, destination_ip, 64, data)  # Default TTL
     
     def send_to_data_link(self, packet, destination_ip):
-        # Find the next hop MAC from routing table
-        if destination_ip in self.routing_table:
-            next_hop_mac = self.routing_table[destination_ip]
+        # Find the next hop MAC from the routing table (longest prefix, then
+        # the default route), or broadcast if no route matches
+        route = self.routing_table.lookup(destination_ip)
+        if route is not None:
+            next_hop_mac = route.next_hop
+            data_link_layer = self.interfaces.get(route.interface, self.data_link_layer)
+            
+            # Without an interface in the route, use the link the next hop was
+            # last heard on
+            if route.interface is None and self.interfaces and self.data_link_layer:
+                found, link = self.data_link_layer.mac_table.lookup(next_hop_mac)
+                if found:
+                    data_link_layer = self.interfaces.get(link, self.data_link_layer)
         else:
-            # Default gateway or broadcast if no route found
             next_hop_mac = 'FF:FF:FF:FF:FF:FF'
+            data_link_layer = self.data_link_layer
         
-        # Serialize and send the packet
-        serialized_packet = json.dumps(packet)
-        if self.data_link_layer:
-            self.data_link_layer.send_to_physical(serialized_packet, next_hop_mac)
+        # The packet goes down as it is, the data link serializes it with its frame
+        self.metrics.count('network.packets_sent')
+        if data_link_layer:
+            data_link_layer.send_to_physical(packet, next_hop_mac)
             print(f"Packet sent to {destination_ip} via {next_hop_mac}")
     
     def receive_from_data_link(self, data):
         try:
             # Parse the packet
-            packet = json.loads(data)
+            start = time.perf_counter()
+            packet = self.codec.decode_packet(data)
+            self.metrics.observe('network.decode', time.perf_counter() - start)
             
-            # Check if the packet is for us
-            if packet['destination_ip'] != self.ip_address:
-                print(f"Packet not for us (for {packet['destination_ip']}), dropping")
+            # Check if the packet is for us, a router passes it on
+            if packet.destination_ip != self.ip_address:
+                if self.forwarding:
+                    self._forward(packet)
+                    return
+                print(f"Packet not for us (for {packet.destination_ip}), dropping")
+                self.metrics.count('network.dropped.not_for_us')
                 return
             
             # Decrement TTL
-            packet['ttl'] -= 1
-            if packet['ttl'] <= 0:
+            packet.ttl -= 1
+            if packet.ttl <= 0:
                 print("TTL expired, dropping packet")
+                self.metrics.count('network.dropped.ttl_expired')
                 return
             
-            print(f"Packet received from {packet['source_ip']}")
+            self.metrics.count('network.packets_received')
+            print(f"Packet received from {packet.source_ip}")
             
             # Forward data to the transport layer
             if self.transport_layer:
-                self.transport_layer.receive_from_network(packet['data'])
+                self.transport_layer.receive_from_network(packet.data, packet.source_ip)
                 
         except Exception as e:
             print(f"Network layer error: {e}")
+            self.metrics.count('network.dropped.error')
+    
+    def _forward(self, packet):
+        """Send a transit packet on towards its destination"""
+        packet.ttl -= 1
+        if packet.ttl <= 0:
+            print(f"TTL expired forwarding to {packet.destination_ip}, dropping packet")
+            self.metrics.count('network.dropped.ttl_expired')
+            return
+        
+        # Without a route a router drops rather than broadcasts
+        if self.routing_table.lookup(packet.destination_ip) is None:
+            print(f"No route to {packet.destination_ip}, dropping packet")
+            self.metrics.count('network.dropped.no_route')
+            return
+        
+        self.metrics.count('network.forwarded')
+        self.send_to_data_link(packet, packet.destination_ip)
+        self.flush()
+    
+    def flush(self):
+        """Push out frames queued on every link, the end of a burst of sends"""
+        if self.data_link_layer:
+            self.data_link_layer.flush()
+        for data_link_layer in self.interfaces.values():
+            data_link_layer.flush()
     
     def send_to_transport(self, data, destination_ip):
         packet = self.create_packet(data, destination_ip)
@@ -6,14 +6,50 @@ from transport_layer import TransportLayer
 from session_layer import SessionLayer
 from presentation_layer import PresentationLayer
 from application_layer import ApplicationLayer
+from connection_server import ConnectionServer
+from loopback_physical_layer import LoopbackConnectionServer, LoopbackPhysicalLayer
+from metrics import Metrics
+from response_cache import ResponseCache
+from worker_pool import WorkerPool
+from wire_format import WireCodec, WIRE_FORMAT_BINARY
+
+# How stacks reach each other: real TCP sockets, or in-process queues
+LINKS = ('tcp', 'loopback')
 
 class OSIStack:
-    def __init__(self, is_server=False, host='127.0.0.1', port=12345, mac_address='00:00:00:00:00:01', ip_address='192.168.1.1'):
+    # Subclasses swap in a different physical layer (see AsyncOSIStack)
+    physical_layer_class = PhysicalLayer
+    
+    def __init__(self, is_server=False, host='127.0.0.1', port=12345, mac_address='00:00:00:00:00:01', ip_address='192.168.1.1', wire_format=WIRE_FORMAT_BINARY, multi_client=False, physical_layer=None, metrics=None, link='tcp'):
+        self.mac_address = mac_address
+        self.ip_address = ip_address
+        self.wire_format = wire_format
+        self.metrics = metrics if metrics is not None else Metrics()
+        
+        # Frame, packet and segment headers share one negotiated wire codec
+        self.codec = WireCodec(wire_format)
+        
+        # A multi-client server accepts every client on one selectors loop (or
+        # the loopback hub) and gives each connection its own stack built from
+        # this one
+        if physical_layer is None:
+            if link not in LINKS:
+                raise ValueError(f"Unknown link: {link}")
+            if link == 'loopback':
+                server_class, physical_class = LoopbackConnectionServer, LoopbackPhysicalLayer
+            else:
+                server_class, physical_class = ConnectionServer, self.physical_layer_class
+            
+            if is_server and multi_client:
+                physical_layer = server_class(host, port, self._create_connection_stack)
+            else:
+                physical_layer = physical_class(is_server, host, port)
+        
         # Create all layers
-        self.physical = PhysicalLayer(is_server, host, port)
-        self.data_link = DataLinkLayer(mac_address)
-        self.network = NetworkLayer(ip_address)
-        self.transport = TransportLayer()
+        self.physical = physical_layer
+        self.data_link = DataLinkLayer(mac_address, self.codec)
+        self.network = NetworkLayer(ip_address, self.codec)
+        self.transport = TransportLayer(self.codec)
         self.session = SessionLayer()
         self.presentation = PresentationLayer()
         self.application = ApplicationLayer()
@@ -26,25 +62,181 @@ class OSIStack:
         self.presentation.connect_to_session_layer(self.session)
         self.application.connect_to_presentation_layer(self.presentation)
         
+        # A connection whose peer stopped acknowledging is reset
+        self.transport.on_failure = self._transport_failed
+        
+        # Extra links of a router, see add_interface
+        self.interfaces = {}  # Maps interface name to its physical layer
+        
+        # Every layer records into the stack's metrics
+        for layer in (self.physical, self.data_link, self.network, self.transport,
+                      self.session, self.presentation, self.application):
+            layer.metrics = self.metrics
+        
         # Initialize routing
         self.data_link.add_mac_entry(mac_address, True)  # Local MAC
     
+    def _create_connection_stack(self, physical):
+        """Build the stack for one connection accepted by a multi-client server"""
+        stack = OSIStack(
+            mac_address=self.mac_address,
+            ip_address=self.ip_address,
+            wire_format=self.wire_format,
+            physical_layer=physical,
+            metrics=self.metrics  # Connections add up into the server's metrics
+        )
+        
+        # Configuration is shared with the server, protocol state is not
+        stack.network.routing_table = self.network.routing_table
+        stack.application.router = self.application.router
+        stack.application.worker_pool = self.application.worker_pool
+        stack.application.response_cache = self.application.response_cache
+        stack.data_link.configure_integrity(self.data_link.integrity, self.data_link.accepted_integrity)
+        stack.session.configure_sessions(self.session.sessions.max_sessions, self.session.sessions.idle_timeout)
+        return stack
+    
+    def configure_workers(self, mode='thread', max_workers=4, max_queue=64):
+        """Run application handlers in a bounded 'thread' or 'process' pool, or 'inline'"""
+        if self.application.worker_pool:
+            self.application.worker_pool.shutdown()
+        self.application.worker_pool = None if mode == 'inline' else WorkerPool(mode, max_workers, max_queue)
+        
+        # Connections accepted earlier by a multi-client server use it too
+        for stack in getattr(self.physical, 'connections', {}).values():
+            stack.application.worker_pool = self.application.worker_pool
+    
+    def configure_integrity(self, preferred='crc32', accepted=None):
+        """Frame check to send ('crc32', 'adler32', 'md5', 'blake2' or 'none') and the ones to accept.
+        
+        The algorithm actually sent is negotiated per link from what the peer
+        accepts. Only accept 'none' on links that are trusted end to end.
+        """
+        links = [self.data_link, *self.network.interfaces.values()]
+        links += [stack.data_link for stack in getattr(self.physical, 'connections', {}).values()]
+        for data_link in links:
+            data_link.configure_integrity(preferred, accepted)
+    
+    def configure_sessions(self, max_sessions=100000, idle_timeout=300.0):
+        """Cap each session table and expire sessions idle for idle_timeout seconds"""
+        self.session.configure_sessions(max_sessions, idle_timeout)
+        for stack in getattr(self.physical, 'connections', {}).values():
+            stack.session.configure_sessions(max_sessions, idle_timeout)
+    
+    def enable_response_cache(self, max_entries=1024, max_bytes=16 * 1024 * 1024, default_ttl=30, vary_headers=()):
+        """Cache responses to GET/HEAD requests we answer, keyed on method, path and vary_headers"""
+        self.application.response_cache = ResponseCache(max_entries, max_bytes, default_ttl, vary_headers)
+        for stack in getattr(self.physical, 'connections', {}).values():
+            stack.application.response_cache = self.application.response_cache
+    
+    def enable_client_cache(self, max_entries=1024, max_bytes=16 * 1024 * 1024, vary_headers=()):
+        """Cache responses to our own GET/HEAD requests and revalidate them by ETag"""
+        self.application.client_cache = ResponseCache(max_entries, max_bytes, 0, vary_headers)
+    
+    def cache_stats(self):
+        """Hit, miss and eviction counters of the response caches that are enabled"""
+        stats = {}
+        if self.application.response_cache is not None:
+            stats['server'] = self.application.response_cache.stats()
+        if self.application.client_cache is not None:
+            stats['client'] = self.application.client_cache.stats()
+        return stats
+    
+    def metrics_snapshot(self):
+        """Counters and latency histograms of every layer, plus cache counters"""
+        snapshot = self.metrics.snapshot()
+        caches = self.cache_stats()
+        if caches:
+            snapshot['caches'] = caches
+        return snapshot
+    
+    def export_metrics(self, format='json'):
+        """Metrics as a JSON document or as 'name value' text lines"""
+        return self.metrics.export(format)
+    
     def initialize(self):
         """Initialize the stack (start the physical layer)"""
         self.physical.initialize()
+        for physical in self.interfaces.values():
+            physical.initialize()
+    
+    def add_interface(self, name, physical_layer, mac_address):
+        """Attach another link with its own MAC address, e.g. to route between networks"""
+        data_link = DataLinkLayer(mac_address, self.codec)
+        data_link.mac_table = self.data_link.mac_table  # One learning table for all links
+        data_link.link_name = name
+        data_link.connect_to_physical_layer(physical_layer)
+        data_link.add_mac_entry(mac_address, True)
+        data_link.configure_integrity(self.data_link.integrity, self.data_link.accepted_integrity)
+        data_link.metrics = physical_layer.metrics = self.metrics
+        self.network.add_interface(name, data_link)
+        self.interfaces[name] = physical_layer
     
-    def add_route(self, destination_ip, next_hop_mac):
-        """Add a route to the network layer"""
-        self.network.add_route(destination_ip, next_hop_mac)
+    def enable_forwarding(self, enabled=True):
+        """Router mode: forward packets for other hosts along the routing table"""
+        self.network.forwarding = enabled
+    
+    def add_route(self, destination, next_hop_mac, metric=0, interface=None):
+        """Add a route to the network layer, destination is an IP or a 'a.b.c.d/n' prefix"""
+        self.network.add_route(destination, next_hop_mac, metric, interface)
     
     def register_application_handler(self, method, handler):
         """Register an application handler"""
         self.application.register_handler(method, handler)
     
-    def send_request(self, method, path, peer_ip, headers=None, body=None):
+    def register_route(self, method, pattern, handler):
+        """Register an application handler for one path pattern, e.g. '/users/{id}'"""
+        self.application.register_route(method, pattern, handler)
+    
+    def mount(self, prefix, handler, methods=None):
+        """Register an application handler for every path under prefix"""
+        self.application.mount(prefix, handler, methods)
+    
+    def open_session(self, peer_ip, weight=1):
+        """Open another logical session to peer_ip on this connection.
+        
+        Pass the returned id as session_id to send_request/submit_request.
+        Sessions have separate queues and flow control, and share the
+        connection in proportion to their weight.
+        """
+        return self.session.open_session(peer_ip, weight)
+    
+    def close_session(self, session_id):
+        self.session.close_session(session_id)
+    
+    def send_request(self, method, path, peer_ip, headers=None, body=None, session_id=None):
         """Send an HTTP-like request"""
-        return self.application.send_request(method, path, peer_ip, headers, body)
+        return self.application.send_request(method, path, peer_ip, headers, body, None, session_id)
+    
+    def submit_request(self, method, path, peer_ip, headers=None, body=None, timeout=None, session_id=None):
+        """Send an HTTP-like request, returns a Future for the parsed response"""
+        return self.application.submit_request(method, path, peer_ip, headers, body, timeout, session_id)
+    
+    def _transport_failed(self, error):
+        """Fail the requests waiting on the peer and drop the link, so the peer and any pool see it go"""
+        self.application.fail_pending(error)
+        self.physical.reset()
+    
+    def stop_timers(self):
+        """Cancel what every layer has scheduled, so nothing fires for a closed stack"""
+        self.transport.close()
+        self.session.close()
+        self.data_link.mac_table.stop()
+        self.application.close()
+    
+    def close_connection(self):
+        """Close the stack of one connection accepted by a multi-client server.
+        
+        Unlike close, it leaves what the connection shares with the server,
+        like the worker pool, running.
+        """
+        self.stop_timers()
+        self.physical.close()
     
     def close(self):
         """Shut down the stack"""
+        self.stop_timers()
         self.physical.close()
+        for physical in self.interfaces.values():
+            physical.close()
+        if self.application.worker_pool:
+            self.application.worker_pool.shutdown()
@@ -1,9 +1,136 @@
 # physical_layer.py
 import socket
 import struct
-from threading import Thread
+import time
+from threading import Condition, Thread
+
+from metrics import NULL_METRICS
+
+# Every frame on the wire is preceded by its length
+LENGTH_PREFIX = struct.Struct('!I')
+
+# Most systems cap the buffers of one sendmsg call at 1024 (IOV_MAX)
+MAX_WRITE_BUFFERS = 1024
+
+# Longest frame a peer may announce, the receive buffer never grows past it
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+
+def write_views(buffers):
+    """Views of the buffers to write, empty ones left out since no write would ever take them"""
+    return [memoryview(buffer) for buffer in buffers if len(buffer)]
+
+
+def skip_sent(views, index, sent):
+    """Move past the sent bytes of views[index:], returns the index of the first view not fully sent.
+    
+    A view sent in part is replaced by the view of its rest.
+    """
+    while index < len(views) and sent >= len(views[index]):
+        sent -= len(views[index])
+        index += 1
+    if sent:
+        views[index] = views[index][sent:]
+    return index
+
+
+def frame_buffers(data):
+    """The buffers of a frame (bytes, text, or a list of buffers sent back to back).
+    
+    Views of immutable bytes are kept as they are, anything that could change
+    before the frame is written, like a view of a receive buffer, is copied.
+    """
+    if isinstance(data, str):
+        return [data.encode()]
+    if not isinstance(data, (list, tuple)):
+        data = (data,)
+    buffers = []
+    for buffer in data:
+        if isinstance(buffer, str):
+            buffer = buffer.encode()
+        elif not (isinstance(buffer, bytes) or isinstance(buffer, memoryview) and isinstance(buffer.obj, bytes)):
+            buffer = bytes(buffer)
+        buffers.append(buffer)
+    return buffers
+
+
+class FrameReceiveBuffer:
+    """Preallocated receive buffer that finds frame boundaries in place.
+    
+    Socket data is read straight into a reusable bytearray with recv_into and
+    complete frames are handed out as memoryview slices of that buffer. A slice
+    is only valid until the next call to recv_from, so anything that keeps a
+    payload around must copy it first. A length prefix over max_frame_size
+    raises ConnectionError before any room is made for the frame.
+    """
+    
+    def __init__(self, size=65536, max_frame_size=MAX_FRAME_SIZE):
+        self.max_frame_size = max_frame_size
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.start = 0  # First byte not yet handed out
+        self.end = 0    # End of the received data
+    
+    def recv_from(self, sock):
+        """Receive into the free space of the buffer, returns 0 on EOF"""
+        if self.end == len(self.buffer):
+            self._make_room(len(self.buffer) - self.start + 1)
+        received = sock.recv_into(self.view[self.end:])
+        self.end += received
+        return received
+    
+    def frames(self):
+        """Yield a memoryview of every complete frame currently buffered"""
+        while self.end - self.start >= LENGTH_PREFIX.size:
+            data_length = LENGTH_PREFIX.unpack_from(self.buffer, self.start)[0]
+            if data_length > self.max_frame_size:
+                raise ConnectionError(f"Frame of {data_length} bytes is over the {self.max_frame_size} byte limit")
+            frame_start = self.start + LENGTH_PREFIX.size
+            frame_end = frame_start + data_length
+            if frame_end > self.end:
+                # Partial frame, make sure the rest of it will fit
+                if frame_end - self.start > len(self.buffer):
+                    self._make_room(frame_end - self.start)
+                break
+            self.start = frame_end
+            yield self.view[frame_start:frame_end]
+        
+        if self.start == self.end:
+            self.start = self.end = 0
+    
+    def _make_room(self, needed):
+        """Move the partial frame to the front, growing the buffer if it cannot hold it"""
+        pending = self.end - self.start
+        if needed > len(self.buffer):
+            # A fresh buffer keeps previously handed out slices intact
+            size = len(self.buffer)
+            while size < needed:
+                size *= 2
+            buffer = bytearray(size)
+            buffer[:pending] = self.view[self.start:self.end]
+            self.buffer = buffer
+            self.view = memoryview(buffer)
+        elif self.start:
+            self.buffer[:pending] = self.view[self.start:self.end]
+        self.start = 0
+        self.end = pending
+
 
 class PhysicalLayer:
+    """Length-prefixed frames over a TCP socket.
+    
+    Frames are written by a writer thread of the connection, or by the event
+    loop that serves it (see ConnectionServer). send_data only queues the
+    frame, and the writer sends everything queued in a single sendmsg call,
+    so frames from concurrent callers never interleave and a burst of small
+    frames costs one syscall. Like Nagle's algorithm the writer holds small
+    writes back, but only until flush_bytes are queued, the oldest frame has
+    waited flush_delay seconds or flush() is called; the transport flushes
+    at the end of every burst it sends. The kernel's own Nagle delay is
+    turned off with TCP_NODELAY. Senders block while max_queued_bytes are
+    waiting, which keeps back-pressure from the socket.
+    """
+    
     def __init__(self, is_server=False, host='127.0.0.1', port=12345):
         self.is_server = is_server
         self.host = host
@@ -12,6 +139,29 @@ class PhysicalLayer:
         self.connected = False
         self.data_link_layer = None
         self.server_socket = None  # For storing the server listening socket
+        self.receive_buffer = FrameReceiveBuffer()
+        self.metrics = NULL_METRICS
+        
+        # Outbound frames waiting for the writer thread
+        self.flush_bytes = 64 * 1024
+        self.flush_delay = 0.0005
+        self.max_queued_bytes = 4 * 1024 * 1024
+        self.outbound = []  # Length prefixes and frame buffers, in send order
+        self.outbound_bytes = 0
+        self.outbound_frames = 0
+        self.oldest_queued = None  # time.monotonic() when the oldest queued frame arrived
+        self.flush_requested = False
+        self.send_condition = Condition()
+        self.writer = None
+        
+        # Writes driven by an event loop instead of the writer thread: frames
+        # taken from the queue but not fully written yet, and whether the loop
+        # has been told there is something queued
+        self.write_loop = None
+        self.unsent = []
+        self.unsent_index = 0
+        self.unsent_frames = 0
+        self.write_requested = False
     
     def connect_to_data_link_layer(self, data_link_layer):
         self.data_link_layer = data_link_layer
@@ -30,67 +180,297 @@ class PhysicalLayer:
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.socket.connect((self.host, self.port))
             print(f"Connected to {self.host}:{self.port}")
-            self.connected = True
+            self.attach_socket(self.socket)
             
             # Start receiving thread
             Thread(target=self.receive_data).start()
     
     def _accept_connections(self):
         """Accept client connections in a separate thread"""
-        client_socket, addr = self.server_socket.accept()
-        self.socket = client_socket
+        try:
+            client_socket, addr = self.server_socket.accept()
+        except OSError:
+            return  # Closed before a client connected
         print(f"Connection from {addr}")
-        self.connected = True
+        self.attach_socket(client_socket)
         
         # Start receiving thread
         Thread(target=self.receive_data).start()
     
-    def send_data(self, data):
-        # Convert data to bitstream (bytes)
-        if isinstance(data, str):
-            bit_data = data.encode()
-        else:
-            bit_data = data
-            
+    def attach_socket(self, connected_socket, write_loop=None):
+        """Use an already connected socket (e.g. one accepted by a ConnectionServer).
+        
+        Without a write_loop frames are written by a thread of our own. With
+        one the socket must be non-blocking, and the loop calls write_delay
+        and write_available when we ask it to with request_write(self).
+        """
+        self.socket = connected_socket
+        # Our writer already batches, the kernel must not delay small frames
+        # further while it waits for the peer's delayed ACK. Only TCP has it
+        if connected_socket.family in (socket.AF_INET, socket.AF_INET6):
+            connected_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.connected = True
+        self.write_loop = write_loop
+        if write_loop is None:
+            self.writer = Thread(target=self._write_frames, name='physical-writer', daemon=True)
+            self.writer.start()
+    
+    def configure_writes(self, flush_bytes=64 * 1024, flush_delay=0.0005, max_queued_bytes=4 * 1024 * 1024):
+        """Tune write coalescing: flush_delay=0 sends as soon as the writer is free"""
+        with self.send_condition:
+            self.flush_bytes = flush_bytes
+            self.flush_delay = flush_delay
+            self.max_queued_bytes = max_queued_bytes
+            self.send_condition.notify_all()
+    
+    def send_data(self, data, flush=False):
+        """Queue a frame for the writer thread, flush=True sends it without waiting for more.
+        
+        A frame given as a list of buffers is written with them in place,
+        the writer gathers them into its sendmsg call.
+        """
+        buffers = frame_buffers(data)
+        length = sum(len(buffer) for buffer in buffers)
+        
         # Only send if we're connected
-        if self.connected and self.socket:
+        if not (self.connected and self.socket):
+            print("Cannot send data: not connected")
+            self.metrics.count('physical.dropped.not_connected')
+            return
+        
+        with self.send_condition:
+            while self.outbound_bytes >= self.max_queued_bytes and self.connected:
+                if self.write_loop is not None and self.write_loop.in_loop():
+                    break  # Only the loop drains the queue, it must not wait for itself
+                self.send_condition.wait()
+            if not self.connected:
+                self.metrics.count('physical.dropped.not_connected')
+                return
+            
             # Send data length first, then data
-            data_len = len(bit_data)
-            self.socket.sendall(struct.pack('!I', data_len))
-            self.socket.sendall(bit_data)
+            was_due = self.flush_requested or self.outbound_bytes >= self.flush_bytes
+            self.outbound.append(LENGTH_PREFIX.pack(length))
+            self.outbound.extend(buffers)
+            self.outbound_bytes += length + LENGTH_PREFIX.size
+            self.outbound_frames += 1
+            if self.oldest_queued is None:
+                self.oldest_queued = time.monotonic()
+            self.flush_requested = self.flush_requested or flush
+            self.send_condition.notify_all()
+            
+            # A loop is told about the first frame, and again when the queue
+            # becomes due before the delay it is waiting out
+            due = self.flush_requested or self.outbound_bytes >= self.flush_bytes
+            wake = self.write_loop is not None and (not self.write_requested or due and not was_due)
+            self.write_requested = self.write_requested or wake
+        self.metrics.count('physical.frames_sent')
+        if wake:
+            self.write_loop.request_write(self)
+    
+    def flush(self):
+        """Send queued frames now instead of waiting to coalesce more"""
+        wake = False
+        with self.send_condition:
+            if self.outbound:
+                wake = self.write_loop is not None and not self.flush_requested
+                self.flush_requested = True
+                self.write_requested = self.write_requested or wake
+                self.send_condition.notify_all()
+        if wake:
+            self.write_loop.request_write(self)
+    
+    def _release_wait(self):
+        """Seconds the queued frames may still wait for more, 0 once they are due.
+        
+        Called with send_condition held and frames queued.
+        """
+        # Whatever is queued goes at once when closing
+        if self.flush_requested or not self.connected or self.outbound_bytes >= self.flush_bytes:
+            return 0
+        return max(self.oldest_queued + self.flush_delay - time.monotonic(), 0)
+    
+    def _take_batch(self):
+        """Take every queued frame, called with send_condition held"""
+        batch, self.outbound = self.outbound, []
+        size, self.outbound_bytes = self.outbound_bytes, 0
+        frames, self.outbound_frames = self.outbound_frames, 0
+        self.oldest_queued = None
+        self.flush_requested = False
+        self.send_condition.notify_all()  # Wake senders blocked on a full queue
+        return batch, size, frames
+    
+    def _next_batch(self):
+        """Wait until the flush policy releases the queued frames, then take them all"""
+        with self.send_condition:
+            while True:
+                if not self.outbound:
+                    if not self.connected:
+                        return None
+                    self.send_condition.wait()
+                    continue
+                
+                wait = self._release_wait()
+                if not wait:
+                    return self._take_batch()
+                self.send_condition.wait(wait)
+    
+    def _write_frames(self):
+        """Writer thread: send each released batch with as few syscalls as possible"""
+        while True:
+            taken = self._next_batch()
+            if taken is None:
+                break
+            batch, size, frames = taken
+            try:
+                start = time.perf_counter()
+                writes = self._write(batch)
+                self.metrics.observe('physical.send', time.perf_counter() - start)
+                self.metrics.count('physical.writes', writes)
+                self.metrics.count('physical.bytes_sent', size)
+            except OSError as e:
+                self._send_failed(e, frames)
+                break
+    
+    def _send_failed(self, error, frames):
+        print(f"Physical layer send error: {error}")
+        self.metrics.count('physical.dropped.send_error', frames)
+        with self.send_condition:
+            self.connected = False
+            self.send_condition.notify_all()
+    
+    def _write(self, buffers):
+        """Gathered write of all buffers, returns the number of syscalls it took"""
+        if not hasattr(self.socket, 'sendmsg'):
+            self.socket.sendall(b''.join(buffers))  # No scatter/gather here
+            return 1
+        
+        writes = 0
+        views = write_views(buffers)
+        index = 0
+        while index < len(views):
+            index = self._send_some(views, index)
+            writes += 1
+        return writes
+    
+    def _send_some(self, views, index):
+        """One write from views[index:], returns the index of the first view not fully sent"""
+        if hasattr(self.socket, 'sendmsg'):
+            sent = self.socket.sendmsg(views[index:index + MAX_WRITE_BUFFERS])
         else:
-            print("Cannot send data: not connected")
+            sent = self.socket.send(views[index])
+        if not sent:
+            raise ConnectionError("Socket accepted no data")
+        return skip_sent(views, index, sent)
+    
+    def write_delay(self):
+        """Event loop: seconds until queued frames are due, 0 if they are, None if nothing is queued"""
+        with self.send_condition:
+            if self.unsent:
+                return 0
+            if not self.outbound:
+                self.write_requested = False  # The next frame tells the loop again
+                return None
+            return self._release_wait()
+    
+    def write_available(self):
+        """Event loop: write the frames that are due until the socket would block.
         
+        Returns True when it would block with frames still due, the loop then
+        waits for the socket to become writable and calls it again.
+        """
+        try:
+            while True:
+                if not self.unsent:
+                    with self.send_condition:
+                        if not self.outbound or self._release_wait():
+                            return False
+                        batch, size, frames = self._take_batch()
+                    self.unsent = write_views(batch)
+                    self.unsent_index = 0
+                    self.unsent_frames = frames
+                    self.metrics.count('physical.bytes_sent', size)
+                
+                self.unsent_index = self._send_some(self.unsent, self.unsent_index)
+                self.metrics.count('physical.writes')
+                if self.unsent_index == len(self.unsent):
+                    self.unsent = []
+        except BlockingIOError:
+            return True
+        except OSError as e:
+            # What is left can never be sent
+            with self.send_condition:
+                frames = self._take_batch()[2] + (self.unsent_frames if self.unsent else 0)
+            self.unsent = []
+            self._send_failed(e, frames)
+            return False
+    
+    
+    def receive_available(self):
+        """Read once from the socket and pass up every complete frame, False on EOF"""
+        received = self.receive_buffer.recv_from(self.socket)
+        if not received:
+            return False
+        self.metrics.count('physical.bytes_received', received)
+        
+        for frame in self.receive_buffer.frames():
+            self.metrics.count('physical.frames_received')
+            if self.data_link_layer:
+                self.data_link_layer.receive_from_physical(frame)
+        return True
+    
     def receive_data(self):
         while self.connected:
             try:
-                # First receive the length of incoming data
-                length_bytes = self.socket.recv(4)
-                if not length_bytes:
+                # Read whatever has arrived, then hand up every complete frame
+                if not self.receive_available():
+                    self._disconnected()  # Peer closed the connection
                     break
-                
-                data_length = struct.unpack('!I', length_bytes)[0]
-                
-                # Receive the actual data
-                received_data = b''
-                while len(received_data) < data_length:
-                    packet = self.socket.recv(data_length - len(received_data))
-                    if not packet:
-                        break
-                    received_data += packet
-                
-                if self.data_link_layer:
-                    self.data_link_layer.receive_from_physical(received_data)
             
             except Exception as e:
-                print(f"Physical layer receive error: {e}")
-                self.connected = False
+                if self.connected:  # Not just closed underneath us
+                    print(f"Physical layer receive error: {e}")
+                self.reset()  # The stream cannot be read past this point
                 break
     
+    def _disconnected(self):
+        with self.send_condition:
+            self.connected = False
+            self.send_condition.notify_all()  # The writer sends what is left and stops
+    
+    def reset(self):
+        """Drop the connection from any thread without sending what is queued.
+        
+        The socket is only shut down: the thread or event loop reading it sees
+        EOF and cleans up as when the peer closes, close still releases it.
+        """
+        with self.send_condition:
+            self.connected = False
+            self.send_condition.notify_all()
+        if self.socket is not None:
+            try:
+                self.socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass  # Not connected (any more)
+    
     def close(self):
-        self.connected = False
-        if self.socket:
-            self.socket.close()
-        if self.server_socket:
-            self.server_socket.close()
+        # Let the writer send what is already queued before the socket goes
+        with self.send_condition:
+            self.connected = False
+            self.flush_requested = True
+            self.send_condition.notify_all()
+        if self.writer is not None and self.writer.is_alive():
+            self.writer.join(timeout=1.0)
+        elif self.write_loop is not None:
+            self.write_available()  # Whatever the socket takes without blocking
+        
+        # Closing a socket does not wake a thread blocked in recv_into or
+        # accept on it, shutting it down does
+        for sock in (self.socket, self.server_socket):
+            if sock is None:
+                continue
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass  # Not connected (any more)
+            sock.close()
         print("Physical connection closed")
\ No newline at end of file
@@ -1,13 +1,31 @@
 # presentation_layer.py
 import json
 import base64
+import threading
+import time
+from compression import CODECS, ZlibStream, is_compressible
+from messages import Message
+from metrics import NULL_METRICS
 
 class PresentationLayer:
     def __init__(self):
         self.session_layer = None
         self.application_layer = None
         self.encoding = 'utf-8'
-        self.compression_enabled = False
+        self.compression_enabled = True
+        self.compression_codec = 'zlib'  # Preferred codec, see compression.CODECS
+        self.compression_threshold = 256  # Smaller payloads are sent as-is
+        self.streaming_compression = True  # Share one zlib context per session
+        self.stream_contexts = {}  # Maps session_id to its ZlibStream
+        self.peer_codecs = {}  # Maps peer IP to the codecs it has advertised
+        self.key = b'SECRET'  # XOR key shared with every peer
+        self.metrics = NULL_METRICS
+        # Stream-compressed messages must be queued in the order they were
+        # compressed, even when several threads send responses at once. Each
+        # session has its own lock, so sessions are encoded in parallel;
+        # send_lock only guards the table of locks and contexts
+        self.session_locks = {}  # Maps session_id to the lock serializing its sends
+        self.send_lock = threading.Lock()
     
     def connect_to_session_layer(self, session_layer):
         self.session_layer = session_layer
@@ -16,98 +34,222 @@ class PresentationLayer:
     def connect_to_application_layer(self, application_layer):
         self.application_layer = application_layer
     
+    def xor_cipher(self, data, position=0):
+        """XOR data with the repeated key in one bulk big-integer operation.
+        
+        position is the offset of data within the whole stream, so a payload
+        processed in chunks gives the same result as processing it at once.
+        """
+        length = len(data)
+        if not length:
+            return b''
+        
+        key = self.key
+        start = position % len(key)
+        keystream = (key * ((start + length) // len(key) + 1))[start:start + length]
+        
+        mixed = int.from_bytes(data, 'little') ^ int.from_bytes(keystream, 'little')
+        return mixed.to_bytes(length, 'little')
+    
+    def encrypt_into(self, data, out, position=0):
+        """XOR data into the caller's writable buffer, returns the number of bytes written"""
+        if isinstance(data, str):
+            data = data.encode(self.encoding)
+        
+        length = len(data)
+        memoryview(out)[:length] = self.xor_cipher(data, position)
+        return length
+    
+    def decrypt_into(self, data, out, position=0):
+        """Inverse of encrypt_into (XOR is its own inverse)"""
+        return self.encrypt_into(data, out, position)
+    
     def encrypt(self, data):
         """Simple XOR 'encryption' - not secure but demonstrates the concept"""
-        key = b'SECRET'
         if isinstance(data, str):
             data = data.encode(self.encoding)
             
-        encrypted = bytearray()
-        for i, byte in enumerate(data):
-            encrypted.append(byte ^ key[i % len(key)])
+        encrypted = self.xor_cipher(data)
         
         # Base64 encode to make it transportable
         return base64.b64encode(encrypted).decode()
     
     def decrypt(self, data):
         """Decrypt data that was encrypted with the encrypt method"""
-        key = b'SECRET'
         # Base64 decode
         try:
             data = base64.b64decode(data)
             
-            decrypted = bytearray()
-            for i, byte in enumerate(data):
-                decrypted.append(byte ^ key[i % len(key)])
+            decrypted = self.xor_cipher(data)
             
             return decrypted.decode(self.encoding)
         except:
             # If it's not properly encrypted/encoded, return as is
             return data
     
-    def compress(self, data):
-        """Simple compression placeholder - in a real implementation you would use zlib or similar"""
-        if self.compression_enabled:
-            # This is a simplified placeholder
-            return f"COMPRESSED:{data}"
-        return data
+    def supported_codecs(self):
+        """Codec names this layer can decode, advertised in every envelope"""
+        return list(CODECS) + [ZlibStream.name]
+    
+    def _stream_context(self, session_id):
+        # Sending and receiving threads must end up with the same context
+        context = self.stream_contexts.get(session_id)
+        if context is None:
+            with self.send_lock:
+                context = self.stream_contexts.get(session_id)
+                if context is None:
+                    context = self.stream_contexts[session_id] = ZlibStream()
+        return context
+    
+    def _session_lock(self, session_id):
+        with self.send_lock:
+            lock = self.session_locks.get(session_id)
+            if lock is None:
+                lock = self.session_locks[session_id] = threading.Lock()
+            return lock
+    
+    def release_session(self, session_id):
+        """Forget the compression context of a session that has ended"""
+        with self.send_lock:
+            self.stream_contexts.pop(session_id, None)
+            self.session_locks.pop(session_id, None)
+    
+    def compress(self, data, session_id=None, peer_ip=None):
+        """Pick a codec for this payload and compress it, returns (codec name, bytes)"""
+        if isinstance(data, str):
+            data = data.encode(self.encoding)
+        
+        # Only compress for peers that told us they can decompress, and only
+        # when the payload is large enough and looks compressible
+        accepted = self.peer_codecs.get(peer_ip, ())
+        codec_name = self.compression_codec
+        if (not self.compression_enabled
+                or codec_name not in accepted
+                or len(data) < self.compression_threshold
+                or not is_compressible(data)):
+            return 'none', data
+        
+        if (codec_name == 'zlib' and self.streaming_compression
+                and session_id is not None and ZlibStream.name in accepted):
+            return ZlibStream.name, self._stream_context(session_id).compress(data)
+        
+        return codec_name, CODECS[codec_name].compress(data)
+    
+    def decompress(self, data, codec_name, session_id=None):
+        """Decompress a payload with the codec recorded in its envelope"""
+        if codec_name == ZlibStream.name:
+            return self._stream_context(session_id).decompress(data)
+        return CODECS[codec_name].decompress(data)
     
-    def decompress(self, data):
-        """Decompress data that was compressed with the compress method"""
-        if self.compression_enabled and isinstance(data, str) and data.startswith("COMPRESSED:"):
+    def legacy_decompress(self, data):
+        """Strip the placeholder compression used by peers without codec support"""
+        if isinstance(data, str) and data.startswith("COMPRESSED:"):
             return data[11:]  # Remove the "COMPRESSED:" prefix
         return data
     
-    def encode(self, data):
-        """Encode data for transmission"""
+    def encode(self, data, session_id=None, peer_ip=None):
+        """Encode data (an application Message, text or bytes) for transmission"""
+        start = time.perf_counter()
+        if isinstance(data, Message):
+            data = data.to_json()
+        codec_name, payload = self.compress(data, session_id, peer_ip)
+        compressed_at = time.perf_counter()
+        encrypted = self.encrypt(payload)
+        encrypted_at = time.perf_counter()
+        
         # Wrap in a presentation layer envelope
         envelope = {
             'encoding': self.encoding,
-            'compressed': self.compression_enabled,
+            'compressed': codec_name != 'none',
+            'codec': codec_name,
+            'accept': self.supported_codecs(),
             'encrypted': True,
-            'data': self.encrypt(self.compress(data))
+            'data': encrypted
         }
+        encoded = json.dumps(envelope)
         
-        return json.dumps(envelope)
+        self.metrics.observe('presentation.compress', compressed_at - start)
+        self.metrics.observe('presentation.cipher', encrypted_at - compressed_at)
+        self.metrics.observe('presentation.encode', time.perf_counter() - start)
+        self.metrics.count('presentation.bytes_compressed', len(payload))
+        return encoded
     
-    def decode(self, data):
+    def decode(self, data, session_id=None):
         """Decode received data"""
+        codec_name = None
         try:
+            # json.loads takes bytes but not a view of them
+            if isinstance(data, memoryview):
+                data = data.tobytes()
             envelope = json.loads(data)
             
             # Extract the metadata
             encoding = envelope.get('encoding', self.encoding)
             compressed = envelope.get('compressed', False)
             encrypted = envelope.get('encrypted', False)
+            codec_name = envelope.get('codec')
+            
+            # Remember what the peer can decompress for our replies
+            if 'accept' in envelope:
+                self.peer_codecs[self._session_peer(session_id)] = set(envelope['accept'])
             
             # Process the data according to the metadata
             result = envelope['data']
             
-            if encrypted:
-                result = self.decrypt(result)
+            if codec_name is None:
+                # Envelope from a peer without codec support
+                if encrypted:
+                    result = self.decrypt(result)
+                
+                if compressed:
+                    result = self.legacy_decompress(result)
+                
+                return result
             
-            if compressed:
-                result = self.decompress(result)
+            start = time.perf_counter()
+            payload = base64.b64decode(result)
+            if encrypted:
+                payload = self.xor_cipher(payload)
+            deciphered_at = time.perf_counter()
             
-            return result
+            decoded = self.decompress(payload, codec_name, session_id).decode(encoding)
+            self.metrics.observe('presentation.cipher', deciphered_at - start)
+            self.metrics.observe('presentation.decompress', time.perf_counter() - deciphered_at)
+            return decoded
         
         except Exception as e:
             print(f"Presentation layer decode error: {e}")
+            self.metrics.count('presentation.dropped.decode_error')
+            
+            # Our stream context no longer matches the peer's, every later
+            # message of the session would fail too
+            if codec_name == ZlibStream.name and self.session_layer:
+                self.session_layer.reset_session(session_id)
             # If decoding fails, return the raw data
             return data
     
-    def send_to_session(self, data, peer_ip):
-        """Encode and send data through the session layer"""
-        encoded_data = self.encode(data)
-        
+    def _session_peer(self, session_id):
+        if self.session_layer:
+            return self.session_layer.peer_of(session_id)
+        return None
+    
+    def send_to_session(self, data, peer_ip, session_id=None):
+        """Encode and send data through the session layer, on the current session unless one is given"""
         if self.session_layer:
-            return self.session_layer.send_to_presentation(encoded_data, peer_ip)
+            # The session is picked first so its compression context can be used
+            if session_id is None:
+                session_id = self.session_layer.session_for_peer(peer_ip)
+            with self._session_lock(session_id):
+                encoded_data = self.encode(data, session_id, peer_ip)
+                return self.session_layer.send_to_transport(encoded_data, session_id)
         
         return False
     
     def receive_from_session(self, data, session_id):
         """Receive and decode data from the session layer"""
-        decoded_data = self.decode(data)
+        start = time.perf_counter()
+        decoded_data = self.decode(data, session_id)
+        self.metrics.observe('presentation.decode', time.perf_counter() - start)
         
         print(f"Data received and decoded in presentation layer")
         
@@ -115,8 +257,8 @@ class PresentationLayer:
         if self.application_layer:
             self.application_layer.receive_from_presentation(decoded_data, session_id)
     
-    def send_to_application(self, data, peer_ip):
+    def send_to_application(self, data, peer_ip, session_id=None):
         """Send data to the application layer after appropriate processing"""
         if self.session_layer:
-            return self.send_to_session(data, peer_ip)
+            return self.send_to_session(data, peer_ip, session_id)
         return False
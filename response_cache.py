@@ -0,0 +1,133 @@
+# response_cache.py
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+CACHEABLE_METHODS = ('GET', 'HEAD')
+
+def compute_etag(body):
+    """Strong validator for a response body"""
+    if not isinstance(body, (str, bytes)):
+        body = json.dumps(body, sort_keys=True)
+    if isinstance(body, str):
+        body = body.encode()
+    return '"' + hashlib.blake2b(body, digest_size=8).hexdigest() + '"'
+
+
+def max_age(headers, default):
+    """TTL from a Cache-Control header, None when the response must not be stored"""
+    for directive in (headers or {}).get('Cache-Control', '').split(','):
+        directive = directive.strip()
+        if directive in ('no-store', 'private'):
+            return None
+        if directive.startswith('max-age='):
+            try:
+                return max(int(directive[8:]), 0)
+            except ValueError:
+                pass
+    return default
+
+
+class ResponseCache:
+    """LRU cache of responses with a TTL per entry and a memory budget.
+    
+    Keys are (method, path, values of the vary headers). Expired entries are
+    kept until evicted so that they can still be revalidated by ETag.
+    """
+    
+    def __init__(self, max_entries=1024, max_bytes=16 * 1024 * 1024, default_ttl=30, vary_headers=()):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.vary_headers = tuple(vary_headers)
+        self.entries = OrderedDict()  # Maps key to entry dict, least recently used first
+        self.size = 0
+        self.lock = threading.Lock()
+        
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.not_modified = 0
+    
+    def key(self, method, path, headers=None):
+        headers = headers or {}
+        return (method, path) + tuple(headers.get(name) for name in self.vary_headers)
+    
+    def get(self, key, allow_stale=False):
+        """Return the entry for key; expired entries only when allow_stale is set"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or (not allow_stale and entry['expires'] <= time.monotonic()):
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+    
+    def put(self, key, status_code, status_message, headers, body, ttl=None):
+        """Store a response, returns the stored entry (None if it cannot be cached)"""
+        ttl = max_age(headers, self.default_ttl if ttl is None else ttl)
+        if ttl is None:
+            return None
+        
+        headers = dict(headers or {})
+        etag = headers.get('ETag') or compute_etag(body)
+        headers['ETag'] = etag
+        entry = {
+            'status_code': status_code,
+            'status_message': status_message,
+            'headers': headers,
+            'body': body,
+            'etag': etag,
+            'expires': time.monotonic() + ttl,
+            'size': len(json.dumps(body)) + len(json.dumps(headers))
+        }
+        if entry['size'] > self.max_bytes:
+            return None
+        
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= old['size']
+            self.entries[key] = entry
+            self.size += entry['size']
+            
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= evicted['size']
+                self.evictions += 1
+        return entry
+    
+    def matches(self, entry, if_none_match):
+        """True if an If-None-Match header names the entry's ETag"""
+        if not if_none_match:
+            return False
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        if '*' in tags or entry['etag'] in tags:
+            with self.lock:
+                self.not_modified += 1
+            return True
+        return False
+    
+    def refresh(self, entry, ttl):
+        """Extend the lifetime of an entry that was revalidated"""
+        entry['expires'] = time.monotonic() + ttl
+    
+    def invalidate(self, path=None):
+        """Drop every entry, or only those for one path"""
+        with self.lock:
+            for key in [key for key in self.entries if path is None or key[1] == path]:
+                self.size -= self.entries.pop(key)['size']
+    
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'not_modified': self.not_modified
+            }
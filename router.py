@@ -0,0 +1,112 @@
+# router.py
+import threading
+from collections import OrderedDict
+
+class RouteNode:
+    """One path segment in the route trie"""
+    __slots__ = ('children', 'param_name', 'param_child', 'handlers', 'mounts')
+    
+    def __init__(self):
+        self.children = {}  # Maps a literal segment to its node
+        self.param_name = None
+        self.param_child = None  # Node matching any segment, e.g. {id}
+        self.handlers = {}  # Maps method to the handler for this exact path
+        self.mounts = {}  # Maps method to a handler for every path below
+
+
+class Router:
+    """Dispatches (method, path) to handlers through a trie of path segments.
+    
+    Patterns are split on '/' into literal segments and {name} parameters.
+    A lookup walks one node per segment, so its cost depends on the depth of
+    the path rather than on how many routes are registered. Literal segments
+    win over parameters, and an exact route wins over a prefix mount.
+    """
+    ANY_METHOD = '*'
+    
+    def __init__(self, cache_size=1024):
+        self.root = RouteNode()
+        self.cache = OrderedDict()  # Maps (method, path) to (handler, params)
+        self.cache_size = cache_size
+        self.lock = threading.Lock()
+    
+    @staticmethod
+    def split(path):
+        return [segment for segment in path.split('/') if segment]
+    
+    def _node_for(self, pattern):
+        node = self.root
+        for segment in self.split(pattern):
+            if segment.startswith('{') and segment.endswith('}'):
+                name = segment[1:-1]
+                if node.param_child is None:
+                    node.param_child = RouteNode()
+                    node.param_name = name
+                elif node.param_name != name:
+                    raise ValueError(f"Conflicting parameter names {{{node.param_name}}} and {{{name}}} in {pattern}")
+                node = node.param_child
+            else:
+                node = node.children.setdefault(segment, RouteNode())
+        return node
+    
+    def add_route(self, method, pattern, handler):
+        """Route requests for exactly this path pattern, e.g. '/users/{id}'"""
+        with self.lock:
+            self._node_for(pattern).handlers[method] = handler
+            self.cache.clear()
+    
+    def mount(self, prefix, handler, methods=None):
+        """Route every path under prefix to handler (all methods if methods is None)"""
+        with self.lock:
+            node = self._node_for(prefix)
+            for method in methods or (self.ANY_METHOD,):
+                node.mounts[method] = handler
+            self.cache.clear()
+    
+    def resolve(self, method, path):
+        """Return (handler, params) for a request, or (None, None) if nothing matches"""
+        key = (method, path)
+        with self.lock:
+            cached = self.cache.get(key)
+            if cached is not None:
+                self.cache.move_to_end(key)
+                return cached[0], dict(cached[1])
+        
+        segments = self.split(path)
+        result = self._match(self.root, segments, 0, method, {})
+        if result is None:
+            return None, None
+        
+        with self.lock:
+            self.cache[key] = (result[0], dict(result[1]))
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return result
+    
+    def _match(self, node, segments, index, method, params):
+        if index == len(segments):
+            handler = node.handlers.get(method) or node.handlers.get(self.ANY_METHOD)
+            if handler:
+                return handler, dict(params)
+        else:
+            segment = segments[index]
+            child = node.children.get(segment)
+            if child is not None:
+                result = self._match(child, segments, index + 1, method, params)
+                if result:
+                    return result
+            
+            if node.param_child is not None:
+                params[node.param_name] = segment
+                result = self._match(node.param_child, segments, index + 1, method, params)
+                del params[node.param_name]
+                if result:
+                    return result
+        
+        # Fall back to a prefix mount at this depth, the rest of the path is passed on
+        handler = node.mounts.get(method) or node.mounts.get(self.ANY_METHOD)
+        if handler:
+            mounted = dict(params)
+            mounted['*'] = '/' + '/'.join(segments[index:])
+            return handler, mounted
+        return None
@@ -0,0 +1,154 @@
+# routing_table.py
+import socket
+import struct
+import threading
+from collections import OrderedDict
+
+IPV4_BITS = 32
+
+def parse_prefix(destination):
+    """Turn 'a.b.c.d/n' (or a bare address, meaning /32) into (network int, length)"""
+    address, _, length = destination.partition('/')
+    length = int(length) if length else IPV4_BITS
+    if not 0 <= length <= IPV4_BITS:
+        raise ValueError(f"Invalid prefix length in {destination}")
+    network = ip_to_int(address)
+    if network is None:
+        raise ValueError(f"Invalid IPv4 address in {destination}")
+    mask = ((1 << length) - 1) << (IPV4_BITS - length)
+    return network & mask, length
+
+
+def ip_to_int(ip_address):
+    try:
+        return struct.unpack('!I', socket.inet_aton(ip_address))[0]
+    except (OSError, TypeError):
+        return None
+
+
+def int_to_ip(value):
+    return socket.inet_ntoa(struct.pack('!I', value))
+
+
+class Route:
+    """One entry of the routing table"""
+    __slots__ = ('network', 'length', 'next_hop', 'metric', 'interface')
+    
+    def __init__(self, network, length, next_hop, metric=0, interface=None):
+        self.network = network
+        self.length = length
+        self.next_hop = next_hop  # MAC address of the next hop on the link
+        self.metric = metric  # Lower wins among routes for the same prefix
+        self.interface = interface  # Name of the link to send on, None for the main one
+    
+    @property
+    def prefix(self):
+        return f"{int_to_ip(self.network)}/{self.length}"
+    
+    def __repr__(self):
+        return f"Route({self.prefix} via {self.next_hop} metric {self.metric})"
+
+
+class RouteNode:
+    """One bit of the prefix trie"""
+    __slots__ = ('children', 'routes')
+    
+    def __init__(self):
+        self.children = [None, None]
+        self.routes = []  # Routes for exactly this prefix, best metric first
+
+
+class RoutingTable:
+    """IPv4 longest-prefix-match table on a binary trie.
+    
+    A lookup walks at most one node per address bit and remembers the last
+    node that carried routes, so it costs O(prefix length) however many
+    routes there are. 0.0.0.0/0 is the default route. Recent lookups are
+    kept in a small LRU cache that is cleared whenever the table changes.
+    """
+    
+    def __init__(self, cache_size=1024):
+        self.root = RouteNode()
+        self.count = 0
+        self.cache = OrderedDict()  # Maps destination IP to its Route (or None)
+        self.cache_size = cache_size
+        self.lock = threading.Lock()
+    
+    def _node_for(self, network, length, create):
+        node = self.root
+        for bit_index in range(length):
+            bit = (network >> (IPV4_BITS - 1 - bit_index)) & 1
+            child = node.children[bit]
+            if child is None:
+                if not create:
+                    return None
+                child = node.children[bit] = RouteNode()
+            node = child
+        return node
+    
+    def add(self, destination, next_hop, metric=0, interface=None):
+        """Add a route to 'a.b.c.d/n' (a bare address is a /32), replacing one with the same next hop"""
+        network, length = parse_prefix(destination)
+        route = Route(network, length, next_hop, metric, interface)
+        with self.lock:
+            node = self._node_for(network, length, True)
+            before = len(node.routes)
+            node.routes = [existing for existing in node.routes if existing.next_hop != next_hop]
+            node.routes.append(route)
+            node.routes.sort(key=lambda candidate: candidate.metric)
+            self.count += len(node.routes) - before
+            self.cache.clear()
+        return route
+    
+    def remove(self, destination, next_hop=None):
+        """Remove the routes to a prefix (only the one via next_hop if given)"""
+        network, length = parse_prefix(destination)
+        with self.lock:
+            node = self._node_for(network, length, False)
+            if node is None:
+                return
+            before = len(node.routes)
+            node.routes = [route for route in node.routes if next_hop is not None and route.next_hop != next_hop]
+            self.count -= before - len(node.routes)
+            self.cache.clear()
+    
+    def lookup(self, ip_address):
+        """Best route for a destination address, or None"""
+        with self.lock:
+            if ip_address in self.cache:
+                self.cache.move_to_end(ip_address)
+                return self.cache[ip_address]
+            
+            best = None
+            address = ip_to_int(ip_address)
+            if address is not None:
+                node = self.root
+                for bit_index in range(IPV4_BITS + 1):
+                    if node.routes:
+                        best = node.routes[0]
+                    if bit_index == IPV4_BITS:
+                        break
+                    node = node.children[(address >> (IPV4_BITS - 1 - bit_index)) & 1]
+                    if node is None:
+                        break
+            elif self.root.routes:
+                best = self.root.routes[0]  # Not an IPv4 address, only the default route applies
+            
+            self.cache[ip_address] = best
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+            return best
+    
+    def routes(self):
+        """Every route in the table, shortest prefix first"""
+        found = []
+        with self.lock:
+            stack = [self.root]
+            while stack:
+                node = stack.pop()
+                found.extend(node.routes)
+                stack.extend(child for child in node.children if child is not None)
+        return sorted(found, key=lambda route: (route.length, route.network, route.metric))
+    
+    def __len__(self):
+        return self.count
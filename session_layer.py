@@ -1,14 +1,40 @@
 # session_layer.py
-import json
+import threading
 import time
-import random
+from collections import deque
+
+from messages import SessionEnvelope
+from metrics import NULL_METRICS
+from session_manager import SessionManager
+from wire_format import detach
 
 class SessionLayer:
-    def __init__(self):
+    """Multiplexes any number of logical sessions over one transport connection.
+    
+    Every session has its own send queue and its own flow-control window:
+    the receiver advertises how many bytes it takes per session and gives
+    credit back as it delivers them, so a session whose reader lags stops
+    sending without holding up the others. Queued messages are handed to
+    the transport by deficit round robin, each session earning quantum *
+    weight bytes per round, and only while the transport backlog is short,
+    so a bulk transfer cannot starve small requests on another session.
+    """
+    
+    def __init__(self, window=256 * 1024, quantum=16 * 1024, max_backlog=2):
         self.transport_layer = None
         self.presentation_layer = None
-        self.sessions = {}  # Maps session_id to session state
+        self.sessions = SessionManager(on_close=self._session_ended)
         self.current_session_id = None
+        self.metrics = NULL_METRICS
+        
+        self.window = window  # Bytes we accept per session before giving credit back
+        self.quantum = quantum  # Bytes a session of weight 1 may send per round
+        self.max_backlog = max_backlog  # Messages the transport may hold unsent
+        self.active = deque()  # Sessions with queued data and credit, in round robin order
+        self.turn_started = False  # Whether the session at the head already got its quantum
+        self.send_lock = threading.Lock()  # Guards the queues and the scheduler
+        self.current_lock = threading.RLock()  # Guards current_session_id
+        self.reordering = set()  # Sessions holding back messages that arrived early
     
     def connect_to_transport_layer(self, transport_layer):
         self.transport_layer = transport_layer
@@ -17,94 +43,306 @@ class SessionLayer:
     def connect_to_presentation_layer(self, presentation_layer):
         self.presentation_layer = presentation_layer
     
+    def configure_sessions(self, max_sessions=100000, idle_timeout=300.0):
+        """Cap the session table and set how long an idle session lives"""
+        self.sessions.max_sessions = max_sessions
+        self.sessions.idle_timeout = idle_timeout
+    
     def create_session(self, peer_ip):
         """Initialize a new session with a peer"""
-        session_id = f"{random.randint(1000, 9999)}"
-        
-        self.sessions[session_id] = {
-            'peer_ip': peer_ip,
-            'state': 'ESTABLISHED',
-            'last_activity': time.time()
-        }
-        
-        self.current_session_id = session_id
+        session_id = self.open_session(peer_ip)
+        with self.current_lock:
+            self.current_session_id = session_id
         return session_id
     
+    def open_session(self, peer_ip, weight=1):
+        """Start another logical session on this connection, without making it the current one"""
+        session = self.sessions.open(peer_ip)
+        session.weight = weight
+        self.metrics.count('session.opened')
+        return session.session_id
+    
     def close_session(self, session_id):
         """Close an existing session"""
-        if session_id in self.sessions:
-            self.sessions[session_id]['state'] = 'CLOSED'
+        if self.sessions.close(session_id):
             print(f"Session {session_id} closed")
-            
-            if self.current_session_id == session_id:
+    
+    def reset_session(self, session_id):
+        """End a session whose state no longer matches the peer's, e.g. its compression stream"""
+        if self.sessions.close(session_id):
+            print(f"Session {session_id} reset")
+            self.metrics.count('session.reset')
+    
+    def _session_ended(self, session, reason):
+        """Release what a closed, expired or evicted session held"""
+        if reason != 'closed':
+            print(f"Session {session.session_id} {reason}")
+            self.metrics.count(f"session.{reason}")
+        
+        # The peer ends it too, it must not go on with per-session state,
+        # like a compression stream, that we no longer have
+        if reason != 'closed_by_peer':
+            self._send_close(session.session_id, session.peer_ip)
+        
+        if self.presentation_layer:
+            self.presentation_layer.release_session(session.session_id)
+        
+        with self.current_lock:
+            if self.current_session_id == session.session_id:
                 self.current_session_id = None
+        
+        # Unsent messages go with it, the scheduler skips closed sessions
+        with self.send_lock:
+            if session.queue:
+                self.metrics.count('session.dropped.closed', len(session.queue))
+                session.queue = None
+    
+    def close(self):
+        """Stop the session timers, e.g. when the stack closes"""
+        self.sessions.stop()
+    
+    def peer_of(self, session_id):
+        """IP of the peer a session is with, or None for an unknown session"""
+        session = self.sessions.get(session_id)
+        return session.peer_ip if session is not None else None
     
     def send_to_transport(self, data, session_id=None):
         """Send data through the session"""
         if session_id is None:
             session_id = self.current_session_id
         
-        if not session_id or session_id not in self.sessions:
+        session = self.sessions.get(session_id) if session_id else None
+        if session is None:
             print("No active session")
+            self.metrics.count('session.dropped.no_session')
             return False
         
-        if self.sessions[session_id]['state'] != 'ESTABLISHED':
+        if session.state != 'ESTABLISHED':
             print(f"Session {session_id} not in ESTABLISHED state")
+            self.metrics.count('session.dropped.closed')
             return False
         
         # Update session activity time
-        self.sessions[session_id]['state'] = 'ESTABLISHED'
-        self.sessions[session_id]['last_activity'] = time.time()
+        self.sessions.touch(session)
         
-        # Package data with session information
-        session_data = {
-            'session_id': session_id,
-            'data': data
-        }
+        if not self.transport_layer:
+            return False
         
-        # Send through transport layer
-        if self.transport_layer:
-            peer_ip = self.sessions[session_id]['peer_ip']
-            self.transport_layer.send_to_session(json.dumps(session_data), peer_ip)
-            print(f"Data sent through session {session_id}")
-            return True
+        # Package data with session information; our receive window rides
+        # on the first message of each session. The envelope is serialized
+        # with the segments that carry it
+        envelope = SessionEnvelope(session_id, data)
+        
+        with self.send_lock:
+            # Numbered under the lock, so the number order is the queue order
+            envelope.seq = session.send_seq
+            session.send_seq += 1
+            if not session.window_sent:
+                envelope.window = self.window
+                session.window_sent = True
+            
+            # Queue it behind the session's earlier messages, the scheduler
+            # sends it when the session's turn and credit allow
+            if session.queue is None:
+                session.queue = deque()
+            session.queue.append(envelope)
+            self._schedule(session)
+            self._pump()
+        
+        print(f"Data queued on session {session_id}")
+        return True
+    
+    def _has_credit(self, session):
+        return session.peer_window is None or session.in_flight < session.peer_window
+    
+    def _schedule(self, session):
+        """Put a session with queued data and credit in the round robin"""
+        if not session.scheduled and session.queue and self._has_credit(session):
+            session.scheduled = True
+            self.active.append(session)
+    
+    def _pump(self):
+        """Hand queued messages to the transport in deficit round robin order.
         
-        return False
+        Called with send_lock held. Sizes are payload bytes, as counted by the
+        receiver when it gives credit back. A message may overshoot the peer's
+        window by its own size, so one larger than the window still goes out.
+        """
+        transport = self.transport_layer
+        while self.active and transport.backlog() < self.max_backlog:
+            session = self.active[0]
+            if not self.turn_started:
+                session.deficit += self.quantum * session.weight
+                self.turn_started = True
+            
+            queue = session.queue
+            if session.state == 'ESTABLISHED' and queue and self._has_credit(session):
+                size = len(queue[0].data)
+                if size <= session.deficit:
+                    message = queue.popleft()
+                    session.deficit -= size
+                    session.in_flight += size
+                    self.metrics.count('session.messages_sent')
+                    transport.send_to_session(message, session.peer_ip)
+                    continue
+            
+            # The turn is over: idle or blocked sessions leave the round,
+            # the others wait for their next quantum at the back
+            self.active.popleft()
+            self.turn_started = False
+            if session.state == 'ESTABLISHED' and queue and self._has_credit(session):
+                self.active.append(session)
+            else:
+                session.scheduled = False
+                session.deficit = 0
     
-    def receive_from_transport(self, data):
+    def receive_from_transport(self, data, source_ip="unknown"):
         try:
-            # Parse session data
-            session_data = json.loads(data)
+            # Parse the session envelope
+            start = time.perf_counter()
+            envelope = self.transport_layer.codec.decode_envelope(data)
+            self.metrics.observe('session.decode', time.perf_counter() - start)
+            self.metrics.count('session.messages_received')
+            
+            session_id = envelope.session_id
             
-            session_id = session_data.get('session_id')
+            # Credit given back by the peer for a session we send on
+            session = self.sessions.get(session_id)
+            if envelope.grant is not None:
+                if session is not None:
+                    self._credit_returned(session, envelope.grant)
+                return
+            
+            # The peer ended the session, end ours without answering
+            if envelope.close:
+                if session is not None:
+                    self.sessions.close(session_id, 'closed_by_peer')
+                return
+            
+            # A late message for a session that ended here must not start a
+            # new one, which would not share the old one's state. Tell the
+            # peer again that it has ended
+            if session is None and self.sessions.has_ended(session_id):
+                self.metrics.count('session.dropped.ended')
+                self._send_close(session_id, source_ip)
+                return
             
             # Check if this is a known session
-            if session_id not in self.sessions:
+            seq = envelope.seq
+            size = len(envelope.data) if envelope.data is not None else 0
+            if session is None:
                 # Create new session if it doesn't exist
-                self.sessions[session_id] = {
-                    'peer_ip': "unknown",  # We'll update this later
-                    'state': 'ESTABLISHED',
-                    'last_activity': time.time()
-                }
+                session = self.sessions.open(source_ip, session_id)
+                self.metrics.count('session.opened')
                 print(f"New session {session_id} created")
             
             # Update session state
-            self.sessions[session_id]['last_activity'] = time.time()
+            self.sessions.touch(session)
+            if envelope.window is not None:
+                with self.send_lock:
+                    session.peer_window = envelope.window
             
             print(f"Data received through session {session_id}")
             
-            # Forward data to the presentation layer
-            if self.presentation_layer and 'data' in session_data:
-                self.presentation_layer.receive_from_session(session_data['data'], session_id)
+            # Deliver in the order the peer sent, holding back messages that
+            # overtook an earlier one of the same session. Frames are handled
+            # one at a time per connection, so this needs no lock
+            if seq is None:
+                self._deliver(session, envelope, size)  # Peer without message numbers
+            elif seq == session.receive_seq:
+                self._deliver(session, envelope, size)
+                session.receive_seq += 1
+                self._deliver_ready(session)
+            elif seq > session.receive_seq:
+                # The payload may still point into the physical receive buffer
+                if session.reorder is None:
+                    session.reorder = {}
+                envelope.data = detach(envelope.data)
+                session.reorder[seq] = (envelope, size)
+                self.reordering.add(session)
+                self.metrics.count('session.out_of_order')
+            else:
+                self.metrics.count('session.dropped.duplicate')
+            
+            # The transport delivers segments in order, so a message that was
+            # overtaken is still partly received. With nothing partial left
+            # the missing ones will never come, e.g. they were sent before
+            # this end expired the session, so stop waiting for them
+            if self.reordering and not self.transport_layer.receiving_partial():
+                self._skip_gaps()
                 
         except Exception as e:
             print(f"Session layer error: {e}")
+            self.metrics.count('session.dropped.error')
+    
+    def _deliver_ready(self, session):
+        """Deliver held back messages that are now next in line"""
+        while session.reorder and session.receive_seq in session.reorder:
+            self._deliver(session, *session.reorder.pop(session.receive_seq))
+            session.receive_seq += 1
+        if not session.reorder:
+            self.reordering.discard(session)
+    
+    def _skip_gaps(self):
+        for session in list(self.reordering):
+            while session.reorder:
+                self.metrics.count('session.gaps_skipped')
+                session.receive_seq = min(session.reorder)
+                self._deliver_ready(session)
+            self.reordering.discard(session)
+    
+    def _deliver(self, session, envelope, size):
+        # Forward data to the presentation layer
+        if self.presentation_layer and envelope.data is not None:
+            self.presentation_layer.receive_from_session(envelope.data, session.session_id)
+        
+        # Give credit back once half the window has been delivered
+        session.consumed += size
+        if session.consumed >= self.window // 2:
+            self._grant(session)
+    
+    def _grant(self, session):
+        """Tell the peer it may send as many bytes again as we delivered"""
+        grant, session.consumed = session.consumed, 0
+        control = SessionEnvelope(session.session_id, grant=grant)
+        if self.transport_layer:
+            self.metrics.count('session.grants_sent')
+            self.transport_layer.send_to_session(control, session.peer_ip)
+    
+    def _send_close(self, session_id, peer_ip):
+        if self.transport_layer:
+            self.metrics.count('session.closes_sent')
+            self.transport_layer.send_to_session(SessionEnvelope(session_id, close=True), peer_ip)
+    
+    def _credit_returned(self, session, grant):
+        with self.send_lock:
+            session.in_flight = max(session.in_flight - grant, 0)
+            self._schedule(session)
+            self._pump()
+    
+    def transport_ready(self):
+        """The transport drained its backlog, send what the scheduler has queued"""
+        with self.send_lock:
+            if self.active:
+                self._pump()
+    
+    def queued(self, session_id=None):
+        """Messages waiting to be sent, on one session or all of them"""
+        with self.send_lock:
+            if session_id is not None:
+                session = self.sessions.get(session_id)
+                return len(session.queue or ()) if session is not None else 0
+            return sum(len(session.queue or ()) for session in self.active)
+    
+    def session_for_peer(self, peer_ip):
+        """Return the current session, creating one if needed"""
+        with self.current_lock:
+            if self.current_session_id not in self.sessions:
+                return self.create_session(peer_ip)
+            return self.current_session_id
     
     def send_to_presentation(self, data, peer_ip):
         """Create a session if needed and send data to the presentation layer"""
-        if not self.current_session_id:
-            session_id = self.create_session(peer_ip)
-        else:
-            session_id = self.current_session_id
+        session_id = self.session_for_peer(peer_ip)
         
         return self.send_to_transport(data, session_id)
@@ -0,0 +1,195 @@
+# session_manager.py
+import itertools
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from timer_wheel import TimerWheel
+from timers import default_scheduler
+
+class Session:
+    """State of one session, kept small since a server may hold many"""
+    __slots__ = ('session_id', 'peer_ip', 'state', 'last_activity',
+                 'weight', 'queue', 'deficit', 'scheduled',
+                 'in_flight', 'peer_window', 'window_sent', 'consumed',
+                 'send_seq', 'receive_seq', 'reorder')
+    
+    def __init__(self, session_id, peer_ip, now):
+        self.session_id = session_id
+        self.peer_ip = peer_ip
+        self.state = 'ESTABLISHED'
+        self.last_activity = now  # time.monotonic() of the last send or receive
+        
+        # Send scheduling, see SessionLayer
+        self.weight = 1  # Share of the connection relative to other sessions
+        self.queue = None  # Deque of SessionEnvelopes waiting to be sent, made on first use
+        self.deficit = 0  # Bytes this session may still send in its deficit round robin turn
+        self.scheduled = False  # Whether it is in the scheduler's active list
+        
+        # Flow control: bytes the peer has not yet given back as credit, the
+        # window it advertised (None means no limit), whether ours went out,
+        # and bytes delivered here since we last gave credit back
+        self.in_flight = 0
+        self.peer_window = None
+        self.window_sent = False
+        self.consumed = 0
+        
+        # Per-session message numbers: the transport may complete a short
+        # message before a longer one sent earlier, the receiver puts them
+        # back in order
+        self.send_seq = 0
+        self.receive_seq = 0
+        self.reorder = None  # Maps seq to a message that arrived early, made on first use
+    
+    def __repr__(self):
+        return f"Session({self.session_id} with {self.peer_ip}, {self.state})"
+
+
+class SessionManager:
+    """Table of open sessions with idle expiry and a hard cap.
+    
+    IDs are a random per-table prefix plus a counter, so they never repeat
+    locally and are unlikely to match an ID picked by a peer. Sessions idle
+    for idle_timeout seconds are expired by a timer wheel advanced on the
+    shared timer thread. A touch only records the time; a session found
+    still active when its deadline comes up is scheduled again, so neither
+    a touch nor an expiry costs more than O(1). When max_sessions is reached
+    the least recently active session is evicted. on_close(session, reason)
+    is called for every session that ends, with reason 'closed', 'expired',
+    'evicted' or 'closed_by_peer'. The IDs of the last max_ended sessions
+    to end are remembered, so a late message for one can be told apart
+    from the first message of a new session.
+    """
+    
+    def __init__(self, max_sessions=100000, idle_timeout=300.0, tick=1.0, timers=None, on_close=None, max_ended=10000):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.timers = timers if timers is not None else default_scheduler()
+        self.on_close = on_close
+        self.sessions = OrderedDict()  # Maps session_id to Session, least recently active first
+        self.max_ended = max_ended
+        self.ended = OrderedDict()  # IDs of sessions that ended, oldest first
+        self.wheel = TimerWheel(tick, now=time.monotonic())
+        self.prefix = secrets.token_hex(4)
+        self.counter = itertools.count(1)
+        self.lock = threading.Lock()
+        self.tick_timer = None
+        self.stopped = False  # No more expiry ticks once stopped
+        self.created = 0
+        self.expired = 0
+        self.evicted = 0
+    
+    def new_id(self):
+        return f"{self.prefix}-{next(self.counter):x}"
+    
+    def open(self, peer_ip, session_id=None):
+        """Start a session with a fresh ID, or adopt the ID a peer chose"""
+        now = time.monotonic()
+        evicted = []
+        with self.lock:
+            if session_id is None:
+                session_id = self.new_id()
+            elif session_id in self.sessions:
+                return self.sessions[session_id]
+            
+            while len(self.sessions) >= self.max_sessions:
+                _, oldest = self.sessions.popitem(last=False)
+                self.wheel.cancel(oldest.session_id)
+                evicted.append(oldest)
+            self.evicted += len(evicted)
+            
+            session = Session(session_id, peer_ip, now)
+            self.sessions[session_id] = session
+            self.wheel.schedule(session_id, now + self.idle_timeout)
+            self.created += 1
+            if self.tick_timer is None and not self.stopped:
+                self.tick_timer = self.timers.call_later(self.wheel.tick, self._advance)
+        
+        for old in evicted:
+            self._closed(old, 'evicted')
+        return session
+    
+    def get(self, session_id):
+        return self.sessions.get(session_id)
+    
+    def touch(self, session):
+        """Record activity on a session, which pushes back its expiry"""
+        session.last_activity = time.monotonic()
+        with self.lock:
+            if session.session_id in self.sessions:
+                self.sessions.move_to_end(session.session_id)
+    
+    def close(self, session_id, reason='closed'):
+        """End a session, returns it or None if it was not open"""
+        with self.lock:
+            session = self.sessions.pop(session_id, None)
+            if session is None:
+                return None
+            self.wheel.cancel(session_id)
+        self._closed(session, reason)
+        return session
+    
+    def has_ended(self, session_id):
+        """Whether a session with this ID was open here and has ended"""
+        return session_id in self.ended
+    
+    def expire_idle(self, now=None):
+        """End the sessions idle for idle_timeout, returns how many"""
+        now = time.monotonic() if now is None else now
+        expired = []
+        with self.lock:
+            for session_id in self.wheel.advance(now):
+                session = self.sessions.get(session_id)
+                if session is None:
+                    continue
+                deadline = session.last_activity + self.idle_timeout
+                if deadline > now:
+                    self.wheel.schedule(session_id, deadline)  # Touched since it was scheduled
+                    continue
+                del self.sessions[session_id]
+                expired.append(session)
+            self.expired += len(expired)
+        
+        for session in expired:
+            self._closed(session, 'expired')
+        return len(expired)
+    
+    def _advance(self):
+        """Timer callback: expire idle sessions, then tick again while any are open"""
+        self.expire_idle()
+        with self.lock:
+            self.tick_timer = None
+            if self.sessions and not self.stopped:
+                self.tick_timer = self.timers.call_later(self.wheel.tick, self._advance)
+    
+    def stop(self):
+        """Cancel the expiry timer, open sessions then live until they are closed"""
+        with self.lock:
+            self.stopped = True
+            if self.tick_timer is not None:
+                self.tick_timer.cancel()
+                self.tick_timer = None
+    
+    def _closed(self, session, reason):
+        session.state = 'CLOSED'
+        with self.lock:
+            self.ended[session.session_id] = None
+            if len(self.ended) > self.max_ended:
+                self.ended.popitem(last=False)
+        if self.on_close:
+            self.on_close(session, reason)
+    
+    def stats(self):
+        return {
+            'active': len(self.sessions),
+            'created': self.created,
+            'expired': self.expired,
+            'evicted': self.evicted
+        }
+    
+    def __contains__(self, session_id):
+        return session_id in self.sessions
+    
+    def __len__(self):
+        return len(self.sessions)
@@ -0,0 +1,17 @@
+# conftest.py
+import os
+import socket
+import sys
+
+import pytest
+
+# The layers are top-level modules of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def port():
+    """A TCP port nothing listens on"""
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
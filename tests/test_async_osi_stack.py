@@ -0,0 +1,98 @@
+# test_async_osi_stack.py
+import asyncio
+import threading
+
+import pytest
+
+from async_osi_stack import AsyncOSIStack
+from timers import AsyncioTimerScheduler
+
+
+async def start_pair(port):
+    server = AsyncOSIStack(is_server=True, port=port)
+    server.add_route('192.168.1.2', '00:00:00:00:00:02')
+    server.register_route('GET', '/hello/{name}', lambda request: (200, 'OK', None, 'hi ' + request['params']['name']))
+    await server.initialize()
+    
+    client = AsyncOSIStack(port=port, mac_address='00:00:00:00:00:02', ip_address='192.168.1.2')
+    client.add_route('192.168.1.1', '00:00:00:00:00:01')
+    await client.initialize()
+    await client.wait_connected()
+    return server, client
+
+
+def test_request_round_trip_on_one_loop(port):
+    async def scenario():
+        threads = set(threading.enumerate())
+        server, client = await start_pair(port)
+        try:
+            responses = await asyncio.gather(*(client.send_request('GET', f'/hello/{index}', '192.168.1.1', timeout=5)
+                                               for index in range(20)))
+            missing = await client.send_request('GET', '/nope', '192.168.1.1', timeout=5)
+            started = [thread.name for thread in set(threading.enumerate()) - threads]
+        finally:
+            await client.close()
+            await server.close()
+        return responses, missing, started
+    
+    responses, missing, started = asyncio.run(scenario())
+    assert [response['body'] for response in responses] == [f'hi {index}' for index in range(20)]
+    assert missing['status_code'] == 404
+    assert started == []  # Timers and I/O all ran on the loop
+
+
+def test_request_to_a_silent_peer_times_out(port):
+    async def scenario():
+        async def swallow(reader, writer):
+            while await reader.read(65536):
+                pass
+        silent = await asyncio.start_server(swallow, '127.0.0.1', port)
+        client = AsyncOSIStack(port=port, mac_address='00:00:00:00:00:02', ip_address='192.168.1.2')
+        await client.initialize()
+        try:
+            with pytest.raises(TimeoutError):
+                await client.send_request('GET', '/', '192.168.1.1', timeout=0.2)
+        finally:
+            await client.close()
+            silent.close()
+    
+    asyncio.run(scenario())
+
+
+def test_timers_armed_from_another_thread_run_on_the_loop():
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        timers = AsyncioTimerScheduler(loop)
+        fired = []
+        done = asyncio.Event()
+        
+        def arm():
+            timers.call_later(0.01, lambda: (fired.append(threading.get_ident()), done.set()))
+            timers.call_later(0.01, fired.append, 'cancelled').cancel()
+        
+        thread = threading.Thread(target=arm)
+        thread.start()
+        thread.join()
+        await asyncio.wait_for(done.wait(), 1)
+        await asyncio.sleep(0.05)
+        return fired, threading.get_ident()
+    
+    fired, loop_thread = asyncio.run(scenario())
+    assert fired == [loop_thread]
+
+
+def test_timers_for_a_closed_loop_never_fire():
+    loop = asyncio.new_event_loop()
+    loop.close()
+    timer = AsyncioTimerScheduler(loop).call_later(0, print, 'never')
+    assert timer.cancelled
+
+
+def test_multi_client_is_refused():
+    with pytest.raises(ValueError):
+        AsyncOSIStack(is_server=True, multi_client=True)
+
+
+def test_loopback_link_is_refused():
+    with pytest.raises(ValueError):
+        AsyncOSIStack(link='loopback')
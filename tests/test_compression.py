@@ -0,0 +1,38 @@
+# test_compression.py
+import os
+import zlib
+
+import pytest
+
+from compression import CODECS, ZlibStream, is_compressible
+
+
+@pytest.mark.parametrize('name', sorted(CODECS))
+def test_codecs_round_trip(name):
+    data = b'header: value\n' * 200
+    codec = CODECS[name]
+    assert codec.decompress(codec.compress(data)) == data
+
+
+def test_stream_messages_decompress_one_by_one():
+    sender, receiver = ZlibStream(), ZlibStream()
+    messages = [b'{"method": "GET", "path": "/users/%d"}' % index for index in range(10)]
+    sizes = []
+    for message in messages:
+        compressed = sender.compress(message)
+        sizes.append(len(compressed))
+        assert receiver.decompress(compressed) == message
+    assert max(sizes[1:]) < sizes[0]  # Later messages reuse the earlier ones
+
+
+def test_stream_messages_out_of_order_fail():
+    sender, receiver = ZlibStream(), ZlibStream()
+    first, second = sender.compress(b'first' * 20), sender.compress(b'second' * 20)
+    with pytest.raises(zlib.error):
+        receiver.decompress(second)
+
+
+def test_is_compressible():
+    assert is_compressible(b'a' * 1000)
+    assert not is_compressible(os.urandom(1000))
+    assert not is_compressible(b'')
@@ -0,0 +1,85 @@
+# test_connection_pool.py
+import time
+
+import pytest
+
+from connection_pool import ConnectionPool
+from osi_stack import OSIStack
+
+CLIENT = {'mac_address': '00:00:00:00:00:02', 'ip_address': '192.168.1.2', 'link': 'loopback'}
+
+
+@pytest.fixture
+def server(port):
+    server = OSIStack(is_server=True, port=port, multi_client=True, link='loopback')
+    server.add_route('192.168.1.2', '00:00:00:00:00:02')
+    server.register_route('GET', '/ping', lambda request: (200, 'OK', {}, 'pong'))
+    server.initialize()
+    yield server
+    server.close()
+
+
+def make_pool(port, **options):
+    pool = ConnectionPool([('127.0.0.1', port)], health_interval=0.05, **dict(CLIENT, **options))
+    pool.add_route('192.168.1.1', '00:00:00:00:00:01')
+    pool.initialize()
+    return pool
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_unknown_strategy_and_empty_address_list_are_rejected():
+    with pytest.raises(ValueError):
+        ConnectionPool([('127.0.0.1', 1)], strategy='random')
+    with pytest.raises(ValueError):
+        ConnectionPool([])
+
+
+def test_round_robin_spreads_requests_over_the_connections(server, port):
+    pool = make_pool(port, size=2, strategy='round_robin')
+    try:
+        futures = [pool.submit_request('GET', '/ping', '192.168.1.1', timeout=10) for _ in range(4)]
+        assert [future.result()['body'] for future in futures] == ['pong'] * 4
+        assert len(pool.stats()) == 2
+        sent = [connection.stack.metrics_snapshot()['counters'].get('application.requests_sent') for connection in pool.connections]
+        assert sent == [2, 2]
+    finally:
+        pool.close()
+
+
+def test_dead_connections_are_replaced(server, port):
+    pool = make_pool(port, size=2)
+    try:
+        dead = pool.connections[0]
+        dead.stack.physical.reset()
+        assert wait_for(lambda: dead not in pool.connections and len(pool.stats()) == 2)
+        assert all(entry['alive'] for entry in pool.stats())
+        assert pool.submit_request('GET', '/ping', '192.168.1.1', timeout=10).result()['body'] == 'pong'
+    finally:
+        pool.close()
+
+
+def test_no_live_connection_fails_the_request(port):
+    pool = ConnectionPool([('127.0.0.1', port)], health_interval=60, **CLIENT)
+    pool.initialize()  # Nothing listens, so no connection opens
+    try:
+        with pytest.raises(ConnectionError):
+            pool.submit_request('GET', '/ping', '192.168.1.1').result(1)
+        assert pool.send_request('GET', '/ping', '192.168.1.1') is False
+    finally:
+        pool.close()
+
+
+def test_close_stops_maintenance_and_refuses_late_connections(server, port):
+    pool = make_pool(port, size=1)
+    pool.close()
+    assert not pool.maintainer.is_alive()
+    
+    # A connection that finishes opening after close() is shut, not pooled
+    assert pool._add_connection() is False
+    assert pool.connections == []
@@ -0,0 +1,80 @@
+# test_connection_server.py
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from osi_stack import OSIStack
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+@pytest.fixture
+def server(port):
+    server = OSIStack(is_server=True, port=port, multi_client=True)
+    server.register_route('GET', '/echo/{text}', lambda request: (200, 'OK', None, request['params']['text']))
+    server.register_route('GET', '/big/{size}', lambda request: (200, 'OK', None, os.urandom(int(request['params']['size'])).hex()))
+    server.initialize()
+    yield server
+    server.close()
+
+
+def client_for(port, number):
+    mac = f'00:00:00:00:01:{number:02X}'
+    ip = f'192.168.2.{number}'
+    client = OSIStack(port=port, mac_address=mac, ip_address=ip)
+    client.add_route('192.168.1.1', '00:00:00:00:00:01')
+    client.initialize()
+    return client
+
+
+def test_each_client_gets_its_own_responses(server, port):
+    clients = [client_for(port, number) for number in range(1, 6)]
+    try:
+        def talk(client):
+            futures = [client.submit_request('GET', f'/echo/{client.ip_address}-{index}', '192.168.1.1', timeout=10)
+                       for index in range(20)]
+            return [future.result()['body'] for future in futures]
+        
+        with ThreadPoolExecutor(len(clients)) as pool:
+            bodies = list(pool.map(talk, clients))
+        for client, received in zip(clients, bodies):
+            assert received == [f'{client.ip_address}-{index}' for index in range(20)]
+        assert len(server.physical.connections) == len(clients)
+    finally:
+        for client in clients:
+            client.close()
+
+
+def test_large_responses_survive_partial_writes(server, port):
+    client = client_for(port, 1)
+    try:
+        futures = [client.submit_request('GET', '/big/400000', '192.168.1.1', timeout=20) for _ in range(3)]
+        assert [len(future.result()['body']) for future in futures] == [800000] * 3
+    finally:
+        client.close()
+
+
+def test_disconnected_clients_are_dropped(server, port):
+    client = client_for(port, 1)
+    assert client.submit_request('GET', '/echo/x', '192.168.1.1', timeout=10).result()['body'] == 'x'
+    assert len(server.physical.connections) == 1
+    client.close()
+    assert wait_for(lambda: not server.physical.connections)
+
+
+def test_close_stops_the_loop_thread(port):
+    server = OSIStack(is_server=True, port=port, multi_client=True)
+    server.initialize()
+    thread = server.physical.thread
+    assert thread.is_alive()
+    server.close()
+    assert not thread.is_alive()
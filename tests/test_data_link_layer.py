@@ -0,0 +1,124 @@
+# test_data_link_layer.py
+import pytest
+
+from data_link_layer import DataLinkLayer
+from messages import Frame
+from metrics import Metrics
+from wire_format import WIRE_FORMAT_JSON, WireCodec
+
+
+class RecordingNetwork:
+    def __init__(self):
+        self.packets = []
+    
+    def receive_from_data_link(self, data):
+        self.packets.append(data.encode() if isinstance(data, str) else bytes(data))
+
+
+def make_data_link(mac_address='00:00:00:00:00:01'):
+    data_link = DataLinkLayer(mac_address)
+    data_link.metrics = Metrics()
+    data_link.mac_table.stop()
+    data_link.connect_to_network_layer(RecordingNetwork())
+    return data_link
+
+
+def encode(source_mac, destination_mac, data=b'packet', integrity='crc32'):
+    return b''.join(WireCodec().encode_frame(Frame(source_mac, destination_mac, integrity, {'crc32'}, data)))
+
+
+def test_frames_for_other_hosts_are_dropped_from_the_header(monkeypatch):
+    data_link = make_data_link()
+    monkeypatch.setattr(data_link.codec, 'decode_frame', lambda frame_data: 1 / 0)  # Never reached
+    data_link.receive_from_physical(encode('00:00:00:00:00:02', '00:00:00:00:00:09'))
+    assert data_link.metrics.snapshot()['counters'] == {'data_link.dropped.not_for_us': 1}
+    assert data_link.network_layer.packets == []
+
+
+def test_frames_for_us_are_delivered_and_teach_the_source():
+    data_link = make_data_link('aa:bb:cc:dd:ee:01')
+    data_link.receive_from_physical(encode('aa:bb:cc:dd:ee:02', 'AA:BB:CC:DD:EE:01'))
+    data_link.receive_from_physical(encode('aa:bb:cc:dd:ee:03', 'FF:FF:FF:FF:FF:FF'))
+    assert data_link.network_layer.packets == [b'packet', b'packet']
+    assert data_link.mac_table.lookup('AA:BB:CC:DD:EE:02') == (True, None)
+    assert data_link.mac_table.lookup('aa:bb:cc:dd:ee:03') == (True, None)
+
+
+class Wire:
+    """Physical layer stand-in that hands every frame to the other data link"""
+    def __init__(self):
+        self.peer = None
+        self.frames = []
+    
+    def connect_to_data_link_layer(self, data_link_layer):
+        pass
+    
+    def send_data(self, buffers):
+        frame_data = b''.join(bytes(buffer) for buffer in buffers)
+        self.frames.append(frame_data)
+        self.peer.receive_from_physical(frame_data)
+
+
+def linked_pair(codec=None):
+    first, second = make_data_link('00:00:00:00:00:01'), make_data_link('00:00:00:00:00:02')
+    if codec is not None:
+        first.codec, second.codec = codec(), codec()
+    for data_link, peer in ((first, second), (second, first)):
+        wire = Wire()
+        wire.peer = peer
+        data_link.connect_to_physical_layer(wire)
+    return first, second
+
+
+def test_sender_falls_back_to_an_algorithm_the_peer_accepts():
+    first, second = linked_pair()
+    first.configure_integrity('blake2')
+    second.configure_integrity('adler32', accepted={'adler32', 'md5'})
+    
+    first.send_to_physical(b'hello', '00:00:00:00:00:02')  # Peer not heard yet, our preference
+    second.send_to_physical(b'hello', '00:00:00:00:00:01')
+    first.send_to_physical(b'again', '00:00:00:00:00:02')
+    assert [first.codec.decode_frame(frame).integrity for frame in first.physical_layer.frames] == ['blake2', 'adler32']
+    assert second.peer_integrity == first.accepted_integrity and first.peer_integrity == {'adler32', 'md5'}
+    assert second.network_layer.packets == [b'hello', b'again']
+
+
+def test_unchecked_frames_only_on_links_that_accept_them():
+    first, second = linked_pair()
+    first.configure_integrity('none')
+    first.send_to_physical(b'x', '00:00:00:00:00:02')
+    assert first.codec.decode_frame(first.physical_layer.frames[0]).integrity == 'crc32'  # Not before the peer allows it
+    
+    second.send_to_physical(b'y', '00:00:00:00:00:01')  # Peer does not accept 'none'
+    first.send_to_physical(b'z', '00:00:00:00:00:02')
+    assert first.codec.decode_frame(first.physical_layer.frames[1]).integrity == 'crc32'
+    
+    second.configure_integrity('crc32', accepted={'none'})
+    second.send_to_physical(b'y', '00:00:00:00:00:01')
+    first.send_to_physical(b'z', '00:00:00:00:00:02')
+    assert first.codec.decode_frame(first.physical_layer.frames[2]).integrity == 'none'
+    assert second.network_layer.packets == [b'x', b'z', b'z']
+
+
+def test_frames_with_a_bad_checksum_are_dropped():
+    data_link = make_data_link()
+    frame_data = bytearray(encode('00:00:00:00:00:02', '00:00:00:00:00:01'))
+    frame_data[-1] ^= 0xFF
+    data_link.receive_from_physical(bytes(frame_data))
+    assert data_link.metrics.snapshot()['counters'] == {'data_link.dropped.checksum': 1}
+    assert data_link.network_layer.packets == []
+
+
+def test_json_links_start_with_md5_for_older_peers():
+    first, second = linked_pair(lambda: WireCodec(WIRE_FORMAT_JSON))
+    first.send_to_physical(b'hello', '00:00:00:00:00:02')
+    assert first.create_frame(b'', '00:00:00:00:00:02').integrity == 'md5'
+    assert second.network_layer.packets == [b'hello']
+
+
+def test_unknown_algorithms_are_rejected():
+    data_link = make_data_link()
+    with pytest.raises(ValueError):
+        data_link.configure_integrity('sha1')
+    with pytest.raises(ValueError):
+        data_link.configure_integrity('crc32', accepted={'crc32', 'sha1'})
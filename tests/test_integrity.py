@@ -0,0 +1,23 @@
+# test_integrity.py
+import pytest
+
+from integrity import ALGORITHMS, ALGORITHMS_BY_ID, FALLBACK_ORDER, mask_to_names, names_to_mask
+
+
+@pytest.mark.parametrize('name', sorted(ALGORITHMS))
+def test_digest_over_buffers_matches_the_joined_data(name):
+    algorithm = ALGORITHMS[name]
+    digest = algorithm.compute(b'hello world')
+    assert len(digest) == algorithm.size
+    assert algorithm.compute_parts([b'hello', memoryview(b' '), b'', b'world']) == digest
+    assert ALGORITHMS_BY_ID[algorithm.algorithm_id] is algorithm
+
+
+def test_accept_mask_round_trip():
+    assert mask_to_names(names_to_mask({'crc32', 'md5'})) == {'crc32', 'md5'}
+    assert names_to_mask({'crc32', 'unknown'}) == names_to_mask({'crc32'})
+    assert mask_to_names(0) == set()
+
+
+def test_fallback_order_only_names_real_checks():
+    assert set(FALLBACK_ORDER) == set(ALGORITHMS) - {'none'}
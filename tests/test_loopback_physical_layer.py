@@ -0,0 +1,104 @@
+# test_loopback_physical_layer.py
+import threading
+
+import pytest
+
+from loopback_physical_layer import LoopbackConnectionServer, LoopbackHub, LoopbackPhysicalLayer
+
+
+class RecordingDataLink:
+    def __init__(self):
+        self.frames = []
+        self.threads = set()
+        self.received = threading.Event()
+    
+    def receive_from_physical(self, frame):
+        self.frames.append(frame)
+        self.threads.add(threading.current_thread().name)
+        self.received.set()
+
+
+def make_link(hub, port=1):
+    server = LoopbackPhysicalLayer(True, port=port, hub=hub)
+    client = LoopbackPhysicalLayer(False, port=port, hub=hub)
+    for physical in (server, client):
+        physical.connect_to_data_link_layer(RecordingDataLink())
+    server.initialize()
+    client.initialize()
+    return server, client
+
+
+def test_unthreaded_hub_delivers_in_send_order_when_asked():
+    hub = LoopbackHub(threaded=False)
+    server, client = make_link(hub)
+    client.send_data(b'one')
+    client.send_data([b't', b'wo'])  # Frames given as buffers are joined
+    server.send_data(b'three')
+    assert server.data_link_layer.frames == [] and hub.thread is None
+    
+    assert hub.deliver_pending(max_frames=1) == 1
+    assert server.data_link_layer.frames == [b'one']
+    assert hub.deliver_pending() == 2
+    assert server.data_link_layer.frames == [b'one', b'two']
+    assert client.data_link_layer.frames == [b'three']
+    assert server.data_link_layer.threads == {threading.current_thread().name}
+
+
+def test_threaded_hub_delivers_on_its_own_thread():
+    hub = LoopbackHub()
+    server, client = make_link(hub)
+    client.send_data(b'frame')
+    assert server.data_link_layer.received.wait(5)
+    assert server.data_link_layer.frames == [b'frame']
+    assert server.data_link_layer.threads == {'loopback'}
+
+
+def test_address_in_use_and_nothing_listening():
+    hub = LoopbackHub(threaded=False)
+    server, client = make_link(hub)
+    with pytest.raises(OSError):
+        LoopbackPhysicalLayer(True, port=1, hub=hub).initialize()
+    with pytest.raises(ConnectionRefusedError):
+        LoopbackPhysicalLayer(False, port=2, hub=hub).initialize()
+    with pytest.raises(ConnectionRefusedError):
+        LoopbackPhysicalLayer(False, port=1, hub=hub).initialize()  # The server already has a peer
+
+
+def test_close_tells_the_peer_and_frees_the_address():
+    hub = LoopbackHub(threaded=False)
+    server, client = make_link(hub)
+    closed = []
+    server.on_peer_closed = closed.append
+    
+    client.close()
+    assert closed == [server] and not server.connected
+    server.send_data(b'late')
+    assert hub.deliver_pending() == 0
+    
+    server.close()
+    make_link(hub)  # The address can be used again
+
+
+def test_connection_server_builds_a_stack_per_client_and_drops_it_on_close():
+    hub = LoopbackHub(threaded=False)
+    stacks = []
+    
+    class Stack:
+        def __init__(self, physical):
+            self.physical = physical
+            self.stopped = False
+            stacks.append(self)
+        
+        def stop_timers(self):
+            self.stopped = True
+    
+    server = LoopbackConnectionServer(port=1, stack_factory=Stack, hub=hub)
+    server.initialize()
+    clients = [LoopbackPhysicalLayer(False, port=1, hub=hub) for _ in range(2)]
+    for client in clients:
+        client.initialize()
+    assert len(stacks) == 2 and len(server.connections) == 2
+    assert [stack.physical.peer for stack in stacks] == clients
+    
+    clients[0].close()
+    assert stacks[0].stopped and list(server.connections.values()) == [stacks[1]]
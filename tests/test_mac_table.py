@@ -0,0 +1,88 @@
+# test_mac_table.py
+import time
+
+from mac_table import MacTable
+
+
+class ManualTimers:
+    def __init__(self):
+        self.calls = []
+    
+    def call_later(self, delay, callback, *args):
+        timer = ManualTimer(delay, callback, args)
+        self.calls.append(timer)
+        return timer
+
+
+class ManualTimer:
+    def __init__(self, delay, callback, args):
+        self.delay = delay
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+    
+    def cancel(self):
+        self.cancelled = True
+    
+    def fire(self):
+        self.callback(*self.args)
+
+
+def age(table, mac_address, seconds):
+    table.learned[mac_address.upper()][1] -= seconds
+
+
+def test_learned_entries_follow_a_host_that_moves():
+    table = MacTable(timers=ManualTimers())
+    table.learn('00:00:00:00:00:02', 'eth0')
+    assert table.lookup('00:00:00:00:00:02') == (True, 'eth0')
+    table.learn('00:00:00:00:00:02', 'eth1')
+    assert table.lookup('00:00:00:00:00:02') == (True, 'eth1')
+    assert table.lookup('00:00:00:00:00:03') == (False, None)
+
+
+def test_addresses_match_in_any_case():
+    table = MacTable(timers=ManualTimers())
+    table.add_static('aa:bb:cc:dd:ee:01', 'eth0')
+    table.learn('aa:bb:cc:dd:ee:02', 'eth1')
+    assert table.lookup('AA:BB:CC:DD:EE:01') == (True, 'eth0')
+    assert table.lookup('AA:BB:CC:DD:EE:02') == (True, 'eth1')
+    
+    # A static entry is not overridden by traffic, whatever the spelling
+    table.learn('AA:BB:CC:DD:EE:01', 'eth1')
+    assert table.lookup('aa:bb:cc:dd:ee:01') == (True, 'eth0')
+    assert len(table) == 2
+
+
+def test_entries_age_out_and_the_sweep_removes_them():
+    timers = ManualTimers()
+    table = MacTable(max_age=10, timers=timers)
+    table.learn('00:00:00:00:00:02')
+    table.learn('00:00:00:00:00:03')
+    assert len(timers.calls) == 1 and timers.calls[0].delay == 10
+    
+    age(table, '00:00:00:00:00:02', 11)
+    assert table.lookup('00:00:00:00:00:02') == (False, None)  # Stale before any sweep
+    timers.calls[0].fire()
+    assert list(table.learned) == ['00:00:00:00:00:03']
+    assert len(timers.calls) == 2  # Checks again while entries remain
+    
+    table.stop()
+    assert timers.calls[1].cancelled
+
+
+def test_least_recently_seen_entry_is_evicted():
+    table = MacTable(max_entries=2, timers=ManualTimers())
+    for mac_address in ('00:00:00:00:00:02', '00:00:00:00:00:03'):
+        table.learn(mac_address)
+    table.learn('00:00:00:00:00:02')  # Seen again, so 03 is now the oldest
+    table.learn('00:00:00:00:00:04')
+    assert list(table.learned) == ['00:00:00:00:00:02', '00:00:00:00:00:04']
+    assert table.evictions == 1
+
+
+def test_static_entries_never_age():
+    table = MacTable(max_age=0.01, timers=ManualTimers())
+    table.add_static('00:00:00:00:00:02', 'eth0')
+    time.sleep(0.02)
+    assert table.lookup('00:00:00:00:00:02') == (True, 'eth0')
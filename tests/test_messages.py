@@ -0,0 +1,46 @@
+# test_messages.py
+import json
+
+import pytest
+
+from messages import Message
+
+
+def test_request_round_trip():
+    request = Message.request('GET', '/users/1', {'Accept': 'json'}, None, 'r-1')
+    parsed = Message.from_json(request.to_json())
+    assert parsed.keys() == ['type', 'request_id', 'method', 'path', 'headers', 'body']
+    assert (parsed['type'], parsed['method'], parsed['path'], parsed['headers']) == ('request', 'GET', '/users/1', {'Accept': 'json'})
+
+
+def test_response_round_trip_from_bytes():
+    response = Message.response(404, 'Not Found', {}, {'error': 'missing'}, 'r-1')
+    parsed = Message.from_json(memoryview(response.to_json().encode()))
+    assert (parsed['status_code'], parsed['status_message'], parsed['body']) == (404, 'Not Found', {'error': 'missing'})
+    assert 'method' not in json.loads(response.to_json())
+
+
+def test_reads_like_a_dict():
+    message = Message.from_json('{"type": "request", "path": "/", "unknown": 1}')
+    assert 'path' in message and 'unknown' not in message and 'body' not in message
+    assert message.get('body', 'default') == 'default'
+    with pytest.raises(KeyError):
+        message['body']
+    with pytest.raises(KeyError):
+        message[0]
+
+
+def test_only_known_fields_can_be_set():
+    message = Message()
+    message['params'] = {'id': '1'}
+    assert message['params'] == {'id': '1'}
+    with pytest.raises(KeyError):
+        message['extra'] = 1
+
+
+def test_local_fields_are_not_serialized():
+    request = Message.request('GET', '/', None, None, 'r-1')
+    request.session_id = 's-1'
+    request.params = {}
+    assert set(json.loads(request.to_json())) == {'type', 'request_id', 'method', 'path', 'headers', 'body'}
+    assert "session_id='s-1'" in repr(request)
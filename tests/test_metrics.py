@@ -0,0 +1,76 @@
+# test_metrics.py
+import gc
+import threading
+
+import pytest
+
+from metrics import NULL_METRICS, Histogram, Metrics
+
+
+def test_histogram_percentiles_and_merge():
+    histogram = Histogram()
+    for seconds in (0.001, 0.002, 0.004, 0.1):
+        histogram.observe(seconds)
+    other = Histogram()
+    other.observe(0.5)
+    histogram.merge(other)
+    summary = histogram.summary()
+    assert summary['count'] == 5
+    assert summary['max_ms'] == 500.0
+    assert 0.004 <= histogram.percentile(0.5) < 0.008  # Upper bound of the sample's bucket
+    assert histogram.percentile(0.99) == 0.5
+
+
+def test_snapshot_merges_the_shards_of_every_thread():
+    metrics = Metrics()
+    metrics.count('test.events')
+    metrics.observe('test.latency', 0.001)
+    barrier = threading.Barrier(4)
+    
+    def record():
+        metrics.count('test.events', 2)
+        metrics.observe('test.latency', 0.002)
+        barrier.wait()  # Every thread holds its shard at the same time
+        barrier.wait()
+    
+    threads = [threading.Thread(target=record) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    assert len(metrics.shards) == 4
+    snapshot = metrics.snapshot()
+    assert snapshot['counters'] == {'test.events': 7}
+    assert snapshot['histograms']['test.latency']['count'] == 4
+    barrier.wait()
+    for thread in threads:
+        thread.join()
+
+
+def test_shards_of_exited_threads_are_folded_into_the_totals():
+    metrics = Metrics()
+    for _ in range(50):
+        thread = threading.Thread(target=lambda: (metrics.count('test.events'), metrics.observe('test.latency', 0.001)))
+        thread.start()
+        thread.join()
+    gc.collect()
+    
+    assert len(metrics.shards) == 0
+    snapshot = metrics.snapshot()
+    assert snapshot['counters'] == {'test.events': 50}
+    assert snapshot['histograms']['test.latency']['count'] == 50
+    
+    metrics.reset()
+    assert metrics.snapshot() == {'counters': {}, 'histograms': {}}
+
+
+def test_disabled_metrics_record_nothing():
+    NULL_METRICS.count('test.events')
+    assert NULL_METRICS.snapshot()['counters'] == {} and NULL_METRICS.shards == {}
+
+
+def test_export_formats():
+    metrics = Metrics()
+    metrics.count('test.events', 3)
+    assert 'test.events 3' in metrics.export('text').splitlines()
+    with pytest.raises(ValueError):
+        metrics.export('xml')
@@ -0,0 +1,154 @@
+# test_physical_layer.py
+import socket
+
+import pytest
+
+from physical_layer import LENGTH_PREFIX, FrameReceiveBuffer, PhysicalLayer, skip_sent, write_views
+
+
+class ChunkSocket:
+    """Hands out the given stream a few bytes per recv_into"""
+    
+    def __init__(self, data, chunk):
+        self.data = data
+        self.chunk = chunk
+    
+    def recv_into(self, view):
+        size = min(self.chunk, len(view), len(self.data))
+        view[:size] = self.data[:size]
+        self.data = self.data[size:]
+        return size
+
+
+def framed(*payloads):
+    return b''.join(LENGTH_PREFIX.pack(len(payload)) + payload for payload in payloads)
+
+
+def receive_all(buffer, sock):
+    frames = []
+    while buffer.recv_from(sock):
+        frames.extend(bytes(frame) for frame in buffer.frames())
+    return frames
+
+
+@pytest.mark.parametrize('chunk', [1, 3, 7, 4096])
+def test_frames_split_across_reads_are_reassembled(chunk):
+    payloads = [b'a', b'', b'hello world', bytes(range(256)) * 3]
+    buffer = FrameReceiveBuffer(size=16)
+    assert receive_all(buffer, ChunkSocket(framed(*payloads), chunk)) == payloads
+
+
+def test_buffer_grows_for_a_large_frame_and_keeps_earlier_slices():
+    buffer = FrameReceiveBuffer(size=16)
+    sock = ChunkSocket(framed(b'first', b'x' * 1000), 12)
+    frames = []
+    while buffer.recv_from(sock):
+        frames.extend(buffer.frames())
+    assert len(buffer.buffer) >= 1004
+    assert bytes(frames[0]) == b'first'  # Still valid, the old buffer was not reused
+    assert bytes(frames[1]) == b'x' * 1000
+
+
+def test_announced_length_over_the_limit_is_rejected_before_growing():
+    buffer = FrameReceiveBuffer(size=16, max_frame_size=1024)
+    buffer.recv_from(ChunkSocket(LENGTH_PREFIX.pack(2**31) + b'xx', 64))
+    with pytest.raises(ConnectionError):
+        list(buffer.frames())
+    assert len(buffer.buffer) == 16
+
+
+def test_oversized_frame_drops_the_connection():
+    ours, theirs = socket.socketpair()
+    try:
+        layer = PhysicalLayer()
+        layer.receive_buffer = FrameReceiveBuffer(max_frame_size=1024)
+        layer.socket = ours
+        layer.connected = True
+        theirs.sendall(LENGTH_PREFIX.pack(4096))
+        layer.receive_data()
+        assert not layer.connected
+        theirs.settimeout(1)
+        assert theirs.recv(16) == b''  # The peer sees the connection go
+    finally:
+        ours.close()
+        theirs.close()
+
+
+class TrickleSocket:
+    """Takes at most limit bytes per write, like a socket with a full send buffer"""
+    
+    def __init__(self, limit):
+        self.limit = limit
+        self.received = bytearray()
+        self.calls = 0
+    
+    def sendmsg(self, buffers):
+        self.calls += 1
+        if self.calls > 1000:
+            raise AssertionError("The writer is spinning")
+        taken = 0
+        for buffer in buffers:
+            part = bytes(buffer[:self.limit - taken])
+            self.received += part
+            taken += len(part)
+            if taken == self.limit:
+                break
+        return taken
+
+
+class SendOnlySocket:
+    """A socket without scatter/gather writes"""
+    
+    def __init__(self):
+        self.received = bytearray()
+    
+    def sendall(self, data):
+        self.received += data
+
+
+def layer_with(sock):
+    layer = PhysicalLayer()
+    layer.socket = sock
+    return layer
+
+
+def test_write_views_leave_out_empty_buffers():
+    views = write_views([b'ab', b'', bytearray(b'c'), memoryview(b'')])
+    assert [bytes(view) for view in views] == [b'ab', b'c']
+
+
+def test_skip_sent_moves_across_buffers():
+    views = write_views([b'abc', b'de', b'fgh'])
+    assert skip_sent(views, 0, 0) == 0
+    assert skip_sent(views, 0, 4) == 1
+    assert bytes(views[1]) == b'e'
+    assert skip_sent(views, 1, 1) == 2
+    assert bytes(views[2]) == b'fgh'
+    assert skip_sent(views, 2, 3) == 3
+
+
+@pytest.mark.parametrize('limit', [1, 2, 3, 5, 64])
+def test_write_sends_everything_in_order(limit):
+    sock = TrickleSocket(limit)
+    buffers = [b'\x00\x00\x00\x05', b'hello', b'', b'\x00\x00\x00\x03', memoryview(b'abc')]
+    writes = layer_with(sock)._write(buffers)
+    assert bytes(sock.received) == b''.join(bytes(buffer) for buffer in buffers)
+    assert writes == sock.calls == -(-16 // limit)
+
+
+def test_write_does_not_spin_on_empty_buffers():
+    sock = TrickleSocket(4)
+    assert layer_with(sock)._write([b'', b'', b'data', b'']) == 1
+    assert sock.received == b'data'
+    assert layer_with(sock)._write([b'', memoryview(b'')]) == 0
+
+
+def test_socket_taking_nothing_is_an_error():
+    with pytest.raises(ConnectionError):
+        layer_with(TrickleSocket(0))._write([b'data'])
+
+
+def test_write_without_sendmsg_joins_the_buffers():
+    sock = SendOnlySocket()
+    assert layer_with(sock)._write([b'ab', b'', memoryview(b'cd')]) == 1
+    assert sock.received == b'abcd'
@@ -0,0 +1,81 @@
+# test_presentation_layer.py
+import os
+
+import pytest
+
+from presentation_layer import PresentationLayer
+
+
+@pytest.fixture
+def presentation():
+    return PresentationLayer()
+
+
+def reference_xor(data, key, position=0):
+    return bytes(byte ^ key[(position + index) % len(key)] for index, byte in enumerate(data))
+
+
+@pytest.mark.parametrize('size', [0, 1, 5, 6, 7, 1000])
+def test_xor_cipher_matches_a_bytewise_xor(presentation, size):
+    data = os.urandom(size)
+    assert presentation.xor_cipher(data) == reference_xor(data, presentation.key)
+
+
+def test_xor_cipher_is_its_own_inverse(presentation):
+    data = os.urandom(257)
+    assert presentation.xor_cipher(presentation.xor_cipher(data)) == data
+
+
+def test_xor_cipher_in_chunks_matches_one_pass(presentation):
+    data = os.urandom(100)
+    chunks = b''.join(presentation.xor_cipher(data[start:start + 7], start) for start in range(0, 100, 7))
+    assert chunks == presentation.xor_cipher(data)
+
+
+def test_xor_cipher_keeps_leading_and_trailing_zero_bytes(presentation):
+    data = presentation.key + b'\x00' * 3  # XORs to all zero bytes
+    assert presentation.xor_cipher(data) == b'\x00' * 6 + presentation.key[:3]
+
+
+def test_encrypt_decrypt_round_trip(presentation):
+    text = 'Hello, wörld!'
+    encrypted = presentation.encrypt(text)
+    assert encrypted != text
+    assert presentation.decrypt(encrypted) == text
+
+
+def test_encrypt_into_writes_the_callers_buffer(presentation):
+    out = bytearray(10)
+    assert presentation.encrypt_into('abc', out, position=2) == 3
+    assert bytes(out[:3]) == reference_xor(b'abc', presentation.key, 2)
+    assert bytes(out[3:]) == bytes(7)
+    
+    back = bytearray(3)
+    presentation.decrypt_into(bytes(out[:3]), back, position=2)
+    assert back == b'abc'
+
+
+def test_payloads_stay_uncompressed_until_the_peer_accepts_a_codec(presentation):
+    body = 'x' * 1000
+    assert presentation.compress(body, 's-1') == ('none', body.encode())
+    
+    peer = PresentationLayer()
+    presentation.decode(peer.encode('hello', 's-1'))  # Learns the codecs the peer accepts
+    codec_name, payload = presentation.compress(body, 's-1')
+    assert codec_name == 'zlib-stream' and len(payload) < 100
+
+
+def test_encode_decode_round_trip_with_a_stream_per_session(presentation):
+    peer = PresentationLayer()
+    peer.decode(presentation.encode('hello', 's-1'))
+    presentation.decode(peer.encode('hello', 's-1'))
+    
+    for index in range(5):
+        for session_id in ('s-1', 's-2'):
+            text = f'{session_id} message {index} ' * 50
+            assert peer.decode(presentation.encode(text, session_id), session_id) == text
+
+
+def test_envelopes_from_peers_without_codecs_are_decoded(presentation):
+    legacy = '{"encoding": "utf-8", "compressed": true, "encrypted": true, "data": "%s"}'
+    assert presentation.decode(legacy % presentation.encrypt('COMPRESSED:hi')) == 'hi'
@@ -0,0 +1,110 @@
+# test_response_cache.py
+from osi_stack import OSIStack
+from response_cache import ResponseCache, compute_etag, max_age
+
+
+def test_get_returns_fresh_entries_and_counts():
+    cache = ResponseCache()
+    key = cache.key('GET', '/a')
+    assert cache.get(key) is None
+    cache.put(key, 200, 'OK', {}, 'body')
+    entry = cache.get(key)
+    assert (entry['status_code'], entry['body']) == (200, 'body')
+    assert entry['headers']['ETag'] == entry['etag'] == compute_etag('body')
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResponseCache(max_entries=2)
+    for path in ('/a', '/b'):
+        cache.put(cache.key('GET', path), 200, 'OK', {}, path)
+    cache.get(cache.key('GET', '/a'))
+    cache.put(cache.key('GET', '/c'), 200, 'OK', {}, '/c')
+    assert [key[1] for key in cache.entries] == ['/a', '/c']
+    assert cache.stats()['evictions'] == 1
+
+
+def test_memory_budget_is_kept():
+    cache = ResponseCache(max_bytes=200)
+    for path in ('/a', '/b', '/c'):
+        cache.put(cache.key('GET', path), 200, 'OK', {}, 'x' * 60)
+    assert cache.size <= 200
+    assert len(cache.entries) < 3
+    assert cache.put(cache.key('GET', '/big'), 200, 'OK', {}, 'x' * 500) is None
+    assert cache.size == sum(entry['size'] for entry in cache.entries.values())
+
+
+def test_expired_entries_are_kept_for_revalidation():
+    cache = ResponseCache()
+    key = cache.key('GET', '/a')
+    cache.put(key, 200, 'OK', {}, 'body', ttl=0)
+    assert cache.get(key) is None
+    entry = cache.get(key, allow_stale=True)
+    assert entry is not None
+    cache.refresh(entry, 60)
+    assert cache.get(key) is entry
+
+
+def test_cache_control():
+    assert max_age({'Cache-Control': 'public, max-age=5'}, 30) == 5
+    assert max_age({'Cache-Control': 'max-age=oops'}, 30) == 30
+    assert max_age({}, 30) == 30
+    assert max_age({'Cache-Control': 'no-store'}, 30) is None
+    
+    cache = ResponseCache()
+    assert cache.put(cache.key('GET', '/a'), 200, 'OK', {'Cache-Control': 'private'}, 'body') is None
+    assert not cache.entries
+
+
+def test_vary_headers_are_part_of_the_key():
+    cache = ResponseCache(vary_headers=('Accept',))
+    cache.put(cache.key('GET', '/a', {'Accept': 'json'}), 200, 'OK', {}, 'json')
+    assert cache.get(cache.key('GET', '/a', {'Accept': 'text'})) is None
+    assert cache.get(cache.key('GET', '/a', {'Accept': 'json'}))['body'] == 'json'
+
+
+def test_etag_matching():
+    cache = ResponseCache()
+    entry = cache.put(cache.key('GET', '/a'), 200, 'OK', {'ETag': '"v1"'}, 'body')
+    assert cache.matches(entry, '"v0", "v1"')
+    assert cache.matches(entry, '*')
+    assert not cache.matches(entry, '"v2"')
+    assert not cache.matches(entry, None)
+    assert cache.stats()['not_modified'] == 2
+
+
+def test_invalidate():
+    cache = ResponseCache()
+    for path in ('/a', '/b'):
+        cache.put(cache.key('GET', path), 200, 'OK', {}, path)
+    cache.invalidate('/a')
+    assert [key[1] for key in cache.entries] == ['/b']
+    cache.invalidate()
+    assert not cache.entries and cache.size == 0
+
+
+def test_stacks_serve_repeated_gets_from_the_caches(port):
+    server = OSIStack(is_server=True, port=port, link='loopback')
+    server.add_route('192.168.1.2', '00:00:00:00:00:02')
+    calls = []
+    server.register_route('GET', '/data', lambda request: calls.append(1) or (200, 'OK', {'Cache-Control': 'max-age=60'}, 'payload'))
+    server.enable_response_cache()
+    server.initialize()
+    client = OSIStack(port=port, mac_address='00:00:00:00:00:02', ip_address='192.168.1.2', link='loopback')
+    client.add_route('192.168.1.1', '00:00:00:00:00:01')
+    client.enable_client_cache()
+    client.initialize()
+    try:
+        responses = [client.submit_request('GET', '/data', '192.168.1.1', timeout=10).result() for _ in range(3)]
+        assert [(response['status_code'], response['body']) for response in responses] == [(200, 'payload')] * 3
+        assert len(calls) == 1 and client.cache_stats()['client']['hits'] == 2
+        
+        # Once the client copy goes stale it is revalidated with a bodiless 304
+        for entry in client.application.client_cache.entries.values():
+            entry['expires'] = 0
+        response = client.submit_request('GET', '/data', '192.168.1.1', timeout=10).result()
+        assert (response['status_code'], response['body']) == (200, 'payload')
+        assert len(calls) == 1 and server.cache_stats()['server']['not_modified'] == 1
+    finally:
+        client.close()
+        server.close()
@@ -0,0 +1,90 @@
+# test_router.py
+import pytest
+
+from router import Router
+
+
+def handler(name):
+    def handle(request):
+        return name
+    handle.__name__ = name
+    return handle
+
+
+@pytest.fixture
+def router():
+    router = Router()
+    router.add_route('GET', '/users', handler('list'))
+    router.add_route('GET', '/users/{id}', handler('show'))
+    router.add_route('GET', '/users/me', handler('me'))
+    router.add_route('POST', '/users/{id}/posts/{post}', handler('post'))
+    router.add_route(Router.ANY_METHOD, '/health', handler('health'))
+    router.mount('/static', handler('static'), methods=['GET'])
+    return router
+
+
+def resolved(router, method, path):
+    found, params = router.resolve(method, path)
+    return (found.__name__ if found else None), params
+
+
+def test_literal_routes_and_parameters(router):
+    assert resolved(router, 'GET', '/users') == ('list', {})
+    assert resolved(router, 'GET', '/users/42') == ('show', {'id': '42'})
+    assert resolved(router, 'POST', '/users/7/posts/9') == ('post', {'id': '7', 'post': '9'})
+
+
+def test_literal_segment_wins_over_parameter(router):
+    assert resolved(router, 'GET', '/users/me') == ('me', {})
+
+
+def test_slashes_are_not_significant(router):
+    assert resolved(router, 'GET', 'users//42/') == ('show', {'id': '42'})
+
+
+def test_method_must_match_unless_any(router):
+    assert router.resolve('DELETE', '/users/42') == (None, None)
+    assert resolved(router, 'DELETE', '/health') == ('health', {})
+
+
+def test_mount_takes_the_rest_of_the_path(router):
+    assert resolved(router, 'GET', '/static/css/site.css') == ('static', {'*': '/css/site.css'})
+    assert resolved(router, 'GET', '/static') == ('static', {'*': '/'})
+    assert router.resolve('POST', '/static/x') == (None, None)
+
+
+def test_exact_route_wins_over_mount():
+    router = Router()
+    router.mount('/api', handler('mounted'))
+    router.add_route('GET', '/api/status', handler('status'))
+    assert resolved(router, 'GET', '/api/status') == ('status', {})
+    assert resolved(router, 'GET', '/api/other') == ('mounted', {'*': '/other'})
+
+
+def test_unknown_path(router):
+    assert router.resolve('GET', '/nope') == (None, None)
+
+
+def test_conflicting_parameter_names_are_rejected(router):
+    with pytest.raises(ValueError):
+        router.add_route('PUT', '/users/{name}', handler('rename'))
+
+
+def test_cached_results_are_copies(router):
+    _, params = router.resolve('GET', '/users/42')
+    params['id'] = 'changed'
+    assert resolved(router, 'GET', '/users/42') == ('show', {'id': '42'})
+
+
+def test_adding_a_route_clears_the_cache(router):
+    assert router.resolve('GET', '/new') == (None, None)
+    router.add_route('GET', '/new', handler('new'))
+    assert resolved(router, 'GET', '/new') == ('new', {})
+
+
+def test_cache_is_bounded():
+    router = Router(cache_size=2)
+    router.add_route('GET', '/items/{id}', handler('item'))
+    for item in range(5):
+        router.resolve('GET', f'/items/{item}')
+    assert list(router.cache) == [('GET', '/items/3'), ('GET', '/items/4')]
@@ -0,0 +1,78 @@
+# test_routing_table.py
+import pytest
+
+from routing_table import RoutingTable, int_to_ip, ip_to_int, parse_prefix
+
+
+@pytest.fixture
+def table():
+    table = RoutingTable()
+    table.add('0.0.0.0/0', 'GW')
+    table.add('10.0.0.0/8', 'A')
+    table.add('10.1.0.0/16', 'B', metric=5)
+    table.add('10.1.2.3', 'HOST')
+    return table
+
+
+def next_hop(table, address):
+    route = table.lookup(address)
+    return route.next_hop if route else None
+
+
+def test_longest_prefix_wins(table):
+    assert next_hop(table, '10.1.2.3') == 'HOST'
+    assert next_hop(table, '10.1.2.4') == 'B'
+    assert next_hop(table, '10.2.0.1') == 'A'
+    assert next_hop(table, '192.168.1.1') == 'GW'
+
+
+def test_without_default_route_nothing_matches():
+    table = RoutingTable()
+    table.add('10.0.0.0/8', 'A')
+    assert table.lookup('11.0.0.1') is None
+
+
+def test_lowest_metric_wins_for_the_same_prefix(table):
+    table.add('10.1.0.0/16', 'C', metric=1)
+    assert next_hop(table, '10.1.9.9') == 'C'
+    table.add('10.1.0.0/16', 'C', metric=9)  # Same next hop replaces the route
+    assert next_hop(table, '10.1.9.9') == 'B'
+    assert len(table) == 5
+
+
+def test_remove(table):
+    table.remove('10.1.2.3/32')
+    assert next_hop(table, '10.1.2.3') == 'B'
+    table.add('10.1.0.0/16', 'C', metric=9)
+    table.remove('10.1.0.0/16', 'B')
+    assert next_hop(table, '10.1.2.3') == 'C'
+    table.remove('10.1.0.0/16')
+    assert next_hop(table, '10.1.2.3') == 'A'
+    table.remove('172.16.0.0/12')  # Nothing there
+    assert len(table) == 2
+
+
+def test_cache_is_cleared_when_the_table_changes(table):
+    assert next_hop(table, '172.16.0.1') == 'GW'
+    table.add('172.16.0.0/12', 'D')
+    assert next_hop(table, '172.16.0.1') == 'D'
+
+
+def test_non_ipv4_destinations_use_the_default_route(table):
+    assert next_hop(table, 'unknown') == 'GW'
+
+
+def test_routes_are_listed_shortest_prefix_first(table):
+    assert [route.prefix for route in table.routes()] == ['0.0.0.0/0', '10.0.0.0/8', '10.1.0.0/16', '10.1.2.3/32']
+
+
+def test_parse_prefix_masks_host_bits():
+    assert parse_prefix('10.1.2.3/8') == (ip_to_int('10.0.0.0'), 8)
+    assert parse_prefix('10.1.2.3') == (ip_to_int('10.1.2.3'), 32)
+    assert int_to_ip(ip_to_int('192.168.0.1')) == '192.168.0.1'
+
+
+@pytest.mark.parametrize('destination', ['10.0.0.0/33', '10.0.0.0/-1', 'not-an-ip/8'])
+def test_parse_prefix_rejects_invalid_prefixes(destination):
+    with pytest.raises(ValueError):
+        parse_prefix(destination)
@@ -0,0 +1,159 @@
+# test_session_layer.py
+import threading
+
+import pytest
+
+from messages import SessionEnvelope
+from session_layer import SessionLayer
+from wire_format import WireCodec
+
+
+class RecordingTransport:
+    """Transport stand-in that records envelopes, with a backlog the test controls"""
+    def __init__(self):
+        self.codec = WireCodec()
+        self.sent = []
+        self.blocked = False
+        self.partial = False
+    
+    def connect_to_session_layer(self, session_layer):
+        pass
+    
+    def backlog(self):
+        return 1000 if self.blocked else 0
+    
+    def send_to_session(self, envelope, peer_ip):
+        self.sent.append(envelope)
+    
+    def receiving_partial(self):
+        return self.partial
+
+
+class RecordingPresentation:
+    def __init__(self):
+        self.received = []
+    
+    def receive_from_session(self, data, session_id):
+        self.received.append((session_id, data.encode() if isinstance(data, str) else bytes(data)))
+    
+    def release_session(self, session_id):
+        pass
+
+
+@pytest.fixture
+def layer():
+    layer = SessionLayer(window=400, quantum=100)
+    layer.connect_to_transport_layer(RecordingTransport())
+    layer.connect_to_presentation_layer(RecordingPresentation())
+    yield layer
+    layer.close()
+
+
+def receive(layer, envelope):
+    encoded = layer.transport_layer.codec.encode_envelope(envelope)
+    joined = ''.join(encoded) if isinstance(encoded[0], str) else b''.join(bytes(part) for part in encoded)
+    layer.receive_from_transport(joined, '192.168.1.2')
+
+
+def sent_messages(layer):
+    return [envelope for envelope in layer.transport_layer.sent if envelope.data is not None]
+
+
+def test_sessions_share_the_link_by_weight(layer):
+    bulk = layer.open_session('192.168.1.2')
+    favoured = layer.open_session('192.168.1.2', weight=2)
+    layer.transport_layer.blocked = True
+    for _ in range(3):
+        layer.send_to_transport(b'a' * 100, bulk)
+    for _ in range(4):
+        layer.send_to_transport(b'b' * 100, favoured)
+    assert sent_messages(layer) == [] and layer.queued() == 7
+    
+    layer.transport_layer.blocked = False
+    layer.transport_ready()
+    order = [envelope.session_id for envelope in sent_messages(layer)]
+    assert order == [bulk, favoured, favoured, bulk, favoured, favoured, bulk]
+    assert layer.queued() == 0
+
+
+def test_first_message_carries_our_window(layer):
+    session_id = layer.open_session('192.168.1.2')
+    layer.send_to_transport(b'x', session_id)
+    layer.send_to_transport(b'y', session_id)
+    assert [envelope.window for envelope in sent_messages(layer)] == [400, None]
+    assert [envelope.seq for envelope in sent_messages(layer)] == [0, 1]
+
+
+def test_sending_stops_at_the_peer_window_until_credit_comes_back(layer):
+    session_id = layer.open_session('192.168.1.2')
+    layer.sessions.get(session_id).peer_window = 250
+    for _ in range(5):
+        layer.send_to_transport(b'x' * 100, session_id)
+    assert len(sent_messages(layer)) == 3  # The last one overshoots the window
+    assert layer.queued(session_id) == 2
+    
+    receive(layer, SessionEnvelope(session_id, grant=200))
+    assert len(sent_messages(layer)) == 5
+    assert layer.sessions.get(session_id).in_flight == 300
+
+
+def test_a_blocked_session_does_not_hold_up_the_others(layer):
+    blocked = layer.open_session('192.168.1.2')
+    other = layer.open_session('192.168.1.2')
+    layer.sessions.get(blocked).peer_window = 100
+    for session_id in (blocked, blocked, other):
+        layer.send_to_transport(b'x' * 100, session_id)
+    assert [envelope.session_id for envelope in sent_messages(layer)] == [blocked, other]
+
+
+def test_credit_is_given_back_after_half_the_window_is_delivered(layer):
+    for seq in range(3):
+        receive(layer, SessionEnvelope('peer-1', 'x' * 100, seq=seq))
+    grants = [envelope for envelope in layer.transport_layer.sent if envelope.grant is not None]
+    assert [(envelope.session_id, envelope.grant) for envelope in grants] == [('peer-1', 200)]
+    assert len(layer.presentation_layer.received) == 3
+
+
+def delivered(layer):
+    return [data for _, data in layer.presentation_layer.received]
+
+
+def test_messages_that_overtook_an_earlier_one_are_held_back(layer):
+    layer.transport_layer.partial = True  # The overtaken message is still arriving
+    receive(layer, SessionEnvelope('peer-1', 'two', seq=1))
+    receive(layer, SessionEnvelope('peer-1', 'three', seq=2))
+    assert delivered(layer) == []
+    
+    receive(layer, SessionEnvelope('peer-1', 'one', seq=0))
+    assert delivered(layer) == [b'one', b'two', b'three']
+    assert not layer.reordering
+    
+    receive(layer, SessionEnvelope('peer-1', 'one', seq=0))  # A duplicate is dropped
+    assert delivered(layer) == [b'one', b'two', b'three']
+
+
+def test_gaps_are_skipped_once_nothing_is_partly_received(layer):
+    layer.transport_layer.partial = True
+    receive(layer, SessionEnvelope('peer-1', 'three', seq=2))
+    assert delivered(layer) == []
+    
+    layer.transport_layer.partial = False  # The missing messages will never come
+    receive(layer, SessionEnvelope('peer-1', 'four', seq=3))
+    assert delivered(layer) == [b'three', b'four']
+    assert layer.sessions.get('peer-1').receive_seq == 4
+
+
+def test_messages_without_numbers_are_delivered_as_they_come(layer):
+    receive(layer, SessionEnvelope('peer-1', 'b'))
+    receive(layer, SessionEnvelope('peer-1', 'a'))
+    assert delivered(layer) == [b'b', b'a']
+
+
+def test_concurrent_senders_keep_numbers_in_send_order(layer):
+    session_id = layer.open_session('192.168.1.2')
+    threads = [threading.Thread(target=lambda: [layer.send_to_transport(b'x', session_id) for _ in range(50)]) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert [envelope.seq for envelope in sent_messages(layer)] == list(range(200))
@@ -0,0 +1,93 @@
+# test_session_manager.py
+import time
+
+from session_manager import SessionManager
+
+
+class ManualTimers:
+    def __init__(self):
+        self.calls = []
+    
+    def call_later(self, delay, callback, *args):
+        timer = ManualTimer(delay, callback, args)
+        self.calls.append(timer)
+        return timer
+
+
+class ManualTimer:
+    def __init__(self, delay, callback, args):
+        self.delay = delay
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+    
+    def cancel(self):
+        self.cancelled = True
+
+
+def make_manager(**options):
+    closed = []
+    manager = SessionManager(timers=ManualTimers(), on_close=lambda session, reason: closed.append((session.session_id, reason)), **options)
+    return manager, closed
+
+
+def test_ids_are_unique_and_peer_ids_are_adopted():
+    manager, _ = make_manager()
+    first, second = manager.open('192.168.1.2'), manager.open('192.168.1.2')
+    assert first.session_id != second.session_id
+    assert first.session_id.startswith(manager.prefix)
+    adopted = manager.open('192.168.1.3', 'peer-1')
+    assert manager.open('192.168.1.3', 'peer-1') is adopted
+    assert len(manager) == 3 and 'peer-1' in manager
+
+
+def test_idle_sessions_expire_and_touched_ones_stay():
+    manager, closed = make_manager(idle_timeout=10, tick=1.0)
+    idle = manager.open('192.168.1.2')
+    busy = manager.open('192.168.1.2')
+    now = time.monotonic()
+    busy.last_activity = now + 8  # Touched after it was scheduled
+    
+    assert manager.expire_idle(now + 12) == 1
+    assert closed == [(idle.session_id, 'expired')]
+    assert idle.state == 'CLOSED' and busy.session_id in manager
+    assert manager.expire_idle(now + 20) == 1
+    assert manager.stats() == {'active': 0, 'created': 2, 'expired': 2, 'evicted': 0}
+
+
+def test_least_recently_active_session_is_evicted_at_the_cap():
+    manager, closed = make_manager(max_sessions=2)
+    first, second = manager.open('192.168.1.2'), manager.open('192.168.1.2')
+    manager.touch(first)
+    third = manager.open('192.168.1.2')
+    assert closed == [(second.session_id, 'evicted')]
+    assert list(manager.sessions) == [first.session_id, third.session_id]
+    assert manager.expire_idle(time.monotonic() + 1000) == 2  # The evicted session left the wheel
+
+
+def test_ended_sessions_are_remembered_up_to_a_limit():
+    manager, closed = make_manager(max_ended=2)
+    sessions = [manager.open('192.168.1.2') for _ in range(3)]
+    for session in sessions:
+        assert manager.close(session.session_id) is session
+    assert manager.close(sessions[0].session_id) is None
+    assert [reason for _, reason in closed] == ['closed'] * 3
+    assert not manager.has_ended(sessions[0].session_id)
+    assert manager.has_ended(sessions[1].session_id) and manager.has_ended(sessions[2].session_id)
+
+
+def test_expiry_ticks_only_while_sessions_are_open():
+    manager, _ = make_manager(idle_timeout=10, tick=1.0)
+    assert manager.timers.calls == []
+    session = manager.open('192.168.1.2')
+    assert [timer.delay for timer in manager.timers.calls] == [1.0]
+    manager.timers.calls[0].callback()
+    assert len(manager.timers.calls) == 2
+    
+    manager.close(session.session_id)
+    manager.timers.calls[1].callback()
+    assert len(manager.timers.calls) == 2
+    
+    manager.open('192.168.1.2')
+    manager.stop()
+    assert manager.timers.calls[2].cancelled
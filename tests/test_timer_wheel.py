@@ -0,0 +1,65 @@
+# test_timer_wheel.py
+from timer_wheel import TimerWheel
+
+
+def test_fires_once_the_deadline_has_passed():
+    wheel = TimerWheel(tick=1.0, slots=8, levels=2)
+    wheel.schedule('a', 5)
+    assert wheel.advance(4.9) == []
+    assert 'a' in wheel
+    assert wheel.advance(5) == ['a']
+    assert 'a' not in wheel and len(wheel) == 0
+    assert wheel.advance(100) == []
+
+
+def test_past_deadlines_fire_on_the_next_tick():
+    wheel = TimerWheel(tick=1.0, now=10.0)
+    wheel.schedule('late', 3)
+    assert wheel.advance(11) == ['late']
+
+
+def test_cancel_and_reschedule():
+    wheel = TimerWheel(tick=1.0, slots=8, levels=2)
+    wheel.schedule('a', 3)
+    wheel.schedule('b', 3)
+    wheel.cancel('a')
+    wheel.cancel('missing')
+    wheel.schedule('b', 6)  # Replaces the earlier deadline
+    assert wheel.advance(5) == []
+    assert wheel.advance(6) == ['b']
+
+
+def test_deadlines_on_higher_levels_cascade_down_in_order():
+    wheel = TimerWheel(tick=1.0, slots=4, levels=3)  # Levels cover 4, 16 and 64 ticks
+    deadlines = {'near': 2, 'level1': 9, 'level2': 37, 'boundary': 16}
+    for key, deadline in deadlines.items():
+        wheel.schedule(key, deadline)
+    
+    fired = {}
+    for now in range(1, 40):
+        for key in wheel.advance(now):
+            fired[key] = now
+    assert fired == deadlines
+
+
+def test_deadlines_beyond_the_top_level_are_parked_until_due():
+    wheel = TimerWheel(tick=1.0, slots=4, levels=2)  # The top level covers 16 ticks
+    wheel.schedule('far', 100)
+    for now in range(1, 100):
+        assert wheel.advance(now) == [], now
+    assert wheel.advance(100) == ['far']
+
+
+def test_fractional_ticks():
+    wheel = TimerWheel(tick=0.5)
+    wheel.schedule('a', 1.2)  # Rounded up to the tick at 1.5
+    assert wheel.advance(1.4) == []
+    assert wheel.advance(1.5) == ['a']
+
+
+def test_large_jump_fires_everything_due():
+    wheel = TimerWheel(tick=1.0, slots=4, levels=2)
+    for deadline in range(1, 50):
+        wheel.schedule(deadline, deadline)
+    assert sorted(wheel.advance(30)) == list(range(1, 31))
+    assert len(wheel) == 19
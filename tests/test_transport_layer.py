@@ -0,0 +1,281 @@
+# test_transport_layer.py
+import socket
+
+import pytest
+
+from messages import FLAG_ACK, FLAG_MORE, FLAG_PIGGYBACK, Segment
+from osi_stack import OSIStack
+from transport_layer import TransportLayer
+from wire_format import WIRE_FORMAT_BINARY, WIRE_FORMAT_JSON, WireCodec
+
+
+class ManualTimers:
+    """Scheduler whose timers only fire when the test says so"""
+    
+    def __init__(self):
+        self.timers = []
+    
+    def call_later(self, delay, callback, *args):
+        timer = ManualTimer(callback, args)
+        self.timers.append(timer)
+        return timer
+
+
+class ManualTimer:
+    def __init__(self, callback, args):
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+    
+    def cancel(self):
+        self.cancelled = True
+
+
+class RecordingNetwork:
+    """Network layer that keeps what the transport sends"""
+    
+    def __init__(self):
+        self.sent = []
+    
+    def connect_to_transport_layer(self, transport_layer):
+        pass
+    
+    def send_to_transport(self, segment, destination_ip):
+        self.sent.append(segment)
+    
+    def flush(self):
+        pass
+
+
+class RecordingSession:
+    def __init__(self):
+        self.received = []
+    
+    def receive_from_transport(self, data, source_ip):
+        self.received.append(bytes(data) if not isinstance(data, str) else data.encode())
+    
+    def transport_ready(self):
+        pass
+
+
+def make_transport(wire_format=WIRE_FORMAT_BINARY):
+    transport = TransportLayer(WireCodec(wire_format))
+    transport.timers = ManualTimers()
+    transport.connect_to_network_layer(RecordingNetwork())
+    transport.connect_to_session_layer(RecordingSession())
+    return transport
+
+
+def deliver(transport, segment):
+    """Hand a segment to the transport as it would arrive from the peer"""
+    encoded = transport.codec.encode_segment(segment)
+    transport.receive_from_network(encoded if isinstance(encoded, str) else b''.join(encoded), '10.0.0.1')
+
+
+def test_cumulative_ack_covers_everything_below_it():
+    transport = make_transport()
+    for index in range(3):
+        transport.send_to_session(b'message %d' % index, '10.0.0.1')
+    
+    deliver(transport, Segment(0, 2, FLAG_ACK | FLAG_PIGGYBACK, 64, 0, b''))
+    assert sorted(transport.send_buffer) == [2]
+
+
+def test_out_of_order_segments_are_delivered_in_order():
+    transport = make_transport()
+    deliver(transport, Segment(1, 0, FLAG_PIGGYBACK, 64, 2, b'second'))
+    assert transport.session_layer.received == []
+    deliver(transport, Segment(0, 0, FLAG_PIGGYBACK, 64, 1, b'first'))
+    assert transport.session_layer.received == [b'first', b'second']
+
+
+def test_timeout_resends_only_expired_segments_and_backs_off():
+    transport = make_transport()
+    transport.send_to_session(b'old', '10.0.0.1')
+    transport.send_to_session(b'new', '10.0.0.1')
+    transport.send_buffer[0].sent_at -= transport.rto
+    rto = transport.rto
+    sent = len(transport.network_layer.sent)
+    
+    transport._on_retransmit_timeout()
+    assert [segment.sequence for segment in transport.network_layer.sent[sent:]] == [0]
+    assert transport.send_buffer[0].retries == 1
+    assert transport.rto == 2 * rto
+
+
+def test_rtt_samples_set_the_rto_within_bounds():
+    transport = make_transport()
+    transport._update_rto(0.01)
+    assert transport.rto == transport.min_rto
+    for _ in range(20):
+        transport._update_rto(100.0)
+    assert transport.rto == transport.max_rto
+
+
+def test_window_limits_segments_in_flight():
+    transport = make_transport()
+    transport.peer_window = 2
+    for index in range(5):
+        transport.send_to_session(b'message %d' % index, '10.0.0.1')
+    assert sorted(transport.send_buffer) == [0, 1]
+    
+    deliver(transport, Segment(0, 1, FLAG_ACK | FLAG_PIGGYBACK, 2, 0, b''))
+    assert sorted(transport.send_buffer) == [1, 2]
+
+
+def test_giving_up_on_a_segment_fails_the_connection():
+    transport = make_transport()
+    failures = []
+    transport.on_failure = failures.append
+    transport.send_to_session(b'lost', '10.0.0.1')
+    
+    segment = transport.send_buffer[0]
+    segment.retries = transport.max_retries
+    segment.sent_at -= transport.rto
+    transport._on_retransmit_timeout()
+    
+    assert len(failures) == 1 and isinstance(failures[0], ConnectionError)
+    assert transport.closed and not transport.send_buffer
+    sent = len(transport.network_layer.sent)
+    transport.send_to_session(b'after', '10.0.0.1')
+    assert len(transport.network_layer.sent) == sent
+
+
+def test_stack_fails_pending_requests_when_the_peer_stops_acknowledging(port):
+    sink = socket.create_server(('127.0.0.1', port))
+    stack = OSIStack(port=port)
+    try:
+        stack.initialize()
+        peer, _ = sink.accept()  # Reads nothing, acknowledges nothing
+        stack.transport.rto = 0.02
+        future = stack.submit_request('GET', '/', '10.0.0.2', timeout=30)
+        with pytest.raises(ConnectionError):
+            future.result(10)
+        assert not stack.physical.connected
+        peer.settimeout(5)
+        while peer.recv(65536):
+            pass  # Until the reset reaches the peer
+        peer.close()
+    finally:
+        stack.close()
+        sink.close()
+
+
+@pytest.mark.parametrize('wire_format', [WIRE_FORMAT_BINARY, WIRE_FORMAT_JSON])
+def test_data_is_not_flagged_ack_for_a_legacy_peer(wire_format):
+    transport = make_transport(wire_format)
+    deliver(transport, Segment(0, 0, 0, 64, 1, b'request'))  # Legacy peers set no PIGGYBACK
+    transport.send_to_session(b'response', '10.0.0.1')
+    
+    data = transport.network_layer.sent[-1]
+    assert not data.flags & FLAG_ACK
+    assert data.flags & FLAG_PIGGYBACK
+    
+    # The ACK goes separately, once the delayed ACK timer fires
+    timer = transport.ack_timer
+    timer.callback(*timer.args)
+    ack = transport.network_layer.sent[-1]
+    assert ack.flags & FLAG_ACK and not ack.data and ack.ack == 1
+
+
+def test_data_carries_the_ack_once_the_peer_reads_piggybacked_acks():
+    transport = make_transport()
+    deliver(transport, Segment(0, 0, FLAG_PIGGYBACK, 64, 1, b'request'))
+    assert transport.codec.peer_piggyback_acks
+    transport.send_to_session(b'response', '10.0.0.1')
+    
+    data = transport.network_layer.sent[-1]
+    assert data.flags & FLAG_ACK and data.ack == 1
+    assert transport.ack_timer is None  # No separate ACK is needed
+
+
+def test_ack_flagged_data_from_a_new_peer_is_delivered():
+    transport = make_transport()
+    deliver(transport, Segment(0, 0, FLAG_ACK | FLAG_PIGGYBACK, 64, 1, b'request'))
+    assert transport.session_layer.received == [b'request']
+
+
+def test_legacy_ack_covers_only_its_own_segment():
+    transport = make_transport()
+    for index in range(3):
+        transport.send_to_session(b'message %d' % index, '10.0.0.1')
+    assert sorted(transport.send_buffer) == [0, 1, 2]
+    
+    deliver(transport, Segment(0, 1, FLAG_ACK, 64, 0, b''))
+    assert sorted(transport.send_buffer) == [0, 2]
+
+
+def test_in_order_segments_share_one_delayed_ack():
+    transport = make_transport()
+    for sequence in range(3):
+        deliver(transport, Segment(sequence, 0, FLAG_PIGGYBACK, 64, sequence + 1, b'data'))
+    assert transport.network_layer.sent == []
+    
+    timer = transport.ack_timer
+    timer.callback(*timer.args)
+    assert [(segment.ack, segment.flags & FLAG_ACK) for segment in transport.network_layer.sent] == [(3, FLAG_ACK)]
+
+
+def test_enough_unacknowledged_segments_are_acked_at_once():
+    transport = make_transport()
+    for sequence in range(transport.max_unacked_segments):
+        deliver(transport, Segment(sequence, 0, FLAG_PIGGYBACK, 64, sequence + 1, b'data'))
+    assert [segment.ack for segment in transport.network_layer.sent] == [transport.max_unacked_segments]
+    assert transport.ack_timer is None
+
+
+def test_gaps_are_acked_at_once():
+    transport = make_transport()
+    deliver(transport, Segment(2, 0, FLAG_PIGGYBACK, 64, 3, b'early'))
+    assert [segment.ack for segment in transport.network_layer.sent] == [0]
+
+
+def carry(sender, receiver):
+    """Deliver everything sender has sent so far to receiver"""
+    sent, sender.network_layer.sent = sender.network_layer.sent, []
+    for segment in sent:
+        deliver(receiver, segment)
+
+
+def test_messages_are_cut_at_the_mss_and_reassembled():
+    sender, receiver = make_transport(), make_transport()
+    sender.mss = 100
+    big = bytes(range(256)) * 4
+    sender.send_to_session(big, '10.0.0.2')
+    
+    segments = sender.network_layer.sent
+    assert [len(b''.join(bytes(part) for part in segment.data)) for segment in segments] == [100] * 10 + [24]
+    assert [bool(segment.flags & FLAG_MORE) for segment in segments] == [True] * 10 + [False]
+    carry(sender, receiver)
+    assert receiver.session_layer.received == [big]
+    assert not receiver.receiving_partial()
+
+
+def test_messages_queued_together_take_turns():
+    sender, receiver = make_transport(), make_transport()
+    sender.mss = 100
+    sender.peer_window = 0  # Hold everything back until the peer opens its window
+    sender.send_to_session(b'a' * 300, '10.0.0.2')
+    sender.send_to_session(b'small', '10.0.0.2')
+    assert sender.network_layer.sent == []
+    
+    deliver(sender, Segment(0, 0, FLAG_ACK | FLAG_PIGGYBACK, 64, 0, b''))
+    assert [segment.message for segment in sender.network_layer.sent] == [1, 2, 1, 1]
+    carry(sender, receiver)
+    assert receiver.session_layer.received == [b'small', b'a' * 300]
+
+
+def test_oversized_messages_are_dropped_without_buffering_them():
+    sender, receiver = make_transport(), make_transport()
+    sender.mss = 100
+    receiver.max_message_size = 250
+    sender.send_to_session(b'x' * 1000, '10.0.0.2')
+    sender.send_to_session(b'y' * 200, '10.0.0.2')
+    
+    segments = sender.network_layer.sent
+    sender.network_layer.sent = []
+    for segment in segments:
+        deliver(receiver, segment)
+        assert sum(receiver.partial_bytes.values()) <= receiver.max_message_size
+    assert receiver.session_layer.received == [b'y' * 200]
+    assert not receiver.receiving_partial() and not receiver.oversized
@@ -0,0 +1,126 @@
+# test_wire_format.py
+import json
+
+import pytest
+
+from messages import FLAG_ACK, FLAG_MORE, FLAG_PIGGYBACK, Frame, Packet, Segment, SessionEnvelope
+from wire_format import WIRE_FORMAT_BINARY, WIRE_FORMAT_JSON, WireCodec
+
+
+def nested_frame(data=b'payload', flags=FLAG_MORE):
+    segment = Segment(7, 3, flags, 64, 42, data)
+    packet = Packet('192.168.1.1', '192.168.1.2', 64, segment)
+    return Frame('00:00:00:00:00:01', '00:00:00:00:00:02', 'crc32', {'crc32', 'md5'}, packet)
+
+
+def decode_all(codec, frame):
+    received = codec.decode_frame(b''.join(codec.encode_frame(frame)))
+    packet = codec.decode_packet(received.data)
+    segment = codec.decode_segment(packet.data)
+    return received, packet, segment
+
+
+@pytest.mark.parametrize('wire_format', [WIRE_FORMAT_BINARY, WIRE_FORMAT_JSON])
+def test_frame_packet_segment_round_trip(wire_format):
+    codec = WireCodec(wire_format)
+    frame = nested_frame()
+    received, packet, segment = decode_all(codec, frame)
+    
+    assert (received.source_mac, received.destination_mac) == ('00:00:00:00:00:01', '00:00:00:00:00:02')
+    assert received.integrity == 'crc32'
+    assert received.accept == {'crc32', 'md5'}
+    assert received.checksum == frame.checksum
+    assert (packet.source_ip, packet.destination_ip, packet.ttl) == ('192.168.1.1', '192.168.1.2', 64)
+    assert (segment.sequence, segment.ack, segment.flags, segment.window, segment.message) == (7, 3, FLAG_MORE, 64, 42)
+    assert bytes(segment.data) == b'payload' if wire_format == WIRE_FORMAT_BINARY else segment.data == 'payload'
+
+
+def test_binary_segment_data_given_as_buffers_is_sent_back_to_back():
+    codec = WireCodec()
+    _, _, segment = decode_all(codec, nested_frame((b'abc', memoryview(b'def'), b'')))
+    assert bytes(segment.data) == b'abcdef'
+
+
+def test_json_frame_switches_a_negotiating_codec_to_json():
+    sender = WireCodec(WIRE_FORMAT_JSON)
+    receiver = WireCodec(WIRE_FORMAT_BINARY)
+    receiver.decode_frame(b''.join(sender.encode_frame(nested_frame())))
+    assert receiver.format == WIRE_FORMAT_JSON
+    
+    fixed = WireCodec(WIRE_FORMAT_BINARY, negotiate=False)
+    fixed.decode_frame(b''.join(sender.encode_frame(nested_frame())))
+    assert fixed.format == WIRE_FORMAT_BINARY
+
+
+@pytest.mark.parametrize('wire_format', [WIRE_FORMAT_BINARY, WIRE_FORMAT_JSON])
+def test_peek_frame_destination(wire_format):
+    codec = WireCodec(wire_format)
+    data = b''.join(codec.encode_frame(nested_frame()))
+    assert codec.peek_frame_destination(data) == '00:00:00:00:00:02'
+    assert codec.peek_frame_destination(b'\xb1') is None
+
+
+def test_unknown_wire_format_is_rejected():
+    with pytest.raises(ValueError):
+        WireCodec('xml')
+
+
+@pytest.mark.parametrize('wire_format', [WIRE_FORMAT_BINARY, WIRE_FORMAT_JSON])
+def test_piggyback_flag_marks_the_peer(wire_format):
+    codec = WireCodec(wire_format)
+    assert not codec.peer_piggyback_acks
+    decode_all(codec, nested_frame(flags=FLAG_ACK))
+    assert not codec.peer_piggyback_acks
+    _, _, segment = decode_all(codec, nested_frame(flags=FLAG_ACK | FLAG_PIGGYBACK))
+    assert segment.flags == FLAG_ACK | FLAG_PIGGYBACK
+    assert codec.peer_piggyback_acks
+
+
+def envelope_round_trip(codec, envelope):
+    encoded = codec.encode_envelope(envelope)
+    joined = ''.join(encoded) if isinstance(encoded[0], str) else b''.join(bytes(part) for part in encoded)
+    return codec.decode_envelope(joined)
+
+
+@pytest.mark.parametrize('wire_format,peer_binary', [(WIRE_FORMAT_BINARY, True), (WIRE_FORMAT_BINARY, False), (WIRE_FORMAT_JSON, False)])
+def test_close_envelope_round_trip(wire_format, peer_binary):
+    codec = WireCodec(wire_format)
+    codec.peer_binary_envelopes = peer_binary
+    close = envelope_round_trip(codec, SessionEnvelope('s-1', close=True))
+    assert (close.session_id, close.data, close.grant, close.close) == ('s-1', None, None, True)
+
+
+@pytest.mark.parametrize('wire_format,peer_binary', [(WIRE_FORMAT_BINARY, True), (WIRE_FORMAT_BINARY, False), (WIRE_FORMAT_JSON, False)])
+def test_grant_envelope_round_trip(wire_format, peer_binary):
+    codec = WireCodec(wire_format)
+    codec.peer_binary_envelopes = peer_binary
+    grant = envelope_round_trip(codec, SessionEnvelope('s-1', grant=4096))
+    assert (grant.session_id, grant.data, grant.grant, grant.close) == ('s-1', None, 4096, False)
+
+
+@pytest.mark.parametrize('peer_binary', [False, True])
+def test_envelope_round_trip(peer_binary):
+    codec = WireCodec()
+    codec.peer_binary_envelopes = peer_binary
+    received = envelope_round_trip(codec, SessionEnvelope('s-1', b'hello', seq=5, window=1024))
+    assert received.session_id == 's-1'
+    assert bytes(received.data) == b'hello' if peer_binary else received.data == 'hello'
+    assert (received.seq, received.window, received.grant, received.close) == (5, 1024, None, False)
+
+
+def test_binary_envelopes_only_once_the_peer_reads_them():
+    codec = WireCodec()
+    first = codec.encode_envelope(SessionEnvelope('s-1', b'x', seq=0))
+    assert json.loads(bytes(first[0]))['binary'] is True
+    
+    peer = WireCodec()
+    peer.decode_envelope(bytes(first[0]))
+    assert peer.peer_binary_envelopes
+    assert peer.encode_envelope(SessionEnvelope('s-1', b'y', seq=0))[0][0] == 0xB4
+
+
+def test_long_session_ids_fall_back_to_json():
+    codec = WireCodec()
+    codec.peer_binary_envelopes = True
+    received = envelope_round_trip(codec, SessionEnvelope('s' * 300, b'x'))
+    assert received.session_id == 's' * 300
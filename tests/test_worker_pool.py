@@ -0,0 +1,64 @@
+# test_worker_pool.py
+import threading
+import time
+
+import pytest
+
+from osi_stack import OSIStack
+from worker_pool import WorkerPool
+
+
+def test_try_submit_refuses_work_beyond_workers_and_queue():
+    pool = WorkerPool(max_workers=1, max_queue=1)
+    release = threading.Event()
+    try:
+        running = [pool.try_submit(release.wait, 5) for _ in range(2)]
+        assert all(future is not None for future in running)
+        assert pool.try_submit(release.wait, 5) is None
+        
+        release.set()
+        for future in running:
+            future.result(5)
+        deadline = time.monotonic() + 5
+        while pool.in_flight and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert pool.in_flight == 0
+        assert pool.try_submit(len, 'abc').result(5) == 3
+    finally:
+        release.set()
+        pool.shutdown()
+
+
+def test_unknown_mode_is_rejected():
+    with pytest.raises(ValueError):
+        WorkerPool(mode='fiber')
+
+
+@pytest.fixture
+def stacks(port):
+    server = OSIStack(is_server=True, port=port, link='loopback')
+    server.add_route('192.168.1.2', '00:00:00:00:00:02')
+    server.initialize()
+    client = OSIStack(port=port, mac_address='00:00:00:00:00:02', ip_address='192.168.1.2', link='loopback')
+    client.add_route('192.168.1.1', '00:00:00:00:00:01')
+    client.initialize()
+    yield server, client
+    client.close()
+    server.close()
+
+
+def test_saturated_pool_answers_503_at_once(stacks):
+    server, client = stacks
+    release = threading.Event()
+    server.register_route('GET', '/slow', lambda request: (200, 'OK', None, str(release.wait(10))))
+    server.register_route('GET', '/boom', lambda request: 1 / 0)
+    server.configure_workers('thread', max_workers=1, max_queue=1)
+    
+    slow = [client.submit_request('GET', '/slow', '192.168.1.1', timeout=10) for _ in range(4)]
+    rejected = [future.result(5)['status_code'] for future in slow[2:]]
+    assert rejected == [503, 503]
+    assert not release.is_set()  # Answered while the pool was still busy
+    
+    release.set()
+    assert [future.result(10)['status_code'] for future in slow[:2]] == [200, 200]
+    assert client.submit_request('GET', '/boom', '192.168.1.1', timeout=10).result()['status_code'] == 500
@@ -0,0 +1,90 @@
+# timer_wheel.py
+import math
+
+class TimerWheel:
+    """Hierarchical timing wheel for many coarse deadlines.
+    
+    Level 0 has one slot per tick; each slot of level n covers a whole
+    rotation of level n - 1. Scheduling and cancelling are O(1) set
+    operations. Advancing moves one tick at a time, and a higher level slot
+    is cascaded into the lower levels only when the wheel reaches it, so
+    every key is moved at most once per level. The wheel keeps no clock and
+    no thread: the owner calls advance() with the current time and locks
+    around it if needed. Deadlines beyond the top level are parked in its
+    last slot and placed again when that slot comes up.
+    """
+    
+    def __init__(self, tick=1.0, slots=64, levels=4, now=0.0):
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self.wheels = [[set() for _ in range(slots)] for _ in range(levels)]
+        self.spans = [slots ** level for level in range(levels)]  # Ticks per slot of each level
+        self.current = int(now // tick)  # Last tick that was processed
+        self.entries = {}  # Maps key to (deadline tick, level, slot)
+    
+    def schedule(self, key, deadline):
+        """Fire key once the wheel is advanced past deadline, replacing an earlier schedule"""
+        self.cancel(key)
+        # A deadline already behind us fires on the next tick
+        self._place(key, max(math.ceil(deadline / self.tick), self.current + 1))
+    
+    def _place(self, key, target):
+        for level, span in enumerate(self.spans):
+            # The slot must come up before this level's wheel wraps around
+            if target // span - self.current // span < self.slots:
+                slot = (target // span) % self.slots
+                break
+        else:
+            # Too far out even for the top level, park it in the last slot
+            level = self.levels - 1
+            slot = (self.current // self.spans[level] + self.slots - 1) % self.slots
+        self.wheels[level][slot].add(key)
+        self.entries[key] = (target, level, slot)
+    
+    def cancel(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            _, level, slot = entry
+            self.wheels[level][slot].discard(key)
+    
+    def advance(self, now):
+        """Process every tick up to now, returns the keys whose deadline has passed"""
+        end = int(now // self.tick)
+        if not self.entries:
+            self.current = max(self.current, end)
+            return []
+        
+        expired = []
+        while self.current < end:
+            self.current += 1
+            tick = self.current
+            # Higher levels first, so their keys can land in a lower slot
+            # that is cascaded or fired on this same tick
+            for level in range(self.levels - 1, 0, -1):
+                span = self.spans[level]
+                if tick % span:
+                    continue
+                slot = (tick // span) % self.slots
+                keys = self.wheels[level][slot]
+                self.wheels[level][slot] = set()
+                for key in keys:
+                    self._place(key, self.entries[key][0])
+            
+            slot = tick % self.slots
+            keys = self.wheels[0][slot]
+            if keys:
+                self.wheels[0][slot] = set()
+                for key in keys:
+                    del self.entries[key]
+                expired.extend(keys)
+            
+            if not self.entries:
+                self.current = end
+        return expired
+    
+    def __contains__(self, key):
+        return key in self.entries
+    
+    def __len__(self):
+        return len(self.entries)
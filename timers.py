@@ -0,0 +1,110 @@
+# timers.py
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+
+class Timer:
+    """Handle for a scheduled callback"""
+    
+    def __init__(self, when, callback, args):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+    
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimerScheduler:
+    """Runs callbacks after a delay on one shared background thread.
+    
+    Every layer of every stack in the process shares the default scheduler,
+    so timers cost a heap entry rather than a thread. Callbacks must be
+    short; anything slow should be handed off to another thread.
+    """
+    
+    def __init__(self):
+        self.heap = []
+        self.counter = itertools.count()  # Tie-breaker for equal deadlines
+        self.condition = threading.Condition()
+        self.thread = None
+    
+    def call_later(self, delay, callback, *args):
+        timer = Timer(time.monotonic() + delay, callback, args)
+        with self.condition:
+            heapq.heappush(self.heap, (timer.when, next(self.counter), timer))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='timers', daemon=True)
+                self.thread.start()
+            self.condition.notify()
+        return timer
+    
+    def _run(self):
+        while True:
+            with self.condition:
+                while True:
+                    if not self.heap:
+                        self.condition.wait()
+                        continue
+                    when, _, timer = self.heap[0]
+                    delay = when - time.monotonic()
+                    if delay <= 0:
+                        heapq.heappop(self.heap)
+                        break
+                    self.condition.wait(delay)
+            
+            if timer.cancelled:
+                continue
+            try:
+                timer.callback(*timer.args)
+            except Exception as e:
+                print(f"Timer callback error: {e}")
+
+
+class AsyncioTimerScheduler:
+    """Same interface as TimerScheduler, but runs callbacks on an asyncio loop.
+    
+    Worker and writer threads arm timers too, and a loop may only be used
+    from its own thread, so timers from any other thread are handed to it
+    with call_soon_threadsafe. Timer.cancel only sets a flag, so it is safe
+    from any thread.
+    """
+    
+    def __init__(self, loop):
+        self.loop = loop
+    
+    def call_later(self, delay, callback, *args):
+        timer = Timer(time.monotonic() + delay, callback, args)
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        
+        if running is self.loop:
+            self.loop.call_later(delay, self._fire, timer)
+        else:
+            try:
+                self.loop.call_soon_threadsafe(self.loop.call_later, delay, self._fire, timer)
+            except RuntimeError:
+                timer.cancelled = True  # The loop is closed, nothing runs on it any more
+        return timer
+    
+    @staticmethod
+    def _fire(timer):
+        if not timer.cancelled:
+            timer.callback(*timer.args)
+
+
+_default_scheduler = None
+_default_lock = threading.Lock()
+
+def default_scheduler():
+    """The process-wide scheduler shared by all stacks"""
+    global _default_scheduler
+    with _default_lock:
+        if _default_scheduler is None:
+            _default_scheduler = TimerScheduler()
+        return _default_scheduler
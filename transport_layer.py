@@ -1,14 +1,91 @@
 # transport_layer.py
-import json
+import threading
+import time
+from collections import deque
+
+from messages import FLAG_ACK, FLAG_MORE, FLAG_PIGGYBACK, Segment, SessionEnvelope
+from metrics import NULL_METRICS
+from timers import default_scheduler
+from wire_format import WireCodec, as_bytes, as_text, detach
+
+class QueuedMessage:
+    """A message waiting to be cut into segments, as the buffers it is sent from"""
+    __slots__ = ('message_id', 'parts', 'index', 'offset', 'destination_ip')
+    
+    def __init__(self, message_id, parts, destination_ip):
+        self.message_id = message_id
+        self.parts = parts
+        self.index = 0  # Part the next segment starts in
+        self.offset = 0  # Position in that part
+        self.destination_ip = destination_ip
+    
+    def cut(self, size):
+        """Take the next size bytes (fewer at the end), as a tuple of slices of the parts"""
+        chunk = []
+        while size and self.index < len(self.parts):
+            part = self.parts[self.index]
+            piece = part[self.offset:self.offset + size]
+            if piece:
+                chunk.append(piece)
+            size -= len(piece)
+            self.offset += len(piece)
+            if self.offset >= len(part):
+                self.index += 1
+                self.offset = 0
+        return tuple(chunk)
+    
+    def done(self):
+        return self.index >= len(self.parts)
+
 
 class TransportLayer:
-    def __init__(self):
+    def __init__(self, codec=None, window=64, mss=8192):
+        self.codec = codec if codec is not None else WireCodec()
         self.network_layer = None
         self.session_layer = None
+        self.timers = default_scheduler()
+        self.metrics = NULL_METRICS
+        self.lock = threading.Lock()  # Guards the send side state below
+        
+        # Send side (selective repeat)
         self.sequence_number = 0
-        self.expected_sequence = 0
-        self.buffer = {}
+        self.sequence_lock = threading.Lock()  # Sequence numbers are taken one at a time
+        self.emit_queue = deque()  # (segment, destination) cut but not yet sent, in sequence order
+        self.emit_lock = threading.Lock()  # Held by the one thread sending the emit queue
+        self.window = window  # Max segments in flight and advertised receive window
+        self.peer_window = window  # Last window advertised by the peer
+        self.send_buffer = {}  # Maps sequence to the in-flight Segment awaiting an ACK
+        self.mss = mss  # Max payload bytes per segment
+        self.outbound = deque()  # QueuedMessages with data still to be segmented
+        self.message_id = 0
         self.max_retries = 3
+        self.retransmit_timer = None
+        self.closed = False  # No timers are armed once closed
+        self.on_failure = None  # Optional callable(error) run when the peer stops acknowledging
+        
+        # Retransmission timeout from smoothed RTT (Jacobson/Karels)
+        self.srtt = None
+        self.rttvar = None
+        self.rto = 1.0
+        self.min_rto = 0.2
+        self.max_rto = 60.0
+        
+        # Receive side
+        self.expected_sequence = 0
+        self.receive_buffer = {}  # Maps sequence to a segment that arrived early
+        self.partial_messages = {}  # Maps message id to the fragments received so far
+        self.partial_bytes = {}  # Maps message id to the size of its fragments so far
+        self.oversized = set()  # Ids of messages being dropped until their last segment
+        # Fragments wait for the rest of their message, so what one message
+        # holds here is bounded by this, not by the window
+        self.max_message_size = 16 * 1024 * 1024
+        
+        # Delayed ACKs: one cumulative ACK covers several segments, and it is
+        # dropped altogether when outbound data can carry it instead
+        self.ack_delay = 0.04
+        self.max_unacked_segments = 8
+        self.unacked_segments = 0  # In-order segments received since our last ACK
+        self.ack_timer = None
     
     def connect_to_network_layer(self, network_layer):
         self.network_layer = network_layer
@@ -17,101 +94,363 @@ class TransportLayer:
     def connect_to_session_layer(self, session_layer):
         self.session_layer = session_layer
     
-    def create_segment(self, data):
-        # TCP-like segment format:
-        # {
-        #   'sequence': <sequence number>,
-        #   'ack': <acknowledgment number>,
-        #   'flags': <control flags>,
-        #   'window': <window size>,
-        #   'data': <payload>
-        # }
-        segment = {
-            'sequence': self.sequence_number,
-            'ack': 0,
-            'flags': {'SYN': False, 'ACK': False, 'FIN': False},
-            'window': 64,  # Default window size
-            'data': data
-        }
-        
-        # Increment sequence number for next segment
-        self.sequence_number += 1
-        
-        return segment
+    def create_segment(self, data, message_id=0, more=False):
+        # TCP-like segment (see messages.Segment), serialized with the frame
+        # that carries it. Every segment says we take piggybacked ACKs. Take
+        # the sequence number and move on to the next one atomically
+        with self.sequence_lock:
+            sequence = self.sequence_number
+            self.sequence_number += 1
+        
+        flags = FLAG_PIGGYBACK | (FLAG_MORE if more else 0)
+        return Segment(sequence, 0, flags, self.advertised_window(), message_id, data)
+    
+    def advertised_window(self):
+        """Free slots in our receive buffer"""
+        return max(self.window - len(self.receive_buffer), 0)
     
     def send_to_network(self, segment, destination_ip):
-        # Serialize and send the segment
-        serialized_segment = json.dumps(segment)
+        # Piggyback an ACK for everything received so far, once the peer has
+        # said it reads data on ACK segments. Older peers would drop the data,
+        # they get separate bare ACKs instead
+        if self.codec.peer_piggyback_acks:
+            with self.lock:
+                segment.ack = self.expected_sequence
+                segment.flags |= FLAG_ACK
+                self._clear_delayed_ack()
+        
+        self.metrics.count('transport.segments_sent')
         if self.network_layer:
-            self.network_layer.send_to_transport(serialized_segment, destination_ip)
-            print(f"Segment {segment['sequence']} sent")
+            self.network_layer.send_to_transport(segment, destination_ip)
+            print(f"Segment {segment.sequence} sent")
+    
+    def _fill_window(self):
+        """Cut segments from queued messages while the window allows, returns them.
+        
+        Messages take turns one segment at a time, so a small message queued
+        behind a large one is sent right away instead of after all of it.
+        """
+        ready = []
+        now = time.monotonic()
+        send_window = min(self.window, self.peer_window)
+        while self.outbound and len(self.send_buffer) < send_window:
+            message = self.outbound.popleft()
+            chunk = message.cut(self.mss)
+            more = not message.done()
+            if more:
+                self.outbound.append(message)
+            
+            segment = self.create_segment(chunk, message.message_id, more)
+            segment.destination_ip = message.destination_ip
+            segment.sent_at = now
+            self.send_buffer[segment.sequence] = segment
+            ready.append((segment, message.destination_ip))
+        
+        if ready:
+            self._arm_retransmit_timer()
+        return ready
+    
+    def _arm_retransmit_timer(self):
+        if self.retransmit_timer is None and self.send_buffer and not self.closed:
+            self.retransmit_timer = self.timers.call_later(self.rto, self._on_retransmit_timeout)
+    
+    def _restart_retransmit_timer(self):
+        if self.retransmit_timer is not None:
+            self.retransmit_timer.cancel()
+            self.retransmit_timer = None
+        self._arm_retransmit_timer()
+    
+    def _on_retransmit_timeout(self):
+        """Resend only the segments whose RTO has expired (selective repeat)"""
+        resend = []
+        failure = None
+        with self.lock:
+            self.retransmit_timer = None
+            now = time.monotonic()
+            
+            for sequence, segment in list(self.send_buffer.items()):
+                if now - segment.sent_at < self.rto:
+                    continue
+                if segment.retries >= self.max_retries:
+                    failure = ConnectionError(f"Segment {sequence} unacknowledged after {self.max_retries} retries")
+                    break
+                segment.retries += 1
+                segment.sent_at = now
+                resend.append((segment, segment.destination_ip))
+            else:
+                # Exponential backoff until a fresh RTT sample arrives
+                if resend:
+                    self.metrics.count('transport.retransmits', len(resend))
+                    self.rto = min(self.rto * 2, self.max_rto)
+                
+                self._arm_retransmit_timer()
+                resend.extend(self._fill_window())
+                self.emit_queue.extend(resend)
+        
+        if failure is not None:
+            self._fail(failure)
+            return
+        self._emit()
     
-    def receive_from_network(self, data):
+    def _fail(self, error):
+        """Give the connection up and report why.
+        
+        The peer takes no segment past one it never got, so once a segment
+        runs out of retries nothing more can be delivered: everything still
+        queued is dropped and on_failure tells the stack.
+        """
+        print(f"Transport failed: {error}")
+        self.metrics.count('transport.dropped.retries_exhausted')
+        self.close()
+        if self.on_failure:
+            self.on_failure(error)
+    
+    def _update_rto(self, sample):
+        self.metrics.observe('transport.rtt', sample)
+        if self.srtt is None:
+            self.srtt = sample
+            self.rttvar = sample / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - sample)
+            self.srtt = 0.875 * self.srtt + 0.125 * sample
+        self.rto = min(max(self.srtt + 4 * self.rttvar, self.min_rto), self.max_rto)
+    
+    def _process_ack(self, segment):
+        """Handle a cumulative ACK: everything below segment.ack has arrived"""
+        ack = segment.ack
+        with self.lock:
+            self.peer_window = segment.window
+            
+            # Peers that predate cumulative ACKs acknowledge one segment, by its sequence
+            if segment.flags & FLAG_PIGGYBACK:
+                acked = [sequence for sequence in self.send_buffer if sequence < ack]
+            else:
+                acked = [ack] if ack in self.send_buffer else []
+            if acked:
+                print(f"ACK received up to segment {max(acked)}")
+            
+            # Karn's rule: only segments sent once give a usable RTT sample
+            now = time.monotonic()
+            newest = self.send_buffer[max(acked)] if acked else None
+            if newest is not None and newest.retries == 0:
+                self._update_rto(now - newest.sent_at)
+            
+            for sequence in acked:
+                del self.send_buffer[sequence]
+            
+            if acked:
+                self._restart_retransmit_timer()
+            self.emit_queue.extend(self._fill_window())
+        
+        self._emit()
+        
+        # Room in the window, let the session layer queue its next messages
+        if acked and self.session_layer:
+            self.session_layer.transport_ready()
+    
+    def _emit(self):
+        """Send queued segments in the order their sequence numbers were taken.
+        
+        Segments are queued under self.lock as they are cut. Whichever thread
+        gets emit_lock sends everything queued, including the segments of
+        threads that found it taken, so no caller waits for another's send
+        and segments reach the network in sequence order.
+        """
+        while self.emit_queue:
+            if not self.emit_lock.acquire(blocking=False):
+                return  # The thread holding it sends ours as well
+            try:
+                sent = False
+                while self.emit_queue:
+                    segment, destination_ip = self.emit_queue.popleft()
+                    self.send_to_network(segment, destination_ip)
+                    sent = True
+                self._flush(sent)
+            finally:
+                self.emit_lock.release()
+    
+    def _flush(self, sent=True):
+        """End of a burst: the segments just sent should not wait to be coalesced"""
+        if sent and self.network_layer:
+            self.network_layer.flush()
+    
+    def backlog(self):
+        """Messages queued that have not been fully cut into segments yet"""
+        return len(self.outbound)
+    
+    def _clear_delayed_ack(self):
+        """Our peer is about to be acknowledged, drop any pending delayed ACK"""
+        self.unacked_segments = 0
+        if self.ack_timer is not None:
+            self.ack_timer.cancel()
+            self.ack_timer = None
+    
+    def _schedule_ack(self, destination_ip):
+        """Acknowledge now if enough segments are waiting, otherwise after ack_delay"""
+        with self.lock:
+            if not self.unacked_segments or self.closed:
+                return  # Already piggybacked on outbound data, or nobody to tell
+            if self.unacked_segments < self.max_unacked_segments:
+                if self.ack_timer is None:
+                    self.ack_timer = self.timers.call_later(self.ack_delay, self._send_ack, destination_ip)
+                return
+        self._send_ack(destination_ip)
+    
+    def _send_ack(self, destination_ip):
+        """Acknowledge everything received in order so far"""
+        with self.lock:
+            self._clear_delayed_ack()
+            
+            # A bare ACK carries no data, so it takes no sequence number
+            with self.sequence_lock:
+                sequence = self.sequence_number
+            ack_segment = Segment(sequence, self.expected_sequence, FLAG_ACK | FLAG_PIGGYBACK,
+                                  self.advertised_window(), 0, ())
+        
+        self.metrics.count('transport.acks_sent')
+        if self.network_layer:
+            self.network_layer.send_to_transport(ack_segment, destination_ip)
+            self.network_layer.flush()
+    
+    def close(self):
+        """Stop retransmitting and acknowledging, unsent and unacknowledged data is dropped"""
+        with self.lock:
+            self.closed = True
+            if self.retransmit_timer is not None:
+                self.retransmit_timer.cancel()
+                self.retransmit_timer = None
+            self._clear_delayed_ack()
+            self.send_buffer.clear()
+            self.outbound.clear()
+            self.emit_queue.clear()
+    
+    def receive_from_network(self, data, source_ip="unknown"):
         try:
             # Parse the segment
-            segment = json.loads(data)
+            start = time.perf_counter()
+            segment = self.codec.decode_segment(data)
+            self.metrics.observe('transport.decode', time.perf_counter() - start)
+            self.metrics.count('transport.segments_received')
             
             # Check for ACK flag
-            if segment['flags']['ACK']:
-                print(f"ACK received for segment {segment['ack']}")
-                # Remove from retransmission buffer if needed
-                if segment['ack'] in self.buffer:
-                    del self.buffer[segment['ack']]
-                return
+            if segment.flags & FLAG_ACK:
+                self._process_ack(segment)
+                
+                # A bare ACK has no data to deliver
+                if not segment.data:
+                    return
             
             # Process regular data segment
-            print(f"Segment {segment['sequence']} received")
-            
-            # Send ACK
-            ack_segment = {
-                'sequence': self.sequence_number,
-                'ack': segment['sequence'],
-                'flags': {'SYN': False, 'ACK': True, 'FIN': False},
-                'window': 64,
-                'data': ''
-            }
-            
-            # Increment sequence number for next segment
-            self.sequence_number += 1
-            
-            # Send acknowledgment
-            if self.network_layer:
-                self.network_layer.send_to_transport(json.dumps(ack_segment), segment['source_ip'] if 'source_ip' in segment else "unknown")
+            sequence = segment.sequence
+            print(f"Segment {sequence} received")
             
             # Check if this is the segment we're expecting
-            if segment['sequence'] == self.expected_sequence:
-                self.expected_sequence += 1
+            if sequence == self.expected_sequence:
+                with self.lock:
+                    self.expected_sequence += 1
+                    self.unacked_segments += 1
                 
                 # Forward data to the session layer
-                if self.session_layer and 'data' in segment:
-                    self.session_layer.receive_from_transport(segment['data'])
+                self._reassemble(segment, source_ip)
                 
                 # Check if we have buffered segments that can now be processed
-                while self.expected_sequence in self.buffer:
-                    buffered_segment = self.buffer[self.expected_sequence]
-                    del self.buffer[self.expected_sequence]
-                    self.expected_sequence += 1
+                while self.expected_sequence in self.receive_buffer:
+                    buffered_segment = self.receive_buffer.pop(self.expected_sequence)
+                    with self.lock:
+                        self.expected_sequence += 1
+                        self.unacked_segments += 1
                     
                     # Forward data from buffered segment
-                    if self.session_layer and 'data' in buffered_segment:
-                        self.session_layer.receive_from_transport(buffered_segment['data'])
-            
-            # If not the expected sequence, buffer it
-            elif segment['sequence'] > self.expected_sequence:
-                self.buffer[segment['sequence']] = segment
-                print(f"Segment {segment['sequence']} buffered (expecting {self.expected_sequence})")
+                    self._reassemble(buffered_segment, source_ip)
+                
+                # Any response sent meanwhile already carried the ACK
+                self._schedule_ack(source_ip)
             
-            # Else it's a duplicate or old segment, just acknowledge it
+            # If it is ahead but inside our window, buffer it
+            elif self.expected_sequence < sequence < self.expected_sequence + self.window:
+                # The payload still points into the physical receive buffer
+                segment.data = detach(segment.data)
+                self.receive_buffer[sequence] = segment
+                print(f"Segment {sequence} buffered (expecting {self.expected_sequence})")
+                self.metrics.count('transport.out_of_order')
                 
+                # A gap means loss, tell the sender at once
+                self._send_ack(source_ip)
+            
+            # Else it's a duplicate, old, or beyond the window: ACK right away
+            # so the sender learns where we are
+            else:
+                self.metrics.count('transport.dropped.duplicate_or_out_of_window')
+                self._send_ack(source_ip)
+        
         except Exception as e:
             print(f"Transport layer error: {e}")
+            self.metrics.count('transport.dropped.error')
+    
+    def _reassemble(self, segment, source_ip):
+        """Collect in-order fragments and pass each complete message to the session layer.
+        
+        A message in one segment is passed on as a view of the receive buffer,
+        the session layer copies it if it has to keep it. A message growing
+        past max_message_size is dropped, the rest of its segments included.
+        """
+        # Segments from peers without segmentation carry a whole message
+        message_id = segment.message
+        data = segment.data
+        more = segment.flags & FLAG_MORE
+        if message_id in self.oversized:
+            if not more:
+                self.oversized.discard(message_id)
+            return
+        
+        size = self.partial_bytes.pop(message_id, 0) + len(data)
+        if size > self.max_message_size:
+            print(f"Message {message_id} is over {self.max_message_size} bytes, dropping it")
+            self.metrics.count('transport.dropped.message_too_large')
+            self.partial_messages.pop(message_id, None)
+            if more:
+                self.oversized.add(message_id)
+            return
+        
+        if more:
+            self.partial_bytes[message_id] = size
+            self.partial_messages.setdefault(message_id, []).append(detach(data))
+            return
+        
+        fragments = self.partial_messages.pop(message_id, None)
+        if fragments:
+            fragments.append(data)
+            data = fragments[0][:0].join(fragments)
+        
+        if self.session_layer:
+            self.session_layer.receive_from_transport(data, source_ip)
+    
+    def receiving_partial(self):
+        """Whether some message has arrived in part and is waiting for the rest"""
+        return bool(self.partial_messages)
     
     def send_to_session(self, data, destination_ip):
-        # Create segment
-        segment = self.create_segment(data)
+        # A SessionEnvelope is encoded into its header and a view of its
+        # payload, which segments are cut from without copying it. Binary
+        # segments are cut at byte boundaries, JSON ones at characters
+        if isinstance(data, SessionEnvelope):
+            parts = self.codec.encode_envelope(data)
+        elif self.codec.binary:
+            parts = (memoryview(as_bytes(data)),)
+        else:
+            parts = (as_text(data),)
+        if not any(parts):
+            print("Nothing to send")
+            return
+        if self.closed:
+            self.metrics.count('transport.dropped.closed')
+            return
         
-        # Add to retransmission buffer
-        self.buffer[segment['sequence']] = segment
+        # Queue the message, it is segmented as the send window opens
+        with self.lock:
+            self.message_id = (self.message_id + 1) % 2**32
+            self.outbound.append(QueuedMessage(self.message_id, parts, destination_ip))
+            self.emit_queue.extend(self._fill_window())
         
-        # Send segment
-        self.send_to_network(segment, destination_ip)
+        # Send whatever fits in the window now, the rest goes out as ACKs arrive
+        self._emit()
@@ -0,0 +1,371 @@
+# wire_format.py
+import json
+import socket
+import struct
+from functools import lru_cache
+
+from integrity import ALGORITHMS, ALGORITHMS_BY_ID, LEGACY_INTEGRITY, mask_to_names, names_to_mask
+from messages import FLAG_PIGGYBACK, SEGMENT_FLAGS, Frame, Packet, Segment, SessionEnvelope
+
+WIRE_FORMAT_BINARY = 'binary'
+WIRE_FORMAT_JSON = 'json'
+WIRE_FORMATS = (WIRE_FORMAT_BINARY, WIRE_FORMAT_JSON)
+
+# Every binary header starts with a magic byte. None of them can start a
+# JSON document, so the format of any received unit can be told from its
+# first byte alone.
+FRAME_MAGIC = 0xB1
+PACKET_MAGIC = 0xB2
+SEGMENT_MAGIC = 0xB3
+SESSION_MAGIC = 0xB4
+FRAME_VERSION = 2
+LEGACY_FRAME_VERSION = 1
+
+# Frame header:   magic, version, integrity algorithm id, mask of accepted
+#                 algorithm ids, destination MAC, source MAC, then a digest
+#                 whose length depends on the algorithm
+# Version 1:      magic, version, destination MAC, source MAC, MD5 digest
+# Packet header:  magic, source IP, destination IP, TTL
+# Segment header: magic, sequence, ack, flag bits, window, message id
+# Session header: magic, bits of the fields present, seq, window, grant,
+#                 length of the session id, then the id
+FRAME_HEADER = struct.Struct('!BBBB6s6s')
+LEGACY_FRAME_HEADER = struct.Struct('!BB6s6s16s')
+PACKET_HEADER = struct.Struct('!B4s4sB')
+SEGMENT_HEADER = struct.Struct('!BIIBHI')
+SESSION_HEADER = struct.Struct('!BBIIIB')
+
+SESSION_SEQ = 0x01
+SESSION_WINDOW = 0x02
+SESSION_GRANT = 0x04
+SESSION_DATA = 0x08
+SESSION_CLOSE = 0x10
+MAX_SESSION_ID_LENGTH = 255  # Longer ids are sent in JSON envelopes
+
+UNKNOWN_IP = '0.0.0.0'
+
+# JSON frames are dumped with source_mac then destination_mac first, so the
+# destination can be found in a short prefix without parsing the payload
+JSON_DESTINATION_KEY = b'"destination_mac": "'
+JSON_PEEK_LENGTH = 96
+MAC_TEXT_LENGTH = 17
+
+
+# Stacks talk to a handful of addresses, so their conversions are cached
+@lru_cache(maxsize=1024)
+def mac_to_bytes(mac_address):
+    """Convert 'AA:BB:CC:DD:EE:FF' to its 6 raw bytes"""
+    return bytes.fromhex(mac_address.replace(':', ''))
+
+
+@lru_cache(maxsize=1024)
+def bytes_to_mac(raw):
+    return ':'.join(f'{byte:02X}' for byte in raw)
+
+
+@lru_cache(maxsize=1024)
+def ip_to_bytes(ip_address):
+    """Convert a dotted IPv4 address to 4 raw bytes (0.0.0.0 if it is not one)"""
+    try:
+        return socket.inet_aton(ip_address)
+    except (OSError, TypeError):
+        return socket.inet_aton(UNKNOWN_IP)
+
+
+@lru_cache(maxsize=1024)
+def bytes_to_ip(raw):
+    return socket.inet_ntoa(bytes(raw))
+
+
+def as_bytes(data):
+    if isinstance(data, str):
+        return data.encode()
+    return data
+
+
+def as_text(data):
+    if isinstance(data, str):
+        return data
+    return bytes(data).decode()
+
+
+def detach(data):
+    """Copy a payload out of the shared physical receive buffer before keeping it"""
+    if isinstance(data, memoryview):
+        return data.tobytes()
+    return data
+
+
+def is_binary(data, magic):
+    """Check whether a received unit uses the binary header with this magic byte"""
+    if isinstance(data, str):
+        return False
+    return len(data) > 0 and data[0] == magic
+
+
+class WireCodec:
+    """Serializes frames, packets, segments and session envelopes in the negotiated wire format.
+    
+    One codec is shared by the data link, network, transport and session
+    layers of a stack. Received units are decoded in whichever format they
+    arrive in; when negotiation is enabled and the peer sends JSON, outbound
+    traffic falls back to JSON so that older peers keep working.
+    """
+    
+    def __init__(self, wire_format=WIRE_FORMAT_BINARY, negotiate=True):
+        if wire_format not in WIRE_FORMATS:
+            raise ValueError(f"Unknown wire format: {wire_format}")
+        self.format = wire_format
+        self.negotiate = negotiate
+        self.peer_binary_envelopes = False  # Whether the peer has said it reads binary session envelopes
+        self.peer_piggyback_acks = False  # Whether the peer has said it reads data on ACK segments
+    
+    @property
+    def binary(self):
+        return self.format == WIRE_FORMAT_BINARY
+    
+    def peer_format_seen(self, wire_format):
+        """Adapt the outbound format to what the peer just sent"""
+        if self.negotiate and wire_format == WIRE_FORMAT_JSON and self.binary:
+            self.format = WIRE_FORMAT_JSON
+            print("Peer uses the JSON wire format, switching to JSON")
+    
+    # Units are encoded once, when the data link hands a frame to the
+    # physical layer. In binary a unit is a list of buffers to be written
+    # back to back: the headers of the unit and of those nested in it are
+    # packed into one small bytes object, and the payload stays the caller's
+    # buffers, so it is never copied on the way down. In JSON a unit is the
+    # text of the one it carries.
+    
+    def _buffers(self, data):
+        """Binary encoding of a Packet, a Segment or a raw payload"""
+        headers = []
+        while True:
+            kind = type(data)
+            if kind is Packet:
+                headers.append(PACKET_HEADER.pack(
+                    PACKET_MAGIC,
+                    ip_to_bytes(data.source_ip),
+                    ip_to_bytes(data.destination_ip),
+                    data.ttl
+                ))
+            elif kind is Segment:
+                headers.append(SEGMENT_HEADER.pack(
+                    SEGMENT_MAGIC,
+                    data.sequence,
+                    data.ack,
+                    data.flags,
+                    data.window,
+                    data.message or 0
+                ))
+            else:
+                break
+            data = data.data
+        
+        buffers = [b''.join(headers)]
+        if kind is tuple:
+            buffers.extend(as_bytes(part) for part in data)
+        else:
+            buffers.append(as_bytes(data))
+        return buffers
+    
+    def _text(self, data):
+        if isinstance(data, Packet):
+            return self.encode_packet(data)
+        if isinstance(data, Segment):
+            return self.encode_segment(data)
+        if isinstance(data, tuple):
+            return ''.join(as_text(part) for part in data)
+        return as_text(data)
+    
+    # Frames
+    
+    def encode_frame(self, frame):
+        """Buffers of a Frame and everything it carries, its checksum is computed here"""
+        algorithm = ALGORITHMS[frame.integrity]
+        if self.binary:
+            buffers = self._buffers(frame.data)
+            frame.checksum = algorithm.compute_parts(buffers)
+            header = FRAME_HEADER.pack(
+                FRAME_MAGIC,
+                FRAME_VERSION,
+                algorithm.algorithm_id,
+                names_to_mask(frame.accept),
+                mac_to_bytes(frame.destination_mac),
+                mac_to_bytes(frame.source_mac)
+            )
+            buffers[0] = header + frame.checksum + buffers[0]
+            return buffers
+        
+        # Frames from peers that predate 'integrity' have an MD5 hex checksum
+        text = self._text(frame.data)
+        frame.checksum = algorithm.compute(text.encode())
+        return [json.dumps({
+            'source_mac': frame.source_mac,
+            'destination_mac': frame.destination_mac,
+            'data': text,
+            'checksum': frame.checksum.hex(),
+            'integrity': frame.integrity,
+            'accept': sorted(frame.accept)
+        }).encode()]
+    
+    def decode_frame(self, frame_data):
+        if is_binary(frame_data, FRAME_MAGIC):
+            version = frame_data[1] if len(frame_data) > 1 else None
+            if version == LEGACY_FRAME_VERSION:
+                _, _, destination, source, checksum = LEGACY_FRAME_HEADER.unpack_from(frame_data)
+                return Frame(bytes_to_mac(source), bytes_to_mac(destination), LEGACY_INTEGRITY,
+                             {LEGACY_INTEGRITY}, frame_data[LEGACY_FRAME_HEADER.size:], checksum)
+            if version != FRAME_VERSION:
+                raise ValueError(f"Unsupported frame version {version}")
+            
+            _, _, algorithm_id, accept_mask, destination, source = FRAME_HEADER.unpack_from(frame_data)
+            algorithm = ALGORITHMS_BY_ID.get(algorithm_id)
+            if algorithm is None:
+                raise ValueError(f"Unknown integrity algorithm {algorithm_id}")
+            data_start = FRAME_HEADER.size + algorithm.size
+            return Frame(bytes_to_mac(source), bytes_to_mac(destination), algorithm.name,
+                         mask_to_names(accept_mask), frame_data[data_start:],
+                         bytes(frame_data[FRAME_HEADER.size:data_start]))
+        
+        self.peer_format_seen(WIRE_FORMAT_JSON)
+        fields = json.loads(as_text(frame_data))
+        return Frame(fields['source_mac'], fields['destination_mac'],
+                     fields.get('integrity', LEGACY_INTEGRITY),
+                     set(fields.get('accept', (LEGACY_INTEGRITY,))),
+                     fields['data'], bytes.fromhex(fields['checksum']))
+    
+    def peek_frame_destination(self, frame_data):
+        """Destination MAC of a frame read from its header only, None if it cannot be found"""
+        if is_binary(frame_data, FRAME_MAGIC):
+            legacy = len(frame_data) > 1 and frame_data[1] == LEGACY_FRAME_VERSION
+            if len(frame_data) < (LEGACY_FRAME_HEADER if legacy else FRAME_HEADER).size:
+                return None
+            offset = 2 if legacy else 4
+            return bytes(frame_data[offset:offset + 6]).hex(':').upper()
+        
+        prefix = as_bytes(frame_data[:JSON_PEEK_LENGTH])
+        if not isinstance(prefix, bytes):
+            prefix = bytes(prefix)
+        start = prefix.find(JSON_DESTINATION_KEY)
+        if start < 0:
+            return None
+        start += len(JSON_DESTINATION_KEY)
+        return prefix[start:start + MAC_TEXT_LENGTH].decode(errors='replace')
+    
+    # Packets
+    
+    def encode_packet(self, packet):
+        if self.binary:
+            return self._buffers(packet)
+        
+        return json.dumps({
+            'source_ip': packet.source_ip,
+            'destination_ip': packet.destination_ip,
+            'ttl': packet.ttl,
+            'data': self._text(packet.data)
+        })
+    
+    def decode_packet(self, data):
+        if is_binary(data, PACKET_MAGIC):
+            _, source, destination, ttl = PACKET_HEADER.unpack_from(data)
+            return Packet(bytes_to_ip(source), bytes_to_ip(destination), ttl, data[PACKET_HEADER.size:])
+        
+        fields = json.loads(as_text(data))
+        return Packet(fields['source_ip'], fields['destination_ip'], fields['ttl'], fields['data'])
+    
+    # Segments
+    
+    def encode_segment(self, segment):
+        if self.binary:
+            return self._buffers(segment)
+        
+        return json.dumps({
+            'sequence': segment.sequence,
+            'ack': segment.ack,
+            'flags': {name: bool(segment.flags & bit) for name, bit in SEGMENT_FLAGS},
+            'window': segment.window,
+            'message': segment.message,
+            'data': self._text(segment.data)
+        })
+    
+    def decode_segment(self, data):
+        if is_binary(data, SEGMENT_MAGIC):
+            _, sequence, ack, flags, window, message = SEGMENT_HEADER.unpack_from(data)
+            segment = Segment(sequence, ack, flags, window, message, data[SEGMENT_HEADER.size:])
+        else:
+            fields = json.loads(as_text(data))
+            flags = 0
+            for name, bit in SEGMENT_FLAGS:
+                if fields['flags'].get(name):
+                    flags |= bit
+            segment = Segment(fields['sequence'], fields['ack'], flags, fields['window'],
+                              fields.get('message'), fields.get('data', ''))
+        
+        # Peers that predate piggybacked ACKs take any segment flagged ACK
+        # for a bare one and drop its data, see TransportLayer.send_to_network
+        if flags & FLAG_PIGGYBACK:
+            self.peer_piggyback_acks = True
+        return segment
+    
+    # Session envelopes
+    
+    def encode_envelope(self, envelope):
+        """A SessionEnvelope as a tuple of buffers (text in JSON) for the transport to cut.
+        
+        Peers that predate binary envelopes read JSON ones, so we only send
+        binary after the peer has said it reads them. Until then every JSON
+        envelope says that we do.
+        """
+        session_id = as_bytes(envelope.session_id or '')
+        if self.binary and self.peer_binary_envelopes and len(session_id) <= MAX_SESSION_ID_LENGTH:
+            fields = 0
+            for value, bit in ((envelope.seq, SESSION_SEQ), (envelope.window, SESSION_WINDOW),
+                               (envelope.grant, SESSION_GRANT), (envelope.data, SESSION_DATA)):
+                if value is not None:
+                    fields |= bit
+            if envelope.close:
+                fields |= SESSION_CLOSE
+            header = SESSION_HEADER.pack(
+                SESSION_MAGIC,
+                fields,
+                envelope.seq or 0,
+                envelope.window or 0,
+                envelope.grant or 0,
+                len(session_id)
+            ) + session_id
+            if envelope.data is None:
+                return (header,)
+            return (header, memoryview(as_bytes(envelope.data)))
+        
+        fields = {'session_id': envelope.session_id}
+        for key in ('data', 'seq', 'window', 'grant'):
+            value = getattr(envelope, key)
+            if value is not None:
+                fields[key] = as_text(value) if key == 'data' else value
+        if envelope.close:
+            fields['close'] = True
+        if self.binary:
+            fields['binary'] = True
+        text = json.dumps(fields)
+        return (memoryview(text.encode()),) if self.binary else (text,)
+    
+    def decode_envelope(self, data):
+        if is_binary(data, SESSION_MAGIC):
+            _, fields, seq, window, grant, id_length = SESSION_HEADER.unpack_from(data)
+            data_start = SESSION_HEADER.size + id_length
+            self.peer_binary_envelopes = True
+            return SessionEnvelope(
+                bytes(data[SESSION_HEADER.size:data_start]).decode() or None,
+                memoryview(data)[data_start:] if fields & SESSION_DATA else None,
+                seq if fields & SESSION_SEQ else None,
+                window if fields & SESSION_WINDOW else None,
+                grant if fields & SESSION_GRANT else None,
+                bool(fields & SESSION_CLOSE)
+            )
+        
+        fields = json.loads(as_text(data))
+        if fields.get('binary'):
+            self.peer_binary_envelopes = True
+        return SessionEnvelope(fields.get('session_id'), fields.get('data'), fields.get('seq'),
+                               fields.get('window'), fields.get('grant'), bool(fields.get('close')))
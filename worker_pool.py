@@ -0,0 +1,49 @@
+# worker_pool.py
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+WORKER_MODES = ('thread', 'process')
+
+class WorkerPool:
+    """Bounded pool that runs application handlers off the receive thread.
+    
+    'thread' suits handlers that wait on I/O, 'process' suits CPU-bound ones
+    (their handler and request must be picklable). At most max_workers
+    handlers run at once and max_queue more may wait; beyond that try_submit
+    refuses the request so the caller can answer with an overload response.
+    """
+    
+    def __init__(self, mode='thread', max_workers=4, max_queue=64):
+        if mode not in WORKER_MODES:
+            raise ValueError(f"Unknown worker mode: {mode}")
+        self.mode = mode
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        if mode == 'thread':
+            self.executor = ThreadPoolExecutor(max_workers, thread_name_prefix='handler')
+        else:
+            self.executor = ProcessPoolExecutor(max_workers)
+        self.in_flight = 0  # Running plus queued handlers
+        self.lock = threading.Lock()
+    
+    def try_submit(self, handler, request):
+        """Schedule handler(request), returns its Future or None if the pool is saturated"""
+        with self.lock:
+            if self.in_flight >= self.max_workers + self.max_queue:
+                return None
+            self.in_flight += 1
+        
+        try:
+            future = self.executor.submit(handler, request)
+        except Exception:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        return future
+    
+    def _release(self, _future):
+        with self.lock:
+            self.in_flight -= 1
+    
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)